@@ -0,0 +1,239 @@
+"""
+This code audits the Open Street Map data set in a single parse. Each audit is a visitor object that is
+ handed every parsed element, so counting tags, classifying keys, finding unique users and grouping
+ street types cost one pass over the file instead of one pass each. With approximate=True the users,
+ distinct keys and street types are estimated with the fixed-memory sketches of the sketches module,
+ which report their error bound and can be merged across extracts.
+"""
+
+import xml.etree.cElementTree as ET
+import pprint
+from collections import defaultdict
+
+import process_data
+from key_classifier import classify
+from osm_input import open_osm
+from sketches import HeavyHitters, HyperLogLog
+
+
+class TagCounter(object):
+    """
+    Counts how many times each tag is encountered in the map, like exercises/mapparser.count_tags
+    """
+    name = "tags"
+
+    def __init__(self):
+        self.tags = defaultdict(int)
+
+    def visit(self, element):
+        self.tags[element.tag] += 1
+
+    def report(self):
+        return dict(self.tags)
+
+
+class KeyTypeCounter(object):
+    """
+    Counts the "k" values of <tag> elements by category, like exercises/tags.key_type
+    """
+    name = "key_types"
+
+    def __init__(self):
+        self.keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+
+    def visit(self, element):
+        if element.tag == "tag":
+            self.keys[classify(element.attrib['k'])[0]] += 1
+
+    def report(self):
+        return dict(self.keys)
+
+
+class UserCollector(object):
+    """
+    Collects the unique user ids that contributed to the map, like exercises/users.process_map
+    """
+    name = "users"
+
+    def __init__(self):
+        self.users = set()
+
+    def visit(self, element):
+        uid = element.attrib.get('uid')
+        if uid is not None:
+            self.users.add(uid)
+
+    def report(self):
+        return self.users
+
+
+class StreetTypeCounter(object):
+    """
+    Groups the words of "addr:street" values by street type, like audit_sample.audit
+    """
+    name = "street_types"
+
+    def __init__(self):
+        self.street_types = defaultdict(int)
+
+    def visit(self, element):
+        if element.tag == "tag" and element.attrib['k'] == "addr:street":
+            for v in element.attrib['v'].split():
+                m = process_data.street_type_re.search(v)
+                if m:
+                    self.street_types[m.group()] += 1
+
+    def report(self):
+        return dict(self.street_types)
+
+
+class ApproximateUserCounter(object):
+    """
+    Estimates the number of unique user ids with a HyperLogLog sketch of fixed memory, see sketches
+    """
+    name = "users"
+
+    def __init__(self, precision=14):
+        self.sketch = HyperLogLog(precision)
+
+    def visit(self, element):
+        uid = element.attrib.get('uid')
+        if uid is not None:
+            self.sketch.add(uid)
+
+    def report(self):
+        return {"distinct": len(self.sketch), "error": self.sketch.error(), "sketch": self.sketch}
+
+
+class ApproximateKeyCounter(object):
+    """
+    Estimates the number of distinct "k" values of <tag> elements with a HyperLogLog sketch
+    """
+    name = "keys"
+
+    def __init__(self, precision=14):
+        self.sketch = HyperLogLog(precision)
+
+    def visit(self, element):
+        if element.tag == "tag":
+            self.sketch.add(element.attrib['k'])
+
+    def report(self):
+        return {"distinct": len(self.sketch), "error": self.sketch.error(), "sketch": self.sketch}
+
+
+class ApproximateStreetTypeCounter(object):
+    """
+    Finds the most common words of the "addr:street" values, like StreetTypeCounter, and the most common of
+    those that are not expected street types, with heavy hitters sketches of fixed memory, see sketches
+    """
+    name = "street_types"
+
+    def __init__(self, top=20, width=2048, depth=4):
+        self.street_types = HeavyHitters(top, width, depth)
+        self.unexpected = HeavyHitters(top, width, depth)
+        self.expected = set(process_data.expected)
+
+    def visit(self, element):
+        if element.tag == "tag" and element.attrib['k'] == "addr:street":
+            for v in element.attrib['v'].split():
+                m = process_data.street_type_re.search(v)
+                if m:
+                    street_type = m.group()
+                    self.street_types.add(street_type)
+                    if street_type not in self.expected:
+                        self.unexpected.add(street_type)
+
+    def report(self):
+        return {"top": self.street_types.most_common(), "unexpected": self.unexpected.most_common(),
+                "error": self.street_types.error_bound(), "sketch": self.street_types,
+                "unexpected_sketch": self.unexpected}
+
+
+def default_visitors():
+    return [TagCounter(), KeyTypeCounter(), UserCollector(), StreetTypeCounter()]
+
+
+def approximate_visitors():
+    """
+        This function returns the audits whose memory stays fixed on any input: the tag and key type counts,
+         which have a handful of distinct values, and the sketches of the users, keys and street types
+    """
+    return [TagCounter(), KeyTypeCounter(), ApproximateUserCounter(), ApproximateKeyCounter(),
+            ApproximateStreetTypeCounter()]
+
+
+def run_audit(file_in, visitors=None, approximate=False):
+    """
+        This function runs every visitor over the elements of the osm file in a single iterparse pass
+
+        Args:
+            file_in(str) : the first argument, the name of file to be audited, .gz and .bz2 files are
+                decompressed on the fly
+            visitors(list) : the second argument, the visitor objects, defaults to all of the audits
+            approximate(boolean) : the third argument, with value = True to default to the fixed memory
+                audits of approximate_visitors
+
+        Returns:
+            dict : the report of each visitor keyed by the visitor name
+
+    """
+    if visitors is None:
+        visitors = approximate_visitors() if approximate else default_visitors()
+    visits = [visitor.visit for visitor in visitors]
+    source = open_osm(file_in)
+    try:
+        context = iter(ET.iterparse(source, events=('start', 'end')))
+        _, root = next(context)
+        depth = 1
+        for event, element in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            for visit in visits:
+                visit(element)
+            # free top level elements once all visitors have seen them
+            if depth == 1:
+                root.clear()
+    finally:
+        source.close()
+    return dict((visitor.name, visitor.report()) for visitor in visitors)
+
+
+def test():
+    import sys
+    sys.path.insert(0, "exercises")
+    import mapparser
+    import tags
+    import users
+
+    for name in ("exercises/map.osm", "exercises/example.osm"):
+        report = run_audit(name)
+        assert report["tags"] == mapparser.count_tags(name)
+        assert report["key_types"] == tags.process_map(name)
+        assert report["users"] == users.process_map(name)
+
+    report = run_audit("exercises/example.osm")
+    pprint.pprint(report["street_types"])
+    assert report["street_types"] == {"Ave": 2, "Baldwin": 1, "Lexington": 1, "Lincoln": 2,
+                                       "N.": 1, "North": 1, "Rd.": 1, "St.": 1, "West": 1}
+    assert run_audit("exercises/map.osm", [TagCounter()]) == {"tags": mapparser.count_tags("exercises/map.osm")}
+
+    for name in ("exercises/map.osm", "exercises/example.osm"):
+        exact = run_audit(name)
+        report = run_audit(name, approximate=True)
+        assert report["tags"] == exact["tags"] and report["key_types"] == exact["key_types"]
+        # small inputs are counted exactly
+        assert report["users"]["distinct"] == len(exact["users"]) and report["users"]["error"] == 0
+        assert report["keys"]["distinct"] == len(set(el.attrib['k'] for _, el in ET.iterparse(name)
+                                                     if el.tag == "tag"))
+        exact = exact["street_types"]
+        report = report["street_types"]
+        assert report["top"] == sorted(exact.items(), key=lambda kv: (kv[1], kv[0]), reverse=True)[:20]
+        assert report["unexpected"] == [(street_type, count) for street_type, count in report["top"]
+                                        if street_type not in process_data.expected][:len(report["unexpected"])]
+
+
+if __name__ == "__main__":
+    test()
@@ -2,8 +2,9 @@
 import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
+from osm_input import open_osm
 
-osm_file = open("new-york_sample.osm", "r")
+osm_file = open_osm("new-york_sample.osm")
 
 street_type_re = re.compile(r'\S+\.?$', re.IGNORECASE)
 street_types = defaultdict(int)
@@ -0,0 +1,275 @@
+"""
+This code is the benchmark suite of the cleaning pipeline. It generates a synthetic osm file with
+ synthetic_osm, times process_data, shape_element, update_name, update_postcode, is_valid and prepare_sample
+ on it and measures the peak resident memory of each benchmark. Every benchmark runs in its own process,
+ as the peak memory of a process never goes down. The results are saved as json, so that the results of
+ two branches can be compared with --compare to catch regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from multiprocessing import Pipe, Process
+
+import prepare_sample
+import process_data
+import synthetic_osm
+
+BENCHMARKS = ("process_data", "shape_element", "update_name", "update_postcode", "is_valid", "prepare_sample")
+
+
+def peak_rss():
+    """
+        This function returns the peak resident memory of the current process in kB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_process_data(file_in, values):
+    file_out = "{0}.json".format(file_in)
+    try:
+        return process_data.process_data(file_in, stream=True)
+    finally:
+        os.remove(file_out)
+
+
+def bench_shape_element(file_in, values):
+    # the file is parsed before the timer starts, only shape_element is timed
+    elements = list(ET.parse(file_in).getroot())
+    start = time.time()
+    for element in elements:
+        process_data.shape_element(element)
+    return len(elements), time.time() - start
+
+
+def bench_update_name(file_in, values):
+    mapping = process_data.mapping
+    for name in values["street"]:
+        process_data.update_name(name, mapping)
+    return len(values["street"])
+
+
+def bench_update_postcode(file_in, values):
+    for postcode in values["postcode"]:
+        process_data.update_postcode(postcode)
+    return len(values["postcode"])
+
+
+def bench_is_valid(file_in, values):
+    elements = [ET.Element("tag", k=k, v=v) for k, v in values["tags"]]
+    start = time.time()
+    for element in elements:
+        process_data.is_valid(element)
+    return len(elements), time.time() - start
+
+
+def bench_prepare_sample(file_in, values):
+    sample_file = tempfile.mktemp(suffix=".osm")
+    try:
+        return prepare_sample.prepare_sample(file_in, sample_file, "every", k=10)
+    finally:
+        if os.path.exists(sample_file):
+            os.remove(sample_file)
+
+
+def run_child(conn, name, file_in, values):
+    start_rss = peak_rss()
+    start = time.time()
+    result = globals()["bench_" + name](file_in, values)
+    elapsed = time.time() - start
+    if isinstance(result, tuple):
+        # benchmarks with a setup step time themselves
+        result, elapsed = result
+    conn.send({"seconds": elapsed, "ops": result, "start_rss_kb": start_rss, "peak_rss_kb": peak_rss()})
+    conn.close()
+
+
+def run_benchmark(name, file_in, values, repeat=3):
+    """
+        This function runs one benchmark repeat times, each run in a new process
+
+        Args:
+            name(str) : first parameter, the name of the benchmark, one of BENCHMARKS
+            file_in(str) : second parameter, the name of the synthetic osm file
+            values(dict) : third parameter, the values of synthetic_osm.sample_values
+            repeat(int) : fourth parameter, the number of runs
+
+        Returns:
+            dict: the best time of the runs, the operations per second and the largest peak memory
+    """
+    runs = []
+    for _ in xrange(repeat):
+        parent, child = Pipe(False)
+        process = Process(target=run_child, args=(child, name, file_in, values))
+        process.start()
+        child.close()
+        try:
+            runs.append(parent.recv())
+        except EOFError:
+            raise RuntimeError("benchmark %s failed" % name)
+        finally:
+            process.join()
+    best = min(run["seconds"] for run in runs)
+    return {"seconds": best,
+            "runs": [run["seconds"] for run in runs],
+            "ops": runs[0]["ops"],
+            "ops_per_sec": runs[0]["ops"] / best if best else None,
+            "start_rss_kb": min(run["start_rss_kb"] for run in runs),
+            "peak_rss_kb": max(run["peak_rss_kb"] for run in runs)}
+
+
+def git_revision():
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(size=20 * 1000 * 1000, way_ratio=0.15, tags_per_element=1.0, abbreviation_rate=0.3,
+              postcodes=synthetic_osm.POSTCODES, values_count=200000, repeat=3, benchmarks=BENCHMARKS, seed=0):
+    """
+        This function generates the synthetic osm file and runs the benchmarks on it
+
+        Args:
+            size(int) : first parameter, the size of the synthetic osm file in bytes
+            way_ratio(float) : second parameter, the number of ways per node
+            tags_per_element(float) : third parameter, the mean number of tags of an element
+            abbreviation_rate(float) : fourth parameter, the share of abbreviated street types
+            postcodes(dict) : fifth parameter, the share of each postcode format
+            values_count(int) : sixth parameter, the number of values of the update_name, update_postcode
+             and is_valid benchmarks
+            repeat(int) : seventh parameter, the number of runs of each benchmark
+            benchmarks(tuple) : eighth parameter, the names of the benchmarks to run
+            seed(int) : ninth parameter, the random seed
+
+        Returns:
+            dict: the parameters of the run under "meta" and the result of each benchmark under "results"
+    """
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        counts = synthetic_osm.generate(file_in, size, way_ratio, tags_per_element, abbreviation_rate,
+                                        postcodes, seed=seed)
+        values = synthetic_osm.sample_values(values_count, abbreviation_rate, postcodes, seed)
+        meta = {"revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "size": os.path.getsize(file_in),
+                "nodes": counts["nodes"],
+                "ways": counts["ways"],
+                "way_ratio": way_ratio,
+                "tags_per_element": tags_per_element,
+                "abbreviation_rate": abbreviation_rate,
+                "postcodes": postcodes,
+                "values": values_count,
+                "repeat": repeat,
+                "seed": seed}
+        results = {}
+        for name in benchmarks:
+            results[name] = run_benchmark(name, file_in, values, repeat)
+            if name in ("process_data", "prepare_sample"):
+                results[name]["mb_per_sec"] = meta["size"] / 1e6 / results[name]["seconds"]
+        return {"meta": meta, "results": results}
+    finally:
+        os.remove(file_in)
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+        This function compares two benchmark reports
+
+        Args:
+            baseline(dict) : first parameter, the report of the reference branch
+            current(dict) : second parameter, the report of the branch checked
+            tolerance(float) : third parameter, the relative slowdown or memory growth allowed
+
+        Returns:
+            list: the (benchmark, metric, baseline, current) regressions found
+    """
+    regressions = []
+    for name, result in sorted(current["results"].items()):
+        if name not in baseline["results"]:
+            continue
+        reference = baseline["results"][name]
+        # time per operation, so that runs with other sizes can still be compared
+        before = reference["seconds"] / max(reference["ops"], 1)
+        after = result["seconds"] / max(result["ops"], 1)
+        if after > before * (1 + tolerance):
+            regressions.append((name, "seconds_per_op", before, after))
+        before = reference["peak_rss_kb"] - reference["start_rss_kb"]
+        after = result["peak_rss_kb"] - result["start_rss_kb"]
+        # growth below 1MB is noise
+        if after > before * (1 + tolerance) and after - before > 1024:
+            regressions.append((name, "rss_growth_kb", before, after))
+    return regressions
+
+
+def parse_postcodes(value):
+    shares = {}
+    for item in value.split(","):
+        kind, share = item.split("=")
+        shares[kind] = float(share)
+    return shares
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning pipeline on a synthetic osm file")
+    parser.add_argument("--size", type=float, default=20, help="size of the synthetic osm file in MB")
+    parser.add_argument("--way-ratio", type=float, default=0.15, help="number of ways per node")
+    parser.add_argument("--tags", type=float, default=1.0, help="mean number of tags per element")
+    parser.add_argument("--abbreviation-rate", type=float, default=0.3, help="share of abbreviated street types")
+    parser.add_argument("--postcodes", type=parse_postcodes, default=synthetic_osm.POSTCODES,
+                        help="share of each postcode format, e.g. valid=0.8,zip4=0.15,invalid=0.05")
+    parser.add_argument("--values", type=int, default=200000,
+                        help="number of values of the update_name, update_postcode and is_valid benchmarks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", action="append", choices=BENCHMARKS, help="run only this benchmark")
+    parser.add_argument("--output", default="benchmark.json", help="file the results are written to")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+    report = run_suite(int(args.size * 1000 * 1000), args.way_ratio, args.tags, args.abbreviation_rate,
+                       args.postcodes, args.values, args.repeat, tuple(args.only or BENCHMARKS), args.seed)
+    with open(args.output, "w") as fo:
+        json.dump(report, fo, indent=2, sort_keys=True)
+    for name in BENCHMARKS:
+        if name in report["results"]:
+            result = report["results"][name]
+            print "%-16s %8.3fs %12.0f ops/s %8d kB peak" % (name, result["seconds"], result["ops_per_sec"] or 0,
+                                                              result["peak_rss_kb"])
+    if args.compare:
+        with open(args.compare) as fi:
+            regressions = compare(json.load(fi), report, args.tolerance)
+        for name, metric, before, after in regressions:
+            print "REGRESSION %s %s: %.6g -> %.6g" % (name, metric, before, after)
+        return 1 if regressions else 0
+    return 0
+
+
+def test():
+    report = run_suite(size=300000, values_count=2000, repeat=1)
+    assert sorted(report["results"]) == sorted(BENCHMARKS)
+    elements = report["meta"]["nodes"] + report["meta"]["ways"]
+    assert report["results"]["process_data"]["ops"] == elements
+    assert report["results"]["shape_element"]["ops"] == elements
+    assert report["results"]["is_valid"]["ops"] == 2000
+    for result in report["results"].values():
+        assert result["peak_rss_kb"] >= result["start_rss_kb"] > 0
+    assert compare(report, report) == []
+    slower = json.loads(json.dumps(report))
+    slower["results"]["update_name"]["seconds"] *= 2
+    assert compare(report, slower) == [("update_name", "seconds_per_op", report["results"]["update_name"]["seconds"]
+                                        / 2000, slower["results"]["update_name"]["seconds"] / 2000)]
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
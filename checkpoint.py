@@ -0,0 +1,218 @@
+"""
+This code converts an osm file to json with periodic checkpoints, so that a run that crashes or is killed
+ can be resumed instead of started again from the first byte. The file is converted in segments of about
+ `interval` bytes cut on top level element boundaries. After each segment the json is flushed to disk and
+ the checkpoint records the input byte offset of the next segment, the output file position, the
+ counters and the output settings. A resumed run truncates the json back to the checkpoint position and parses on from the
+ recorded offset, so at most one segment is converted twice.
+"""
+
+import argparse
+import json
+import os
+
+import process_data
+from osm_input import is_compressed
+from process_parallel import ShardReader, find_body, find_boundary
+from sinks import JsonFileSink
+
+# default size of the segments between two checkpoints
+INTERVAL = 64 << 20
+
+
+def checkpoint_name(file_out):
+    return "{0}.checkpoint".format(file_out)
+
+
+def input_signature(file_in):
+    """
+        This function returns the size and modification time of the input, recorded to check that a
+         resumed run reads the same file
+    """
+    st = os.stat(file_in)
+    return {"size": st.st_size, "mtime": int(st.st_mtime)}
+
+
+def save_checkpoint(checkpoint_file, state):
+    """
+        This function writes the checkpoint to a temporary file and renames it, so that a crash while
+         saving leaves the previous checkpoint in place
+    """
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, "w") as fo:
+        json.dump(state, fo, indent=2, sort_keys=True)
+        fo.flush()
+        os.fsync(fo.fileno())
+    os.rename(tmp_file, checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file, file_in, settings):
+    """
+        This function reads the checkpoint of an interrupted run
+
+        Args:
+            checkpoint_file(str) : the first argument, the name of the checkpoint file
+            file_in(str) : the second argument, the name of the osm file being converted
+            settings(dict) : the third argument, the pretty, compact and backend values of the resumed run,
+                which must be those of the interrupted run so that the json is written in one format
+
+        Returns :
+            dict : the checkpoint, or None if there is none
+
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file) as fi:
+        state = json.load(fi)
+    if state["input_signature"] != input_signature(file_in):
+        raise ValueError("%s has changed since the checkpoint was written" % file_in)
+    if state.get("settings") != settings:
+        raise ValueError("the checkpoint was written with %s, not %s" % (state.get("settings"), settings))
+    return state
+
+
+def convert(file_in, file_out=None, pretty=False, compact=False, backend="etree", interval=INTERVAL,
+            resume=False):
+    """
+        This function converts the osm input file to json, saving a checkpoint after every segment
+
+        Args:
+            file_in(str) : the first argument, the name of the uncompressed osm file
+            file_out(str) : the second argument, the name of the json file, defaults to "<file_in>.json"
+            pretty(boolean) : the third argument, with value = False to indent the resulting json
+            compact(boolean) : the fourth argument, with value = True to write the json with compact keys
+            backend(str) : the fifth argument, the parse backend of process_data, "etree" or "expat"
+            interval(int) : the sixth argument, the number of input bytes between two checkpoints
+            resume(boolean) : the seventh argument, with value = True to continue from the checkpoint of
+                an interrupted run, a run without a checkpoint starts from the beginning
+
+        Returns :
+            int : the number of documents written
+
+    """
+    if is_compressed(file_in) or file_in.endswith(".pbf"):
+        # byte offsets of compressed input cannot be parsed from
+        raise ValueError("checkpoints need an uncompressed osm file: %s" % file_in)
+    file_out = file_out or "{0}.json".format(file_in)
+    if file_out.endswith(".gz"):
+        raise ValueError("a gzip stream cannot be truncated to a checkpoint: %s" % file_out)
+    checkpoint_file = checkpoint_name(file_out)
+    settings = {"pretty": pretty, "compact": compact, "backend": backend}
+    state = load_checkpoint(checkpoint_file, file_in, settings) if resume else None
+    with open(file_in, "rb") as fo:
+        start, end = find_body(fo)
+        if state is None:
+            state = {"input": file_in, "input_signature": input_signature(file_in), "output": file_out,
+                     "settings": settings, "offset": start, "output_position": 0, "count": 0, "types": {}}
+            open(file_out, "wb").close()
+        else:
+            # drop the documents written after the checkpoint
+            with open(file_out, "r+b") as output:
+                output.truncate(state["output_position"])
+        types = state["types"]
+        offset = state["offset"]
+        while offset < end:
+            segment_end = find_boundary(fo, min(offset + interval, end), end)
+            reader = ShardReader(file_in, offset, segment_end)
+            sink = JsonFileSink(file_out, pretty, compact, append=True)
+            try:
+                for el in process_data.iter_shaped(reader, backend=backend):
+                    sink.write(el)
+                    types[el["type"]] = types.get(el["type"], 0) + 1
+                sink.flush()
+                os.fsync(sink.fo.fileno())
+                state["output_position"] = sink.fo.tell()
+            finally:
+                reader.close()
+                sink.close()
+            state["count"] += sink.count
+            state["offset"] = offset = segment_end
+            save_checkpoint(checkpoint_file, state)
+    os.remove(checkpoint_file)
+    return state["count"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert an osm file to json with checkpoints")
+    parser.add_argument("file_in")
+    parser.add_argument("file_out", nargs="?")
+    parser.add_argument("--resume", action="store_true",
+                        help="truncate the json to the last checkpoint and continue from there")
+    parser.add_argument("--interval", type=float, default=INTERVAL / float(1 << 20),
+                        help="MB of input between two checkpoints")
+    parser.add_argument("--backend", choices=("etree", "expat"), default="etree")
+    parser.add_argument("--pretty", action="store_true")
+    parser.add_argument("--compact", action="store_true")
+    args = parser.parse_args(argv)
+    count = convert(args.file_in, args.file_out, args.pretty, args.compact, args.backend,
+                    int(args.interval * (1 << 20)), args.resume)
+    print "%d documents written" % count
+
+
+def test():
+    import tempfile
+    import synthetic_osm
+    file_in = tempfile.mktemp(suffix=".osm")
+    file_out = file_in + ".json"
+    try:
+        counts = synthetic_osm.generate(file_in, 1250000)
+        total = counts["nodes"] + counts["ways"]
+        process_data.process_data(file_in, stream=True)
+        with open(file_out, "rb") as fi:
+            expected = fi.read()
+        assert convert(file_in, interval=40000) == total
+        assert not os.path.exists(checkpoint_name(file_out))
+        with open(file_out, "rb") as fi:
+            assert fi.read() == expected
+
+        # kill the conversion in the middle of a segment
+        iter_shaped = process_data.iter_shaped
+
+        def crashing(*args, **kwargs):
+            for i, el in enumerate(iter_shaped(*args, **kwargs)):
+                if i == 150:
+                    raise KeyboardInterrupt
+                yield el
+        calls = []
+        process_data.iter_shaped = lambda *args, **kwargs: calls.append(1) or (
+            crashing(*args, **kwargs) if len(calls) == 4 else iter_shaped(*args, **kwargs))
+        try:
+            convert(file_in, interval=40000, compact=True)
+            assert False
+        except KeyboardInterrupt:
+            pass
+        finally:
+            process_data.iter_shaped = iter_shaped
+        with open(checkpoint_name(file_out)) as fi:
+            state = json.load(fi)
+        assert 0 < state["count"] == state["types"]["node"] < counts["nodes"]
+        assert os.path.getsize(file_out) > state["output_position"]
+        assert state["settings"] == {"pretty": False, "compact": True, "backend": "etree"}
+        size = os.path.getsize(file_out)
+        for settings in ({}, {"compact": True, "backend": "expat"}, {"compact": True, "pretty": True}):
+            try:
+                convert(file_in, interval=40000, resume=True, **settings)
+                assert False
+            except ValueError as e:
+                assert "checkpoint was written with" in str(e)
+        assert os.path.getsize(file_out) == size
+        assert convert(file_in, interval=40000, compact=True, resume=True) == total
+        assert convert(file_in, compact=True) == total
+        with open(file_out, "rb") as fi:
+            compact = fi.read()
+        convert(file_in, interval=40000, compact=True, resume=True)
+        with open(file_out, "rb") as fi:
+            assert fi.read() == compact
+        for name in ("exercises/example.osm", "exercises/map.osm"):
+            assert convert(name, file_out, interval=1000, backend="expat") == len(process_data.process_data(name))
+            with open(name + ".json", "rb") as fi, open(file_out, "rb") as fo:
+                assert fi.read() == fo.read()
+            os.remove(name + ".json")
+    finally:
+        for name in (file_in, file_out, checkpoint_name(file_out)):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+This code exports the node ids, coordinates, versions and timestamps of the osm file as typed columns.
+ Each column is streamed into an array and flushed to a .npy file, which numpy.load can memory-map, so
+ spatial analysis does not have to parse the json just to get the coordinates back.
+"""
+
+import array
+import calendar
+import os
+import struct
+import sys
+
+import process_data
+
+# column name, array type code
+COLUMNS = [("id", "l"), ("lat", "d"), ("lon", "d"), ("version", "l"), ("timestamp", "l")]
+
+# bytes reserved for the .npy header, enough for any shape
+HEADER_SIZE = 128
+
+# number of values buffered per column before they are flushed to disk
+CHUNK_SIZE = 65536
+
+
+def parse_timestamp(value):
+    """
+        This function converts an osm timestamp such as "2012-03-28T18:31:23Z" to seconds since the epoch
+
+        Args:
+            value(str) : first parameter, the timestamp
+
+        Returns:
+            int: the seconds since the epoch
+    """
+    return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19]), 0, 0, 0))
+
+
+def npy_descr(typecode):
+    """
+        This function returns the numpy dtype string of an array type code on this machine
+    """
+    kind = "f" if typecode == "d" else "i"
+    order = "<" if sys.byteorder == "little" else ">"
+    return "%s%s%d" % (order, kind, array.array(typecode).itemsize)
+
+
+def npy_header(typecode, length):
+    """
+        This function builds a version 1.0 .npy header of fixed size for a one dimensional column
+    """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (npy_descr(typecode), length)
+    header = header.ljust(HEADER_SIZE - 10 - 1) + "\n"
+    return "\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header
+
+
+class ColumnWriter(object):
+    """
+    Streams the values of one column into a .npy file, rewriting the header with the final length on close
+
+    Args:
+        file_out(str) : the name of the .npy file
+        typecode(str) : the array type code of the values
+    """
+
+    def __init__(self, file_out, typecode):
+        self.fo = open(file_out, "wb")
+        self.typecode = typecode
+        self.values = array.array(typecode)
+        self.length = 0
+        self.fo.write(npy_header(typecode, 0))
+
+    def flush(self):
+        self.values.tofile(self.fo)
+        self.length += len(self.values)
+        self.values = array.array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.fo.seek(0)
+        self.fo.write(npy_header(self.typecode, self.length))
+        self.fo.close()
+
+
+def export_columns(file_in, dir_out=None):
+    """
+        This function streams the nodes of the osm file into one .npy file per column
+
+        Args:
+            file_in(str) : the first argument, the name of file to be processed
+            dir_out(str) : the second argument, the directory of the columns, defaults to "<file_in>.columns"
+
+        Returns :
+            int : the number of nodes exported
+
+    """
+    dir_out = dir_out or "{0}.columns".format(file_in)
+    if not os.path.isdir(dir_out):
+        os.makedirs(dir_out)
+    writers = [ColumnWriter(os.path.join(dir_out, name + ".npy"), typecode) for name, typecode in COLUMNS]
+    ids, lats, lons, versions, timestamps = [writer.values for writer in writers]
+    count = 0
+    try:
+        for element in process_data.iter_elements(file_in, tags=('node',)):
+            attrib = element.attrib
+            ids.append(int(attrib["id"]))
+            lats.append(float(attrib["lat"]))
+            lons.append(float(attrib["lon"]))
+            versions.append(int(attrib.get("version", 0)))
+            timestamp = attrib.get("timestamp")
+            timestamps.append(parse_timestamp(timestamp) if timestamp else 0)
+            count += 1
+            if count % CHUNK_SIZE == 0:
+                for writer in writers:
+                    writer.flush()
+                ids, lats, lons, versions, timestamps = [writer.values for writer in writers]
+    finally:
+        for writer in writers:
+            writer.close()
+    return count
+
+
+def load_columns(dir_in, mmap=True):
+    """
+        This function loads the exported columns, memory-mapped with numpy when it is installed and as
+         arrays otherwise
+
+        Args:
+            dir_in(str) : the first argument, the directory of the columns
+            mmap(boolean) : the second argument, with value = True to memory-map the numpy arrays
+
+        Returns :
+            dict : the column of each name
+
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    columns = {}
+    for name, typecode in COLUMNS:
+        path = os.path.join(dir_in, name + ".npy")
+        if numpy is not None:
+            columns[name] = numpy.load(path, mmap_mode="r" if mmap else None)
+        else:
+            values = array.array(typecode)
+            with open(path, "rb") as fi:
+                fi.seek(HEADER_SIZE)
+                values.fromstring(fi.read())
+            columns[name] = values
+    return columns
+
+
+def test():
+    import shutil
+    import tempfile
+    dir_out = tempfile.mkdtemp()
+    try:
+        assert export_columns("exercises/example.osm", dir_out) == 23
+        columns = load_columns(dir_out)
+        assert list(columns["id"][:2]) == [261114295, 261114296]
+        assert list(columns["lat"][:1]) == [41.9730791]
+        assert list(columns["lon"][:1]) == [-87.6866303]
+        assert list(columns["version"][:1]) == [7]
+        assert list(columns["timestamp"][:1]) == [parse_timestamp("2012-03-28T18:31:23Z")]
+        assert parse_timestamp("1970-01-02T00:00:01Z") == 86401
+        with open(os.path.join(dir_out, "lat.npy"), "rb") as fi:
+            header = fi.read(HEADER_SIZE)
+        assert header.startswith("\x93NUMPY") and "'shape': (23,)" in header and header.endswith("\n")
+    finally:
+        shutil.rmtree(dir_out)
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,306 @@
+"""
+This code holds the shaped elements of process_data in a compact in-memory form. ElementList stores the
+ fixed fields of every element in typed arrays: the type, the id, the created version, changeset,
+ timestamp (parsed to seconds since the epoch) and uid as integers, the user as an index into a table of
+ interned names, pos as two doubles and the node_refs of all the ways as one flat integer array. The other
+ fields are kept as flat tuples of interned keys and values. An element is converted back to the dict of
+ process_data.shape_element only when it is read, and a value that would not convert back to the same
+ string, such as an id with a leading zero, is kept as it is.
+"""
+
+import array
+import time
+
+from columnar_export import parse_timestamp
+
+TYPES = ("node", "way")
+
+# bits of the flags of an element, set for the fields stored in the arrays
+HAS_ID, HAS_CREATED, HAS_VERSION, HAS_CHANGESET, HAS_TIMESTAMP, HAS_UID, HAS_USER, HAS_POS, HAS_REFS = \
+    [1 << bit for bit in range(9)]
+
+# integer fields of the created dictionary and their flags
+CREATED_FIELDS = {"version": HAS_VERSION, "changeset": HAS_CHANGESET, "uid": HAS_UID}
+
+# values up to this length are interned, longer ones are mostly unique
+INTERN_LENGTH = 32
+
+
+class Items(tuple):
+    """
+    Flat (key, value, key, value, ...) tuple standing for a nested dictionary such as "address"
+    """
+    __slots__ = ()
+
+
+def to_int(value):
+    """
+        This function returns the value as an integer if it converts back to the same string, else None
+    """
+    if type(value) is str and value.lstrip("-").isdigit():
+        number = int(value)
+        if str(number) == value:
+            return number
+    return None
+
+
+def format_timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def to_timestamp(value):
+    """
+        This function returns the timestamp in seconds if it converts back to the same string, else None
+    """
+    try:
+        seconds = parse_timestamp(value)
+    except (ValueError, TypeError):
+        return None
+    if format_timestamp(seconds) == value:
+        return seconds
+    return None
+
+
+class ElementList(object):
+    """
+    List of shaped elements stored in typed arrays, elements are appended as dictionaries and read back as
+    dictionaries equal to them
+
+    Args:
+        elements(iterable) : the shaped elements to be added
+    """
+
+    def __init__(self, elements=()):
+        self.types = array.array("B")
+        self.flags = array.array("H")
+        self.ids = array.array("l")
+        self.versions = array.array("l")
+        self.changesets = array.array("l")
+        self.timestamps = array.array("l")
+        self.uids = array.array("l")
+        self.users = array.array("l")
+        self.lats = array.array("d")
+        self.lons = array.array("d")
+        # node_refs of element i are refs[ref_starts[i]:ref_starts[i + 1]]
+        self.ref_starts = array.array("l", [0])
+        self.refs = array.array("l")
+        self.extras = []
+        self.strings = {}
+        self.user_names = []
+        self.user_index = {}
+        for el in elements:
+            self.append(el)
+
+    def intern(self, value):
+        if isinstance(value, basestring) and len(value) <= INTERN_LENGTH:
+            # str and unicode values are equal for ascii text, the type is part of the key
+            return self.strings.setdefault((type(value), value), value)
+        if isinstance(value, dict):
+            return self.pack_items(value)
+        return value
+
+    def pack_items(self, fields, skip=()):
+        items = []
+        for k, v in fields.iteritems():
+            if k not in skip:
+                items.append(self.intern(k))
+                items.append(self.intern(v))
+        return Items(items)
+
+    def append(self, el):
+        """
+            This function adds a shaped element to the list
+
+            Args:
+                el(dict) : first parameter, the dictionary of process_data.shape_element
+        """
+        flags = 0
+        skip = set()
+        # a "type" tag replaces the element type, see process_data.shape_tag, and is kept with the other fields
+        type_code = TYPES.index(el["type"]) if el.get("type") in TYPES else len(TYPES)
+        if type_code < len(TYPES):
+            skip.add("type")
+        values = dict.fromkeys(("id", "version", "changeset", "timestamp", "uid", "user"), 0)
+        element_id = to_int(el.get("id"))
+        if element_id is not None:
+            flags |= HAS_ID
+            values["id"] = element_id
+            skip.add("id")
+        created = el.get("created")
+        created_extra = None
+        if type(created) is dict:
+            flags |= HAS_CREATED
+            skip.add("created")
+            rest = {}
+            for k, v in created.iteritems():
+                number = None
+                if k in CREATED_FIELDS:
+                    number = to_int(v)
+                elif k == "timestamp":
+                    number = to_timestamp(v)
+                if number is not None:
+                    flags |= CREATED_FIELDS.get(k, HAS_TIMESTAMP)
+                    values[k] = number
+                elif k == "user" and isinstance(v, basestring):
+                    flags |= HAS_USER
+                    if v not in self.user_index:
+                        self.user_index[v] = len(self.user_names)
+                        self.user_names.append(v)
+                    values[k] = self.user_index[v]
+                else:
+                    rest[k] = v
+            if rest:
+                created_extra = self.pack_items(rest)
+        pos = el.get("pos")
+        lat = lon = 0.0
+        if type(pos) is list and len(pos) == 2 and type(pos[0]) is float and type(pos[1]) is float:
+            flags |= HAS_POS
+            skip.add("pos")
+            lat, lon = pos
+        refs = el.get("node_refs")
+        if type(refs) is list:
+            numbers = [to_int(ref) for ref in refs]
+            if None not in numbers:
+                flags |= HAS_REFS
+                skip.add("node_refs")
+                self.refs.extend(numbers)
+        extra = self.pack_items(el, skip)
+        if created_extra is not None:
+            extra = Items(extra + ("created", created_extra))
+        self.types.append(type_code)
+        self.flags.append(flags)
+        self.ids.append(values["id"])
+        self.versions.append(values["version"])
+        self.changesets.append(values["changeset"])
+        self.timestamps.append(values["timestamp"])
+        self.uids.append(values["uid"])
+        self.users.append(values["user"])
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.ref_starts.append(len(self.refs))
+        self.extras.append(extra or None)
+
+    def extend(self, elements):
+        for el in elements:
+            self.append(el)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        """
+            This function converts one element back to its dictionary
+
+            Args:
+                i(int) : first parameter, the index of the element
+
+            Returns:
+                dict: the dictionary of process_data.shape_element
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("element index out of range")
+        flags = self.flags[i]
+        el = {}
+        if self.types[i] < len(TYPES):
+            el["type"] = TYPES[self.types[i]]
+        if flags & HAS_ID:
+            el["id"] = str(self.ids[i])
+        if flags & HAS_CREATED:
+            created = {}
+            if flags & HAS_VERSION:
+                created["version"] = str(self.versions[i])
+            if flags & HAS_CHANGESET:
+                created["changeset"] = str(self.changesets[i])
+            if flags & HAS_TIMESTAMP:
+                created["timestamp"] = format_timestamp(self.timestamps[i])
+            if flags & HAS_UID:
+                created["uid"] = str(self.uids[i])
+            if flags & HAS_USER:
+                created["user"] = self.user_names[self.users[i]]
+            el["created"] = created
+        if flags & HAS_POS:
+            el["pos"] = [self.lats[i], self.lons[i]]
+        if flags & HAS_REFS:
+            el["node_refs"] = [str(ref) for ref in self.refs[self.ref_starts[i]:self.ref_starts[i + 1]]]
+        extra = self.extras[i]
+        if extra is not None:
+            for k, v in unpack_items(extra).iteritems():
+                if k == "created" and type(v) is dict and "created" in el:
+                    el["created"].update(v)
+                else:
+                    el[k] = v
+        return el
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def to_list(self):
+        return list(self)
+
+
+def unpack_items(items):
+    fields = {}
+    for j in xrange(0, len(items), 2):
+        v = items[j + 1]
+        fields[items[j]] = unpack_items(v) if type(v) is Items else v
+    return fields
+
+
+def deep_size(obj, seen=None):
+    """
+        This function returns the bytes taken by the object and everything it references
+    """
+    import sys
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif isinstance(obj, ElementList):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+def test():
+    import os
+    import tempfile
+    import process_data
+    import synthetic_osm
+    for name in ("exercises/example.osm", "exercises/map.osm"):
+        data = process_data.process_data(name)
+        with open(name + ".json", "rb") as fi:
+            expected = fi.read()
+        records = process_data.process_data(name, records=True)
+        with open(name + ".json", "rb") as fi:
+            assert fi.read() == expected
+        os.remove(name + ".json")
+        assert len(records) == len(data) and list(records) == data and records[-1] == data[-1]
+    odd = [{"type": "node", "id": "007", "pos": [1.5, 1.5], "created": {"version": "x", "timestamp": "yesterday",
+                                                                     "user": u"caf\xe9"}},
+           {"type": "way", "id": "-3", "node_refs": ["1", "02"], "created": "tag value", "geometry": [[1.0, 2.0]],
+            "address": {"street": "Main Street"}, "building": {"levels": "2", "building": "yes"}},
+           {"type": "multipolygon", "id": "4"}]
+    assert list(ElementList(odd)) == odd
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        synthetic_osm.generate(file_in, 2000000, way_ratio=0.2)
+        data = list(process_data.iter_shaped(file_in))
+        records = ElementList(data)
+        assert list(records) == data
+        ratio = deep_size(data) / float(deep_size(records))
+        print "%d elements: dicts %d bytes, records %d bytes, %.1fx smaller" % (
+            len(data), deep_size(data), deep_size(records), ratio)
+        assert ratio > 3
+    finally:
+        os.remove(file_in)
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,218 @@
+"""
+This code builds a sidecar index of an osm file mapping element type and id to the byte offset and length
+ of the element in the file, so that a single node, way or relation can be fetched to debug a cleaning
+ problem without parsing the whole file. The index is built in one scan of the memory-mapped file and
+ stored as fixed-width records sorted by type and id, which are binary searched on lookup.
+"""
+
+import array
+import mmap
+import os
+import re
+import struct
+import xml.etree.cElementTree as ET
+
+import process_data
+from osm_input import is_compressed
+
+# index record: type code, element length, element id, element offset
+RECORD = struct.Struct("<B3xIqq")
+
+TYPE_CODES = {"node": 0, "way": 1, "relation": 2}
+
+# regular expressions for the start tag of a top level element and its id attribute, quoted with double
+# quotes or with the single quotes JOSM writes
+start_tag_re = re.compile(r'<(node|way|relation)\s[^>]*>')
+id_re = re.compile(r'\sid=(["\'])(-?\d+)\1')
+
+
+def build_index(file_in, index_file=None):
+    """
+        This function scans the osm file once and writes the sorted index of its elements
+
+        Args:
+            file_in(str) : the first argument, the name of the osm file
+            index_file(str) : the second argument, the name of the index, defaults to "<file_in>.idx"
+
+        Returns:
+            int : the number of elements indexed
+
+    """
+    if is_compressed(file_in):
+        raise ValueError("byte offsets need an uncompressed osm file: %s" % file_in)
+    index_file = index_file or "{0}.idx".format(file_in)
+    # one array per field, 25 bytes per element instead of a tuple of Python integers
+    types, ids, offsets, lengths = array.array("B"), array.array("l"), array.array("l"), array.array("l")
+    in_order = True
+    last = None
+    with open(file_in, "rb") as fi:
+        data = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = 0
+            search = start_tag_re.search
+            while True:
+                m = search(data, pos)
+                if not m:
+                    break
+                tag = m.group(1)
+                start_tag = m.group()
+                if start_tag.endswith("/>"):
+                    end = m.end()
+                else:
+                    end = data.find("</%s>" % tag, m.end())
+                    if end == -1:
+                        raise ValueError("<%s> element at byte %d is not closed" % (tag, m.start()))
+                    end += len(tag) + 3
+                id_match = id_re.search(start_tag)
+                if not id_match:
+                    raise ValueError("<%s> element at byte %d has no id" % (tag, m.start()))
+                key = (TYPE_CODES[tag], int(id_match.group(2)))
+                if last is not None and key < last:
+                    in_order = False
+                last = key
+                types.append(key[0])
+                ids.append(key[1])
+                offsets.append(m.start())
+                lengths.append(end - m.start())
+                pos = end
+        finally:
+            data.close()
+    order = xrange(len(ids))
+    if not in_order:
+        # osm files are sorted by type and id, other files are sorted here
+        order = sorted(order, key=lambda i: (types[i], ids[i]))
+    pack = RECORD.pack
+    with open(index_file, "wb") as fo:
+        for i in order:
+            fo.write(pack(types[i], lengths[i], ids[i], offsets[i]))
+    return len(ids)
+
+
+class ElementIndex(object):
+    """
+    Random access to the elements of an osm file through its sidecar index
+
+    Args:
+        file_in(str) : the name of the osm file
+        index_file(str) : the name of the index, defaults to "<file_in>.idx", built if it does not exist
+    """
+
+    def __init__(self, file_in, index_file=None):
+        self.file_in = file_in
+        index_file = index_file or "{0}.idx".format(file_in)
+        if not os.path.exists(index_file):
+            build_index(file_in, index_file)
+        self.index = open(index_file, "rb")
+        self.size = os.path.getsize(index_file) // RECORD.size
+        self.map = mmap.mmap(self.index.fileno(), 0, access=mmap.ACCESS_READ) if self.size else ""
+        self.osm = open(file_in, "rb")
+
+    def locate(self, tag, element_id):
+        """
+            This function looks up the byte range of an element
+
+            Args:
+                tag(str) : first parameter, "node", "way" or "relation"
+                element_id(str) : second parameter, the id of the element
+
+            Returns:
+                tuple: the offset and length of the element, or None if it is not in the file
+        """
+        key = (TYPE_CODES[tag], int(element_id))
+        unpack_from = RECORD.unpack_from
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            type_code, length, record_id, offset = unpack_from(self.map, mid * RECORD.size)
+            if (type_code, record_id) < key:
+                lo = mid + 1
+            elif (type_code, record_id) > key:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def get(self, tag, element_id):
+        """
+            This function reads and parses one element
+
+            Returns:
+                element: the parsed element, or None if it is not in the file
+        """
+        location = self.locate(tag, element_id)
+        if location is None:
+            return None
+        offset, length = location
+        self.osm.seek(offset)
+        return ET.fromstring(self.osm.read(length))
+
+    def shape(self, tag, element_id):
+        """
+            This function reads one element and shapes it with process_data.shape_element
+
+            Returns:
+                dict: the shaped element, or None if it is not in the file
+        """
+        element = self.get(tag, element_id)
+        if element is None:
+            return None
+        return process_data.shape_element(element)
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.index.close()
+        self.osm.close()
+
+
+def test():
+    import time
+    for file_in in ("exercises/example.osm", "exercises/map.osm"):
+        index_file = file_in + ".idx"
+        try:
+            count = sum(1 for _ in process_data.iter_elements(file_in))
+            assert build_index(file_in) == count
+            index = ElementIndex(file_in)
+            assert len(index) == count
+            shaped = process_data.process_data(file_in)
+            os.remove(file_in + ".json")
+            for el in shaped:
+                assert index.shape(el["type"], el["id"]) == el
+            assert index.get("node", "1") is None
+            start = time.time()
+            index.shape(shaped[-1]["type"], shaped[-1]["id"])
+            assert time.time() - start < 0.05
+            index.close()
+        finally:
+            os.remove(index_file)
+
+    import tempfile
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        with open(file_in, "w") as fo:
+            fo.write("<osm version='0.6'>\n <node id='2' lat='1.5' lon='2.5'/>\n"
+                     " <way id='1'>\n  <nd ref='2'/>\n  <tag k='highway' v='service'/>\n </way>\n</osm>\n")
+        assert build_index(file_in) == 2
+        index = ElementIndex(file_in)
+        assert index.shape("node", "2")["pos"] == [1.5, 2.5]
+        assert index.shape("way", "1")["node_refs"] == ["2"]
+        index.close()
+        for broken in ('<osm><node id="1" lat="1" lon="1"><tag k="a" v="b"/>', '<osm><node lat="1" lon="1"/></osm>'):
+            with open(file_in, "w") as fo:
+                fo.write(broken)
+            try:
+                build_index(file_in)
+                assert False
+            except ValueError as e:
+                assert "byte 5" in str(e)
+    finally:
+        for name in (file_in, file_in + ".idx"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    test()
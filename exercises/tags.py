@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import xml.etree.cElementTree as ET
+import os
 import pprint
 import re
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from key_classifier import classify
 """
 Your task is to explore the data a bit more.
 Before you process the data and add it into your database, you should check the
@@ -35,27 +39,9 @@ problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 def key_type(element, keys):
     #find keys for <tag> elements to match regular expressions defined above
     if element.tag == "tag":
-        # for lower case  characters
-        l=lower.search(element.attrib['k'])
-        # for lower case contain colon
-        lc=lower_colon.search(element.attrib['k'])
-        # for problem characters
-        pc=problemchars.search(element.attrib['k'])
-        #increment count for corresponding regular expression if match is found
-
-        if l:
-            keys["lower"]+=1
-            pass
-        elif lc:
-            keys["lower_colon"]+=1
-            pass
-        elif pc:
-            keys["problemchars"]+=1
-            pass
-        #if no match is found
-        else:
-            keys["other"]+=1
-            pass
+        # the category of each distinct key is computed once by the shared key classifier
+        # with the same regular expressions as above and cached
+        keys[classify(element.attrib['k'])[0]] += 1
     return keys
 
 
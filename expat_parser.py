@@ -0,0 +1,160 @@
+"""
+This code is a parse backend for process_data built directly on pyexpat. The start/end callbacks collect
+ the attributes, node refs and tags of each node/way and shape them with process_data.shape_parts, the
+ helper of process_data.shape_element, so no ElementTree element is built for the <node>, <way>, <nd> and
+ <tag> tags and the output is identical.
+"""
+
+import re
+import xml.parsers.expat
+
+import process_data
+from osm_input import open_osm
+
+# size of the blocks fed to the parser
+BLOCK_SIZE = 1 << 16
+
+# regular expression for non ascii characters
+non_ascii_re = re.compile(r'[^\x00-\x7f]')
+
+
+def as_text(value):
+    """
+        This function returns the value the way ElementTree returns attribute values, a str for ascii
+         text and a unicode string otherwise
+    """
+    if non_ascii_re.search(value):
+        return value.decode("utf-8")
+    return value
+
+
+class RecordHandler(object):
+    """
+    Expat callbacks collecting the nodes and ways of the osm file as (tag, attributes, node refs, tags)
+    records, with the values converted like ElementTree does, in `records` until the caller takes them
+    """
+
+    def __init__(self):
+        self.records = []
+        self.record = None
+
+    def start(self, name, attrs):
+        if name == "node" or name == "way":
+            self.record = (name, dict((k, as_text(v)) for k, v in attrs.iteritems()), [], [])
+        elif self.record is not None:
+            if name == "nd":
+                self.record[2].append(as_text(attrs["ref"]))
+            else:
+                self.record[3].append((as_text(attrs["k"]), as_text(attrs["v"])))
+
+    def end(self, name):
+        if (name == "node" or name == "way") and self.record is not None:
+            self.records.append(self.record)
+            self.record = None
+
+
+class ShapeHandler(RecordHandler):
+    """
+    Expat callbacks shaping the nodes and ways of the osm file with process_data.shape_parts, the finished
+    dictionaries are collected in `records` until the caller takes them
+
+    Args:
+        clean(function) : the function cleaning the address values, see process_data.shape_tag
+    """
+
+    def __init__(self, clean=process_data.clean_address):
+        RecordHandler.__init__(self)
+        self.clean = clean
+
+    def end(self, name):
+        if (name == "node" or name == "way") and self.record is not None:
+            tag, attrib, node_refs, tags = self.record
+            self.records.append(process_data.shape_parts(tag, attrib, node_refs, tags, self.clean))
+            self.record = None
+
+
+def iter_shaped(file_in, stats=None):
+    """
+        This function streams the shaped elements of the osm file, parsed with pyexpat
+
+        Args:
+            file_in(str) : the first argument, the name (or file object) of the file to be processed
+            stats : the second argument, an instrumentation.Stats counting the bytes read and timing the
+                clean_address stage
+
+        Returns :
+            generator : the shaped node/way dictionaries
+
+    """
+    clean = process_data.clean_address
+    if stats is not None:
+        clean = stats.timed("clean_address", clean)
+    handler = ShapeHandler(clean)
+    parser = xml.parsers.expat.ParserCreate()
+    # utf-8 encoded str values, converted like ElementTree does by as_text
+    parser.returns_unicode = False
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    opened = isinstance(file_in, basestring)
+    source = open_osm(file_in) if opened else file_in
+    if stats is not None:
+        source = stats.reader(source)
+    try:
+        while True:
+            data = source.read(BLOCK_SIZE)
+            parser.Parse(data, not data)
+            if handler.records:
+                for el in handler.records:
+                    yield el
+                handler.records = []
+            if not data:
+                return
+    finally:
+        if opened:
+            source.close()
+
+
+def benchmark(file_in):
+    """
+        This function times both parse backends of process_data on the same file and checks that their
+         output is identical
+
+        Args:
+            file_in(str) : the first argument, the name of the osm file
+
+        Returns :
+            dict : the seconds taken by each backend and the speedup of expat
+
+    """
+    import time
+    start = time.time()
+    etree = list(process_data.iter_shaped(file_in, backend="etree"))
+    etree_time = time.time() - start
+    start = time.time()
+    expat = list(process_data.iter_shaped(file_in, backend="expat"))
+    expat_time = time.time() - start
+    assert etree == expat
+    return {"etree": etree_time, "expat": expat_time, "speedup": etree_time / expat_time}
+
+
+def test():
+    import os
+    import tempfile
+    from StringIO import StringIO
+    import synthetic_osm
+    for name in ("exercises/example.osm", "exercises/map.osm"):
+        assert list(iter_shaped(name)) == list(process_data.iter_shaped(name))
+    osm = ('<osm><node id="1" lat="1" lon="2" user="\xc3\xa9"><tag k="name" v="caf\xc3\xa9"/>'
+           '<tag k="addr:street" v="Main St"/><tag k="building" v="yes"/><tag k="building:levels" v="2"/></node>'
+           '<relation id="2"><tag k="type" v="route"/></relation><way id="3"><nd ref="1"/></way></osm>')
+    assert list(iter_shaped(StringIO(osm))) == list(process_data.iter_shaped(StringIO(osm)))
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        synthetic_osm.generate(file_in, 5000000)
+        print benchmark(file_in)
+    finally:
+        os.remove(file_in)
+
+
+if __name__ == "__main__":
+    test()
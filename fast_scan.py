@@ -0,0 +1,237 @@
+"""
+This code answers the questions that do not need the parsed elements, the number of each tag, the unique
+ user ids and the histogram of the tag keys, by scanning the memory-mapped osm file with compiled regular
+ expressions. The patterns run over the mapped bytes in windows ending on a '<', so nothing is copied but
+ the matched names and no element is built. The scan relies on the osm file layout: attributes quoted
+ with double quotes and no comments or CDATA sections holding markup. It does not read compressed files.
+"""
+
+import argparse
+import mmap
+import os
+import pprint
+import re
+
+from expat_parser import as_text
+from key_classifier import classify
+from osm_input import is_compressed
+
+# regular expressions for the name of a start tag, the uid attribute and the k attribute of a <tag>, no
+# other osm attribute ends in uid and a double quoted value cannot hold 'uid="', so the literal start of
+# uid_re is enough and lets the scan skip ahead to it
+start_tag_re = re.compile(r'<([^\s/>!?]+)')
+uid_re = re.compile(r'uid="([^"]*)"')
+key_re = re.compile(r'<tag\s(?:[^>]*?\s)?k="([^"]*)"')
+
+# regular expression for the references an xml parser replaces in attribute values
+reference_re = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|lt|gt|amp|quot|apos);')
+
+ENTITIES = {"lt": u"<", "gt": u">", "amp": u"&", "quot": u'"', "apos": u"'"}
+
+# bytes scanned by one call of a pattern, the matches of a window are held at once
+WINDOW_SIZE = 16 << 20
+
+
+def replace_reference(m):
+    name = m.group(1)
+    if name.startswith("#x"):
+        return unichr(int(name[2:], 16))
+    if name.startswith("#"):
+        return unichr(int(name[1:]))
+    return ENTITIES[name]
+
+
+def unescape(value):
+    """
+        This function returns the raw attribute value the way ElementTree returns it, with the white space
+         normalized, the references replaced and as a str for ascii text or a unicode string otherwise
+    """
+    if "\t" in value or "\n" in value or "\r" in value:
+        value = value.replace("\r\n", " ").replace("\t", " ").replace("\n", " ").replace("\r", " ")
+    if "&" in value:
+        value = reference_re.sub(replace_reference, value.decode("utf-8"))
+        try:
+            return value.encode("ascii")
+        except UnicodeEncodeError:
+            return value
+    return as_text(value)
+
+
+def iter_windows(data, window_size=WINDOW_SIZE):
+    """
+        This function splits the mapped file into (start, end) windows ending on a '<', so that no match of
+         the scan patterns, which never span a '<', is cut
+    """
+    start = 0
+    size = len(data)
+    while start < size:
+        end = data.find("<", start + window_size) if start + window_size < size else -1
+        if end == -1:
+            end = size
+        yield start, end
+        start = end
+
+
+def scan(file_in, scan_data):
+    """
+        This function maps the osm file in memory and scans it
+
+        Args:
+            file_in(str) : first parameter, the name of the uncompressed osm file
+            scan_data(function) : second parameter, called with the mapped file, its result is returned
+
+        Returns:
+            the result of scan_data
+    """
+    if is_compressed(file_in):
+        raise ValueError("fast scan needs an uncompressed osm file: %s" % file_in)
+    with open(file_in, "rb") as fi:
+        if os.fstat(fi.fileno()).st_size == 0:
+            return scan_data("")
+        data = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return scan_data(data)
+        finally:
+            data.close()
+
+
+def count_names(pattern, data):
+    counts = {}
+    get = counts.get
+    for start, end in iter_windows(data):
+        for name in pattern.findall(data, start, end):
+            counts[name] = get(name, 0) + 1
+    return counts
+
+
+def count_tags(file_in):
+    """
+        This function counts the elements of each tag, like exercises/mapparser.count_tags
+
+        Args:
+            file_in(str) : first parameter, the name of the uncompressed osm file
+
+        Returns:
+            dict: the number of elements of each tag
+    """
+    return scan(file_in, lambda data: count_names(start_tag_re, data))
+
+
+def unique_users(file_in):
+    """
+        This function finds the unique user ids, like exercises/users.process_map
+
+        Args:
+            file_in(str) : first parameter, the name of the uncompressed osm file
+
+        Returns:
+            set: the uid values
+    """
+    def scan_users(data):
+        users = set()
+        for start, end in iter_windows(data):
+            users.update(uid_re.findall(data, start, end))
+        return set(unescape(uid) for uid in users)
+    return scan(file_in, scan_users)
+
+
+def key_histogram(file_in):
+    """
+        This function counts the <tag> elements of each key
+
+        Args:
+            file_in(str) : first parameter, the name of the uncompressed osm file
+
+        Returns:
+            dict: the number of tags of each "k" value
+    """
+    histogram = {}
+    for k, count in scan(file_in, lambda data: count_names(key_re, data)).iteritems():
+        k = unescape(k)
+        histogram[k] = histogram.get(k, 0) + count
+    return histogram
+
+
+def key_types(histogram):
+    """
+        This function counts the keys of each category of the key classifier, like
+         exercises/tags.process_map, from the histogram of key_histogram
+    """
+    keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+    for k, count in histogram.iteritems():
+        keys[classify(k)[0]] += count
+    return keys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count the tags, users and keys of an osm file without parsing it")
+    parser.add_argument("file_in")
+    parser.add_argument("--tags", action="store_true", help="count the elements of each tag")
+    parser.add_argument("--users", action="store_true", help="count the unique user ids")
+    parser.add_argument("--keys", action="store_true", help="count the tags of each key")
+    args = parser.parse_args(argv)
+    everything = not (args.tags or args.users or args.keys)
+    if args.tags or everything:
+        pprint.pprint(count_tags(args.file_in))
+    if args.users or everything:
+        print "%d unique users" % len(unique_users(args.file_in))
+    if args.keys or everything:
+        histogram = key_histogram(args.file_in)
+        pprint.pprint(key_types(histogram))
+        pprint.pprint(sorted(histogram.iteritems(), key=lambda kv: kv[1], reverse=True)[:20])
+
+
+def test():
+    import sys
+    import tempfile
+    import time
+    import xml.etree.cElementTree as ET
+    sys.path.insert(0, "exercises")
+    import mapparser
+    import tags
+    import users
+
+    def iterparse_histogram(name):
+        histogram = {}
+        for _, element in ET.iterparse(name):
+            if element.tag == "tag":
+                k = element.attrib["k"]
+                histogram[k] = histogram.get(k, 0) + 1
+        return histogram
+
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        with open(file_in, "w") as fo:
+            fo.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE osm>\n<osm version="0.6">\n'
+                     ' <node id="1" lat="1" lon="1" uid="7"><tag v="x" k="name"/><tag k="a&amp;b" v="1"/>'
+                     '<tag k="caf\xc3\xa9" v="1"/><tag k="a\tb&#233;" v="2"/></node>\n'
+                     ' <way id="2"\n  uid="8"><nd ref="1"/><tag k="name" v="a uid=&quot;9&quot;"/></way>\n'
+                     ' <relation id="3" uid="7"><member type="way" ref="2" role=""/></relation>\n</osm>\n')
+        for name in (file_in, "exercises/example.osm", "exercises/map.osm"):
+            assert count_tags(name) == mapparser.count_tags(name), name
+            assert unique_users(name) == users.process_map(name), name
+            histogram = key_histogram(name)
+            assert histogram == iterparse_histogram(name), name
+            assert key_types(histogram) == tags.process_map(name), name
+        assert key_histogram(file_in)[u"a b\xe9"] == 1
+
+        with open(file_in, "w") as fo:
+            pass
+        assert count_tags(file_in) == {} and unique_users(file_in) == set()
+
+        import synthetic_osm
+        synthetic_osm.generate(file_in, 20000000)
+        for fast, slow in ((count_tags, mapparser.count_tags), (unique_users, users.process_map),
+                           (key_histogram, iterparse_histogram)):
+            start = time.time()
+            expected = slow(file_in)
+            slow_time = time.time() - start
+            start = time.time()
+            assert fast(file_in) == expected
+            print "%s: iterparse %.2fs, fast scan %.2fs" % (fast.__name__, slow_time, time.time() - start)
+    finally:
+        os.remove(file_in)
+
+
+if __name__ == "__main__":
+    main()
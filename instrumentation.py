@@ -0,0 +1,270 @@
+"""
+This code instruments a process_data run. The Stats object is passed down the run, to iter_shaped and
+ the JsonFileSink it writes to, which wrap the parse, shape_element, clean_address, json_encode and write
+ stages of that run with counters and timers, so other conversions in the same process are not counted.
+ Periodic progress lines give the elements per second, the bytes consumed and an ETA, and a json report
+ of the stages is written at the end. One stage can also be profiled with cProfile. Nothing is wrapped
+ when no Stats object is passed, so an uninstrumented run pays nothing.
+
+ The stage times are inclusive: shape_element includes clean_address and write includes json_encode. The
+ pbf workers time their own stages and send the totals back with their elements, so for .pbf input the
+ times are summed over the workers and can add up to more than the wall time.
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import sys
+import time
+
+import process_data
+from osm_input import is_compressed
+
+STAGES = ("parse", "shape_element", "clean_address", "json_encode", "write")
+
+
+class CountingReader(object):
+    """
+    File wrapper counting the bytes read from the osm input
+
+    Args:
+        source : the file object read by the parser
+        stats(Stats) : the stats the bytes are added to
+    """
+
+    def __init__(self, source, stats):
+        self.source = source
+        self.stats = stats
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.stats.bytes += len(data)
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+class Stats(object):
+    """
+    Counters and timers of the stages of a process_data run, passed as process_data(..., stats=Stats())
+
+    Args:
+        interval(float) : the seconds between progress lines, None for no progress output
+        report_file(str) : the name of the json report written at the end of the run
+        profile(str) : the stage profiled with cProfile, one of STAGES
+        profile_file(str) : the name of the cProfile output, defaults to "<profile>.prof"
+        out : the file the progress lines are written to
+    """
+
+    def __init__(self, interval=5.0, report_file=None, profile=None, profile_file=None, out=None):
+        if profile is not None and profile not in STAGES:
+            raise ValueError("unknown stage: %s" % profile)
+        self.interval = interval
+        self.report_file = report_file
+        self.profile = profile
+        self.profile_file = profile_file or "{0}.prof".format(profile)
+        self.out = out or sys.stderr
+        self.profiler = cProfile.Profile() if profile else None
+        self.calls = dict((stage, 0) for stage in STAGES)
+        self.seconds = dict((stage, 0.0) for stage in STAGES)
+        self.elements = 0
+        self.bytes = 0
+        self.total_bytes = None
+        self.started = None
+        self.finished = None
+
+    def timed(self, stage, func):
+        """
+            This function wraps func so that its calls and time are added to the stage
+
+            Args:
+                stage(str) : first parameter, the name of the stage
+                func(function) : second parameter, the function to be wrapped
+
+            Returns:
+                function: the wrapped function
+        """
+        calls, seconds, clock = self.calls, self.seconds, time.time
+        profiler = self.profiler if stage == self.profile else None
+
+        def wrapper(*args):
+            start = clock()
+            if profiler is not None:
+                profiler.enable()
+            try:
+                return func(*args)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                seconds[stage] += clock() - start
+                calls[stage] += 1
+        return wrapper
+
+    def timed_iter(self, stage, iterable):
+        """
+            This function yields the items of iterable, adding the time taken by each next to the stage
+        """
+        step = self.timed(stage, iter(iterable).next)
+        while True:
+            try:
+                item = step()
+            except StopIteration:
+                # the final next is not an item
+                self.calls[stage] -= 1
+                return
+            yield item
+
+    def reader(self, source):
+        """
+            This function wraps the file object read by the parser so that the bytes read are counted
+        """
+        return CountingReader(source, self)
+
+    def add(self, calls, seconds):
+        """
+            This function adds the calls and seconds of the stages timed in a worker process
+        """
+        for stage in STAGES:
+            self.calls[stage] += calls[stage]
+            self.seconds[stage] += seconds[stage]
+
+    def start(self, file_in):
+        """
+            This function starts the clock of the run, called by process_data before the run
+        """
+        if isinstance(file_in, basestring) and not is_compressed(file_in):
+            self.total_bytes = os.path.getsize(file_in)
+        self.started = self.last = time.time()
+
+    def track(self, elements):
+        """
+            This function counts the shaped elements of the run and prints the progress lines
+        """
+        clock = time.time
+        for el in elements:
+            self.elements += 1
+            # the clock is read once every 1024 elements
+            if self.interval is not None and not self.elements & 1023 and clock() - self.last >= self.interval:
+                self.last = clock()
+                self.out.write(self.progress_line() + "\n")
+            yield el
+
+    def progress_line(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        line = "%d elements, %.0f elements/s, %.1f MB" % (self.elements, self.elements / elapsed, self.bytes / 1e6)
+        if self.total_bytes:
+            line += " of %.1f MB (%.1f%%)" % (self.total_bytes / 1e6, 100.0 * self.bytes / self.total_bytes)
+            if self.bytes:
+                eta = elapsed * (self.total_bytes - self.bytes) / self.bytes
+                line += ", ETA %d:%02d:%02d" % (eta // 3600, eta % 3600 // 60, eta % 60)
+        return line
+
+    def finish(self):
+        """
+            This function writes the report and the profile, called by process_data after the run
+        """
+        if self.started is None:
+            return
+        self.finished = time.time()
+        if self.interval is not None:
+            self.out.write(self.progress_line() + ", done\n")
+        if self.report_file:
+            with open(self.report_file, "w") as fo:
+                json.dump(self.report(), fo, indent=2, sort_keys=True)
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_file)
+
+    def report(self):
+        """
+            This function returns the stats of the run
+
+            Returns:
+                dict: the totals of the run and the calls and seconds of each stage
+        """
+        elapsed = max((self.finished or time.time()) - self.started, 1e-9)
+        stages = {}
+        for stage in STAGES:
+            stages[stage] = {"calls": self.calls[stage],
+                             "seconds": self.seconds[stage],
+                             "share": self.seconds[stage] / elapsed,
+                             "us_per_call": 1e6 * self.seconds[stage] / self.calls[stage] if self.calls[stage] else None}
+        return {"elements": self.elements,
+                "bytes": self.bytes,
+                "total_bytes": self.total_bytes,
+                "seconds": elapsed,
+                "elements_per_sec": self.elements / elapsed,
+                "mb_per_sec": self.bytes / 1e6 / elapsed,
+                "stages": stages}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert an osm file to json with per-stage timings")
+    parser.add_argument("file_in")
+    parser.add_argument("--backend", choices=("etree", "expat"), default="etree")
+    parser.add_argument("--geometry", action="store_true")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between progress lines")
+    parser.add_argument("--report", help="file the json stats report is written to")
+    parser.add_argument("--profile", choices=STAGES, help="stage profiled with cProfile")
+    parser.add_argument("--profile-file", help="file the cProfile output is written to")
+    args = parser.parse_args(argv)
+    stats = Stats(args.interval, args.report, args.profile, args.profile_file)
+    process_data.process_data(args.file_in, stream=True, geometry=args.geometry, backend=args.backend, stats=stats)
+    for stage, values in sorted(stats.report()["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print "%-14s %10d calls %9.3fs %5.1f%%" % (stage, values["calls"], values["seconds"], 100 * values["share"])
+
+
+def test():
+    import pstats
+    import tempfile
+    import pbf_reader
+    from StringIO import StringIO
+    report_file = tempfile.mktemp(suffix=".json")
+    profile_file = tempfile.mktemp(suffix=".prof")
+    file_pbf = tempfile.mktemp(suffix=".osm.pbf")
+    out = StringIO()
+    try:
+        for backend in ("etree", "expat"):
+            expected = process_data.process_data("exercises/example.osm", backend=backend)
+            stats = Stats(interval=0, report_file=report_file, profile="shape_element", profile_file=profile_file,
+                          out=out)
+            assert process_data.process_data("exercises/example.osm", backend=backend, stats=stats) == expected
+            with open(report_file) as fi:
+                report = json.load(fi)
+            assert report["elements"] == len(expected) == report["stages"]["write"]["calls"]
+            assert report["bytes"] == report["total_bytes"] == os.path.getsize("exercises/example.osm")
+            assert report["stages"]["json_encode"]["calls"] == len(expected)
+            assert report["stages"]["clean_address"]["calls"] > 0
+            if backend == "etree":
+                parsed = sum(1 for _ in process_data.iter_elements("exercises/example.osm"))
+                assert report["stages"]["parse"]["calls"] == report["stages"]["shape_element"]["calls"] == parsed
+                assert "shape_element" in str(pstats.Stats(profile_file).stats.keys())
+        assert "done" in out.getvalue() and "ETA" in out.getvalue()
+
+        # a conversion running at the same time is not counted
+        stats = Stats(interval=None)
+        elements = process_data.iter_shaped("exercises/example.osm", stats=stats)
+        next(elements)
+        process_data.process_data("exercises/example.osm")
+        list(process_data.iter_shaped("exercises/example.osm", backend="expat"))
+        assert stats.calls["shape_element"] == stats.calls["parse"] == 1
+        elements.close()
+
+        # the stage times of the pbf workers are added to the report
+        pbf_reader.write_pbf("exercises/example.osm", file_pbf)
+        stats = Stats(interval=None)
+        expected = process_data.process_data(file_pbf)
+        assert process_data.process_data(file_pbf, stats=stats) == expected
+        report = stats.report()
+        assert report["stages"]["shape_element"]["calls"] == len(expected) == report["elements"]
+        assert report["stages"]["clean_address"]["calls"] > 0
+        assert 0 < report["bytes"] < report["total_bytes"] == os.path.getsize(file_pbf)
+    finally:
+        for name in ("exercises/example.osm.json", file_pbf + ".json", report_file, profile_file, file_pbf):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+This code classifies the "k" values of <tag> elements. A key is matched against the lower, lower_colon
+ and problem_chars regular expressions and split on ':' only the first time it is seen, the result is
+ cached, as a file of millions of tags has only a few thousand distinct keys. The classification is shared
+ by process_data.is_valid, audit_engine and exercises/tags.key_type.
+"""
+
+import re
+
+# regular expression for lower case characters
+lower = re.compile(r'^([a-z]|_)*$')
+# regular expression for lower case characters containing colon
+lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+# regular expression for problem characters
+problem_chars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+# regular expression for non ascii characters
+non_ascii = re.compile(u'[^\x00-\x7f]')
+
+KEY_TYPES = ("lower", "lower_colon", "problemchars", "other")
+
+
+def key_type(k):
+    """
+        This function returns the category of the key, "lower", "lower_colon", "problemchars" or "other"
+    """
+    if lower.search(k):
+        return "lower"
+    elif lower_colon.search(k):
+        return "lower_colon"
+    elif problem_chars.search(k):
+        return "problemchars"
+    return "other"
+
+
+def is_ascii(value):
+    """
+        This function checks that the value has only ascii characters, with one regular expression search
+         instead of a loop over the characters
+    """
+    return not non_ascii.search(value)
+
+
+class KeyClassifier(object):
+    """
+    Cache of the category, the validity and the ':' separated parts of each tag key
+
+    Args:
+        max_keys(int) : the number of keys cached, the cache is emptied when it is full
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.cache = {}
+
+    def classify(self, k):
+        """
+            This function classifies the key
+
+            Args:
+                k(str) : first parameter, the key of the tag
+
+            Returns:
+                tuple: the category of the key, True if the key has no problem characters, and the tuple
+                    of the parts of the key split on ':'
+        """
+        try:
+            return self.cache[k]
+        except KeyError:
+            pass
+        category = key_type(k)
+        # a key matching lower or lower_colon cannot have problem characters
+        info = (category, category != "problemchars", tuple(k.split(":")))
+        if len(self.cache) >= self.max_keys:
+            self.cache.clear()
+        self.cache[k] = info
+        return info
+
+    __call__ = classify
+
+    def is_valid_key(self, k):
+        return self.classify(k)[1]
+
+    def __len__(self):
+        return len(self.cache)
+
+
+# cache shared by all the modules
+key_classifier = KeyClassifier()
+classify = key_classifier.classify
+
+
+def test():
+    for k, category in (("name", "lower"), ("addr:street", "lower_colon"), ("addr:street:name", "other"),
+                        ("note;bad", "problemchars"), ("Name", "other"), ("a b", "problemchars"),
+                        ("name_en", "lower")):
+        assert key_type(k) == category
+        classifier = KeyClassifier(max_keys=2)
+        assert classifier.classify(k) == (category, category != "problemchars", tuple(k.split(":")))
+        assert classifier.classify(k) is classifier.classify(k)
+    classifier = KeyClassifier(max_keys=2)
+    for k in ("a", "b", "c"):
+        classifier(k)
+    assert len(classifier) == 1
+    assert is_ascii("Main Street") and is_ascii(u"Main Street") and is_ascii("")
+    assert not is_ascii("caf\xc3\xa9") and not is_ascii(u"caf\xe9")
+    assert problem_chars.search(u"a\xe9") is None
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,156 @@
+"""
+This code normalizes street/city names in a single compiled pass. The abbreviation pattern is built once
+ from the street type mapping and the normalized names are kept in a bounded LRU cache, since the same
+ values repeat millions of times in a metro extract.
+"""
+
+import bisect
+import random
+import re
+from collections import OrderedDict
+
+
+class NameNormalizer(object):
+    """
+    Replaces whole-word street type abbreviations with their full names
+
+    Args:
+        value_mapping(dict) : the abbreviations and the full names they are replaced with
+        expected(list) : the expected street types, every full name in value_mapping must be one of them
+        cache_size(int) : the maximum number of normalized names kept in the cache
+    """
+
+    def __init__(self, value_mapping, expected, cache_size=10000):
+        unknown = set(value_mapping.values()) - set(expected)
+        if unknown:
+            raise ValueError("mapping values not in expected street types: %s" % sorted(unknown))
+        self.mapping = dict(value_mapping)
+        # longest abbreviations first so that "St." is preferred over "St"
+        keys = sorted(self.mapping, key=len, reverse=True)
+        self.pattern = re.compile(r'(?<!\S)(?:%s)(?!\S)' % "|".join(re.escape(k) for k in keys))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _replace(self, match):
+        return self.mapping[match.group()]
+
+    def normalize(self, name):
+        """
+            This function returns the name with every abbreviated street type replaced
+
+            Args:
+                name(str) : first parameter, the street/city name to be normalized
+
+            Returns:
+                str: The return value, the normalized name
+        """
+        cache = self.cache
+        try:
+            value = cache.pop(name)
+            self.hits += 1
+        except KeyError:
+            value = self.pattern.sub(self._replace, name)
+            self.misses += 1
+            if len(cache) >= self.cache_size:
+                cache.popitem(last=False)
+        # re-insert to mark the name as most recently used
+        cache[name] = value
+        return value
+
+    __call__ = normalize
+
+    def stats(self):
+        """
+            This function reports the cache statistics
+
+            Returns:
+                dict: the hits, misses, hit rate and current size of the cache
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache),
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0}
+
+
+def sample_names(count, seed=0):
+    """
+        This function draws street names with a zipf-like frequency, like the values of a metro extract
+
+        Args:
+            count(int) : first parameter, the number of names to draw
+            seed(int) : second parameter, the random seed
+
+        Returns:
+            list: the drawn names
+    """
+    rng = random.Random(seed)
+    bases = ["Broadway", "Main", "Park", "Lexington", "Madison", "Atlantic", "Flatbush", "Ocean",
+             "Bedford", "Nostrand", "Queens", "Jamaica", "Linden", "Myrtle", "Fulton", "Amsterdam",
+             "Columbus", "Riverside", "Church", "Court"]
+    types = ["Street", "St", "St.", "Avenue", "Ave", "Ave.", "Road", "Rd", "Place", "Pl", "Boulevard",
+             "Blvd", "Parkway", "Pkwy", "Drive", "Dr", "Lane", "Court", "Ct"]
+    prefixes = ["", "", "", "East", "West", "E", "W", "North", "S"]
+    names = []
+    for i in xrange(5000):
+        name = "%s %d %s %s" % (rng.choice(prefixes), rng.randint(1, 200), rng.choice(bases), rng.choice(types))
+        names.append(name.strip())
+    # rank r is drawn with probability proportional to 1 / r
+    weights = [1.0 / (r + 1) for r in xrange(len(names))]
+    total = sum(weights)
+    cumulative = []
+    acc = 0.0
+    for w in weights:
+        acc += w / total
+        cumulative.append(acc)
+    return [names[min(bisect.bisect(cumulative, rng.random()), len(names) - 1)] for _ in xrange(count)]
+
+
+def benchmark(count=200000):
+    """
+        This function times process_data.update_name against the normalizer on the same names
+
+        Args:
+            count(int) : first parameter, the number of names to normalize
+
+        Returns:
+            dict: the timings, the speedup and the cache statistics
+    """
+    import time
+    import process_data
+    names = sample_names(count)
+    start = time.time()
+    for name in names:
+        process_data.update_name(name, process_data.mapping)
+    update_name_time = time.time() - start
+    normalizer = NameNormalizer(process_data.mapping, process_data.expected)
+    start = time.time()
+    for name in names:
+        normalizer.normalize(name)
+    normalizer_time = time.time() - start
+    return {"update_name": update_name_time, "normalizer": normalizer_time,
+            "speedup": update_name_time / normalizer_time, "cache": normalizer.stats()}
+
+
+def test():
+    import process_data
+    normalizer = NameNormalizer(process_data.mapping, process_data.expected, cache_size=2)
+    assert normalizer("West Lexington St.") == "West Lexington Street"
+    assert normalizer("Baldwin Rd.") == "Baldwin Road"
+    assert normalizer("N Lincoln Ave") == "North Lincoln Avenue"
+    # abbreviations are only replaced as whole words
+    assert normalizer("Stanton St") == "Stanton Street"
+    assert normalizer("Stx") == "Stx"
+    assert normalizer("East Broadway") == "East Broadway"
+    assert normalizer("East Broadway") == "East Broadway"
+    assert normalizer.stats() == {"hits": 1, "misses": 6, "size": 2, "hit_rate": 1.0 / 7}
+    try:
+        NameNormalizer({"Sttt": "Stret"}, process_data.expected)
+        assert False
+    except ValueError:
+        pass
+    print benchmark()
+
+
+if __name__ == "__main__":
+    test()
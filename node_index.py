@@ -0,0 +1,237 @@
+"""
+This code builds a compact on-disk index of node id -> (lat, lon), used to embed the coordinates of
+ each way's nodes into the way documents. Each node takes a 16 byte record (int64 id, lat and lon as
+ int32 in units of 1e-7 degrees, the precision of osm) in a file sorted by id, which is memory-mapped
+ and binary searched, so the Python heap does not grow with the number of nodes.
+
+Memory use: building keeps at most `chunk_size` records in memory (16 MB for the default of one million).
+ Osm extracts are sorted by node id, so the records are written straight to the index; unsorted input
+ is written as sorted runs and merged, holding one record per run. Lookups only use the page cache:
+ a city extract of 20 million nodes gives a 320 MB index, a country of 400 million nodes 6.4 GB on disk,
+ and the resident memory stays bounded by what the operating system chooses to cache.
+"""
+
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+# node record: id, lat and lon in units of 1e-7 degrees
+RECORD = struct.Struct("<qii")
+
+# osm coordinate precision
+SCALE = 10000000
+
+
+def to_fixed(value):
+    return int(round(float(value) * SCALE))
+
+
+def read_records(file_in):
+    """
+        This function iterates the records of a run or index file
+    """
+    with open(file_in, "rb") as fi:
+        while True:
+            data = fi.read(RECORD.size * 4096)
+            if not data:
+                return
+            for offset in xrange(0, len(data), RECORD.size):
+                yield RECORD.unpack_from(data, offset)
+
+
+def read_run(file_in, run_number):
+    """
+        This function iterates the records of a run as (id, run number, position, lat, lon), so that
+         merging the runs keeps duplicated ids in input order
+    """
+    for position, (node_id, lat, lon) in enumerate(read_records(file_in)):
+        yield node_id, run_number, position, lat, lon
+
+
+class NodeIndexBuilder(object):
+    """
+    Collects the node coordinates during the node pass and writes them to an index file sorted by id
+
+    Args:
+        file_out(str) : the name of the index file, a temporary file is used by default
+        chunk_size(int) : the number of records buffered in memory
+    """
+
+    def __init__(self, file_out=None, chunk_size=1000000):
+        if file_out is None:
+            fd, file_out = tempfile.mkstemp(suffix=".nodeidx")
+            os.close(fd)
+            self.temporary = True
+        else:
+            self.temporary = False
+        self.file_out = file_out
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.runs = []
+        self.last_id = None
+        self.sorted = True
+        self.fo = open(file_out, "wb")
+
+    def add(self, node_id, lat, lon):
+        if self.fo.closed:
+            raise ValueError("node %s added to a finished index" % node_id)
+        node_id = int(node_id)
+        if self.last_id is not None and node_id <= self.last_id:
+            self.sorted = False
+        self.last_id = node_id
+        self.buffer.append((node_id, to_fixed(lat), to_fixed(lon)))
+        if len(self.buffer) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        if self.sorted:
+            fo = self.fo
+        else:
+            # write the rest of the input as sorted runs to be merged at the end
+            fd, run = tempfile.mkstemp(suffix=".noderun")
+            fo = os.fdopen(fd, "wb")
+            self.runs.append(run)
+            self.buffer.sort(key=lambda record: record[0])
+        pack = RECORD.pack
+        fo.write("".join(pack(*record) for record in self.buffer))
+        if fo is not self.fo:
+            fo.close()
+        self.buffer = []
+
+    def finish(self):
+        """
+            This function completes the index file and opens it for lookups
+
+            Returns:
+                NodeIndex: the index
+        """
+        self._flush()
+        self.fo.close()
+        if self.runs:
+            # the sorted prefix written to the index file is the first run
+            prefix = self.file_out + ".run"
+            os.rename(self.file_out, prefix)
+            runs = [prefix] + self.runs
+            pack = RECORD.pack
+            with open(self.file_out, "wb") as fo:
+                last_id = None
+                # runs are in input order, so ties on the id are merged in input order
+                merged = heapq.merge(*[read_run(run, n) for n, run in enumerate(runs)])
+                for node_id, _, _, lat, lon in merged:
+                    # keep the last record of duplicated ids
+                    if node_id == last_id:
+                        fo.seek(-RECORD.size, os.SEEK_CUR)
+                    fo.write(pack(node_id, lat, lon))
+                    last_id = node_id
+            for run in runs:
+                os.remove(run)
+        return NodeIndex(self.file_out, remove=self.temporary)
+
+
+class NodeIndex(object):
+    """
+    Memory-mapped, sorted node index
+
+    Args:
+        file_in(str) : the name of the index file
+        remove(boolean) : with value = True to remove the file when the index is closed
+    """
+
+    def __init__(self, file_in, remove=False):
+        self.file_in = file_in
+        self.remove = remove
+        self.fo = open(file_in, "rb")
+        self.size = os.path.getsize(file_in) // RECORD.size
+        self.map = mmap.mmap(self.fo.fileno(), 0, access=mmap.ACCESS_READ) if self.size else ""
+
+    def __len__(self):
+        return self.size
+
+    def get(self, node_id):
+        """
+            This function looks up the coordinates of a node
+
+            Args:
+                node_id(str) : first parameter, the node id
+
+            Returns:
+                list: [lat, lon] of the node, or None if it is not in the index
+        """
+        node_id = int(node_id)
+        unpack_from = RECORD.unpack_from
+        data = self.map
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = unpack_from(data, mid * RECORD.size)
+            if record[0] < node_id:
+                lo = mid + 1
+            elif record[0] > node_id:
+                hi = mid
+            else:
+                return [float(record[1]) / SCALE, float(record[2]) / SCALE]
+        return None
+
+    def resolve(self, node_refs):
+        """
+            This function looks up the coordinates of a way's nodes, with None for nodes outside the extract
+        """
+        return [self.get(ref) for ref in node_refs]
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.fo.close()
+        if self.remove:
+            os.remove(self.file_in)
+
+
+def test():
+    builder = NodeIndexBuilder(chunk_size=2)
+    for node_id, lat, lon in [(5, "1.5", "-2.25"), (9, "41.9730791", "-87.6866303"), (2, "0", "0"),
+                              (7, "-90", "180"), (9, "3", "4")]:
+        builder.add(node_id, lat, lon)
+    index = builder.finish()
+    assert len(index) == 4
+    assert index.get("9") == [3.0, 4.0]
+    assert index.get(5) == [1.5, -2.25]
+    assert index.resolve(["2", "7", "8"]) == [[0.0, 0.0], [-90.0, 180.0], None]
+    index.close()
+    assert not os.path.exists(index.file_in)
+
+    builder = NodeIndexBuilder()
+    builder.add("261114295", "41.9730791", "-87.6866303")
+    index = builder.finish()
+    assert index.get("261114295") == [41.9730791, -87.6866303]
+    index.close()
+
+    import process_data
+    from StringIO import StringIO
+    osm = StringIO('<osm><node id="1" lat="40.7" lon="-74.0"/><node id="2" lat="40.8" lon="-73.9"/>'
+                   '<way id="3"><nd ref="1"/><nd ref="2"/><nd ref="4"/></way></osm>')
+    way = list(process_data.iter_shaped(osm, geometry=True))[-1]
+    assert way["node_refs"] == ["1", "2", "4"]
+    assert way["geometry"] == [[40.7, -74.0], [40.8, -73.9], None]
+    osm = StringIO('<osm><node id="1" lat="40.7" lon="-74.0"/><way id="3"><nd ref="1"/><nd ref="2"/></way>'
+                   '<node id="2" lat="40.8" lon="-73.9"/></osm>')
+    data = list(process_data.iter_shaped(osm, geometry=True))
+    assert [el["id"] for el in data] == ["1", "3", "2"]
+    assert data[1]["geometry"] == [[40.7, -74.0], [40.8, -73.9]]
+    try:
+        builder.add("1", "0", "0")
+        assert False
+    except ValueError:
+        pass
+    data = process_data.process_data("exercises/example.osm", geometry=True)
+    assert data[-1]["geometry"] == [None] * 7
+    for el in data:
+        el.pop("geometry", None)
+    assert data == process_data.process_data("exercises/example.osm")
+    os.remove("exercises/example.osm.json")
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,292 @@
+"""
+This code applies an osm change file (.osc) to an existing conversion, so that a daily refresh does not
+ have to convert the whole extract again. Only the elements in the create/modify/delete blocks are shaped
+ with process_data.shape_element, and the changes are applied keyed by element type and id either to a
+ json lines file written by process_data (pretty=False) or to a Mongo Db collection.
+"""
+
+import gzip
+import json
+import os
+import re
+import xml.etree.cElementTree as ET
+
+import process_data
+from osm_input import open_osm
+from sinks import JsonFileSink, expand_keys
+
+# actions of an osm change file
+ACTIONS = ("create", "modify", "delete")
+
+# regular expression for the id values of a json line, used to skip the lines that did not change, with or
+# without the spaces after the separators and under the compact key of sinks.COMPACT_KEYS
+id_re = re.compile(r'"(?:id|@i)": ?"(\d+)"')
+
+# element types converted by shape_element
+TYPES = ("node", "way")
+
+
+def iter_changes(file_osc):
+    """
+        This function iterates the changes of the osm change file in file order
+
+        Args:
+            file_osc(str) : the first argument, the name (or file object) of the change file, .osc.gz and
+                .osc.bz2 files are decompressed on the fly
+
+        Returns:
+            generator : (action, type, id, shaped element) tuples, the element is None for deletions
+
+    """
+    source = open_osm(file_osc) if isinstance(file_osc, basestring) else file_osc
+    try:
+        for change in _iter_changes(source):
+            yield change
+    finally:
+        if source is not file_osc:
+            source.close()
+
+
+def _iter_changes(source):
+    context = iter(ET.iterparse(source, events=('start', 'end')))
+    _, root = next(context)
+    action = None
+    block = None
+    for event, element in context:
+        if event == 'start':
+            if element.tag in ACTIONS and action is None:
+                action = element.tag
+                block = element
+            continue
+        if element is block:
+            action = None
+            block = None
+            root.clear()
+        elif action is not None and element.tag in ('node', 'way', 'relation'):
+            el = None
+            if action != "delete":
+                el = process_data.shape_element(element)
+            yield action, element.tag, element.attrib["id"], el
+            block.clear()
+
+
+def load_changes(file_osc):
+    """
+        This function collects the net changes of the osm change file, later changes replacing earlier ones
+
+        Args:
+            file_osc(str) : the first argument, the name of the change file
+
+        Returns:
+            dict : the shaped element of each (type, id), None for deleted elements
+
+    """
+    changes = {}
+    for action, tag, element_id, el in iter_changes(file_osc):
+        # relations are not converted by shape_element, but their deletion is harmless
+        if action == "delete" or el:
+            changes[(tag, element_id)] = el
+    return changes
+
+
+def change_keys(doc):
+    """
+        This function returns the (type, id) keys of the changes a converted element can match. A "type" tag
+         replaces the type of the element (see process_data.shape_tag), so such an element, like the "other"
+         partitions of sinks.PartitionedSink, can be either a node or a way
+    """
+    doc_type = doc.get("type")
+    if doc_type in TYPES:
+        return [(doc_type, doc.get("id"))]
+    return [(tag, doc.get("id")) for tag in TYPES]
+
+
+def element_query(tag, element_id):
+    """
+        This function returns the Mongo Db query of the converted element, whose type is either its tag or
+         the value of a "type" tag, see change_keys
+    """
+    if tag not in TYPES:
+        return {"type": tag, "id": element_id}
+    other = [t for t in TYPES if t != tag]
+    return {"id": element_id, "type": {"$nin": other}}
+
+
+def apply_to_json(file_osc, json_in, json_out=None):
+    """
+        This function applies the osm change file to a json lines file. Unchanged lines are copied as they
+         are, only the lines holding an id of the change file are decoded, modified elements are replaced
+         in place and created elements are appended at the end, encoded like the rest of the file
+
+        Args:
+            file_osc(str) : the first argument, the name of the change file
+            json_in(str) : the second argument, the json lines file written by process_data, plain or with
+                compact keys, gzip compressed if it ends in .gz
+            json_out(str) : the third argument, the updated file, defaults to replacing json_in
+
+        Returns:
+            dict : the number of elements created, modified and deleted
+
+    """
+    changes = load_changes(file_osc)
+    changed_ids = set(element_id for _, element_id in changes)
+    counts = {"created": 0, "modified": 0, "deleted": 0}
+    json_out = json_out or json_in
+    # the temporary file keeps the .gz suffix so that the sink compresses it
+    head, tail = os.path.split(json_out)
+    tmp_out = os.path.join(head, ".tmp." + tail)
+    fi = gzip.open(json_in, "rb") if json_in.endswith(".gz") else open(json_in, "rb")
+    sink = None
+    try:
+        for line in fi:
+            if sink is None:
+                # the compact mode is told apart by the short name of the id or type on the first line
+                sink = JsonFileSink(tmp_out, compact='"@i":' in line or '"@t":' in line)
+            if changed_ids.isdisjoint(id_re.findall(line)):
+                sink.write_line(line)
+                continue
+            doc = json.loads(line)
+            if sink.compact:
+                doc = expand_keys(doc)
+            key = next((key for key in change_keys(doc) if key in changes), None)
+            if key is None:
+                sink.write_line(line)
+                continue
+            el = changes.pop(key)
+            if el is None:
+                counts["deleted"] += 1
+            else:
+                counts["modified"] += 1
+                sink.write(el)
+        if sink is None:
+            sink = JsonFileSink(tmp_out)
+        for key, el in sorted(changes.items()):
+            if el is not None:
+                counts["created"] += 1
+                sink.write(el)
+    finally:
+        fi.close()
+        if sink is not None:
+            sink.close()
+    os.rename(tmp_out, json_out)
+    return counts
+
+
+def apply_to_collection(file_osc, collection):
+    """
+        This function applies the osm change file to a Mongo Db collection loaded by process_data, upserting
+         created and modified elements and removing deleted ones
+
+        Args:
+            file_osc(str) : the first argument, the name of the change file
+            collection : the second argument, the pymongo collection
+
+        Returns:
+            dict : the number of elements upserted and deleted
+
+    """
+    counts = {"upserted": 0, "deleted": 0}
+    for (tag, element_id), el in load_changes(file_osc).items():
+        if el is None:
+            collection.delete_one(element_query(tag, element_id))
+            counts["deleted"] += 1
+        else:
+            collection.replace_one(element_query(tag, element_id), el, upsert=True)
+            counts["upserted"] += 1
+    return counts
+
+
+def test():
+    import tempfile
+    from StringIO import StringIO
+    from sinks import FakeCollection
+    osc = ('<osmChange version="0.6">'
+           '<modify><node id="261114295" version="8" lat="41.9730791" lon="-87.6866303">'
+           '<tag k="addr:street" v="West Lexington St."/></node></modify>'
+           '<delete><node id="261114296" version="7" lat="0" lon="0"/>'
+           '<way id="258219703" version="2"/></delete>'
+           '<create><node id="9000000001" version="1" lat="41.97" lon="-87.69"/></create>'
+           '<create><relation id="1" version="1"/></create>'
+           '<modify><node id="9000000001" version="2" lat="41.98" lon="-87.69"/></modify>'
+           '</osmChange>')
+    changes = list(iter_changes(StringIO(osc)))
+    assert [change[:3] for change in changes] == [
+        ("modify", "node", "261114295"), ("delete", "node", "261114296"), ("delete", "way", "258219703"),
+        ("create", "node", "9000000001"), ("create", "relation", "1"), ("modify", "node", "9000000001")]
+    assert changes[0][3]["address"] == {"street": "West Lexington Street"}
+
+    data = process_data.process_data("exercises/example.osm")
+    json_in = "exercises/example.osm.json"
+    file_osc = tempfile.mktemp(suffix=".osc")
+    try:
+        with open(file_osc, "w") as fo:
+            fo.write(osc)
+        assert apply_to_json(file_osc, json_in) == {"created": 1, "modified": 1, "deleted": 2}
+        with open(json_in) as fi:
+            updated = [json.loads(line) for line in fi]
+        collection = FakeCollection()
+        collection.insert_many([dict(el) for el in data], ordered=False)
+        assert apply_to_collection(file_osc, collection) == {"upserted": 2, "deleted": 2}
+    finally:
+        os.remove(file_osc)
+        os.remove(json_in)
+    assert len(updated) == len(data) - 1
+    assert updated[0]["created"]["version"] == "8"
+    assert updated[-1]["id"] == "9000000001" and updated[-1]["created"]["version"] == "2"
+    assert "261114296" not in [doc["id"] for doc in updated]
+    assert updated[1:-1] == [json.loads(json.dumps(el)) for el in data[2:] if el["id"] != "258219703"]
+    assert sorted(json.loads(json.dumps(collection.docs))) == sorted(updated)
+
+    import sinks
+    for compress, compact in ((True, False), (False, True), (True, True)):
+        process_data.process_data("exercises/example.osm", stream=True, compress=compress, compact=compact)
+        json_in = "exercises/example.osm.json" + (".gz" if compress else "")
+        file_osc = tempfile.mktemp(suffix=".osc")
+        try:
+            with open(file_osc, "w") as fo:
+                fo.write(osc)
+            assert apply_to_json(file_osc, json_in) == {"created": 1, "modified": 1, "deleted": 2}
+            fi = gzip.open(json_in) if compress else open(json_in)
+            lines = fi.read().splitlines(True)
+            fi.close()
+        finally:
+            os.remove(file_osc)
+            os.remove(json_in)
+        docs = [json.loads(line) for line in lines]
+        if compact:
+            docs = [sinks.expand_keys(doc) for doc in docs]
+        assert docs == updated, (compress, compact)
+        # the replaced and appended lines are encoded like the rest of the file
+        encode = sinks.JsonFileSink(os.devnull, compact=compact).encode
+        assert lines[0] == encode(changes[0][3]) and lines[-1] == encode(changes[-1][3])
+        assert all(('": "' in line) != compact for line in lines)
+
+    # a "type" tag replaces the type of the converted element
+    file_in = tempfile.mktemp(suffix=".osm")
+    file_osc = tempfile.mktemp(suffix=".osc")
+    try:
+        with open(file_in, "w") as fo:
+            fo.write('<osm><node id="5" lat="1" lon="2"/><node id="6" lat="1" lon="2"><tag k="type" v="stop"/></node>'
+                     '<way id="5"><nd ref="5"/><tag k="type" v="multipolygon"/></way></osm>')
+        with open(file_osc, "w") as fo:
+            fo.write('<osmChange version="0.6"><delete><way id="5"/></delete><modify><node id="6" lat="3" lon="4">'
+                     '<tag k="type" v="stop"/></node></modify></osmChange>')
+        data = process_data.process_data(file_in)
+        assert [doc["type"] for doc in data] == ["node", "stop", "multipolygon"]
+        assert apply_to_json(file_osc, file_in + ".json") == {"created": 0, "modified": 1, "deleted": 1}
+        with open(file_in + ".json") as fi:
+            updated = [json.loads(line) for line in fi]
+        assert [(doc["id"], doc["type"], doc["pos"]) for doc in updated] == [("5", "node", [1.0, 2.0]),
+                                                                              ("6", "stop", [3.0, 4.0])]
+        collection = FakeCollection()
+        collection.insert_many([dict(el) for el in data], ordered=False)
+        assert apply_to_collection(file_osc, collection) == {"upserted": 1, "deleted": 1}
+        assert json.loads(json.dumps(collection.docs)) == updated
+    finally:
+        for name in (file_in, file_in + ".json", file_osc):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,245 @@
+"""
+This code opens osm files for parsing, whether they are plain, gzip (.gz) or bzip2 (.bz2) compressed, so
+ that the extracts do not have to be decompressed on disk first. Multistream bzip2 files (such as the
+ planet and Geofabrik extracts) are split on stream boundaries and the streams are decompressed in
+ parallel worker processes, then handed to the parser in order.
+"""
+
+import bz2
+import gzip
+import os
+import re
+from multiprocessing import Pool, cpu_count
+
+# regular expression for the start of a bzip2 stream: the header and the magic number of its first block,
+# 10 bytes that are very unlikely to appear by chance inside compressed data
+bz2_stream_re = re.compile(r'BZh[1-9]1AY&SY')
+
+# size of the blocks read from the compressed file
+BLOCK_SIZE = 1 << 20
+
+# compressed bytes decompressed by one task of the worker pool
+CHUNK_SIZE = 4 << 20
+
+
+def iter_bz2(file_in):
+    """
+        This function decompresses a bzip2 file, including multistream files, in the current process
+
+        Args:
+            file_in(str) : first parameter, the name of the compressed file
+
+        Returns:
+            generator: the decompressed blocks
+    """
+    with open(file_in, "rb") as fi:
+        decompressor = bz2.BZ2Decompressor()
+        while True:
+            data = fi.read(BLOCK_SIZE)
+            if not data:
+                return
+            while data:
+                try:
+                    output = decompressor.decompress(data)
+                except EOFError:
+                    # the previous stream ended exactly at the end of the last block
+                    decompressor = bz2.BZ2Decompressor()
+                    continue
+                yield output
+                # the rest of the data after the end of a stream belongs to the next one
+                data = decompressor.unused_data
+                if data:
+                    decompressor = bz2.BZ2Decompressor()
+
+
+def find_bz2_chunks(file_in, chunk_size=CHUNK_SIZE):
+    """
+        This function groups the streams of a bzip2 file into byte ranges of about chunk_size bytes
+
+        Args:
+            file_in(str) : first parameter, the name of the compressed file
+            chunk_size(int) : second parameter, the compressed size of each range
+
+        Returns:
+            list: (start, end) byte ranges starting on stream boundaries
+    """
+    size = os.path.getsize(file_in)
+    bounds = [0]
+    with open(file_in, "rb") as fi:
+        offset = 0
+        carry = ""
+        while True:
+            block = fi.read(BLOCK_SIZE)
+            if not block:
+                break
+            data = carry + block
+            base = offset - len(carry)
+            for m in bz2_stream_re.finditer(data):
+                start = base + m.start()
+                if start >= bounds[-1] + chunk_size:
+                    bounds.append(start)
+            carry = data[-9:]
+            offset += len(block)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def decompress_range(args):
+    """
+        This function decompresses the byte range of a bzip2 file in a worker process
+    """
+    file_in, start, end = args
+    with open(file_in, "rb") as fi:
+        fi.seek(start)
+        data = fi.read(end - start)
+    return "".join(iter_streams(data))
+
+
+def iter_streams(data):
+    """
+        This function decompresses concatenated bzip2 streams held in memory
+    """
+    while data:
+        decompressor = bz2.BZ2Decompressor()
+        try:
+            yield decompressor.decompress(data)
+        except EOFError:
+            return
+        data = decompressor.unused_data
+
+
+def iter_bz2_parallel(file_in, workers=None, chunk_size=CHUNK_SIZE):
+    """
+        This function decompresses the streams of a multistream bzip2 file in parallel worker processes.
+         At most two ranges per worker are in flight, so memory stays bounded by the window of
+         decompressed ranges
+
+        Args:
+            file_in(str) : first parameter, the name of the compressed file
+            workers(int) : second parameter, the number of processes, defaults to the cpu count
+            chunk_size(int) : third parameter, the compressed size of the range given to each task
+
+        Returns:
+            generator: the decompressed ranges in file order
+    """
+    workers = workers or cpu_count()
+    chunks = find_bz2_chunks(file_in, chunk_size)
+    if len(chunks) == 1 or workers == 1:
+        # a single stream cannot be split
+        for data in iter_bz2(file_in):
+            yield data
+        return
+    pool = Pool(workers)
+    try:
+        window = []
+        for start, end in chunks:
+            window.append(pool.apply_async(decompress_range, ((file_in, start, end),)))
+            if len(window) >= 2 * workers:
+                yield window.pop(0).get()
+        while window:
+            yield window.pop(0).get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class ChunkReader(object):
+    """
+    File like object reading the bytes of an iterator of chunks, so that they can be parsed by ET.iterparse
+
+    Args:
+        chunks(iterable) : the chunks of bytes
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+        self.offset = 0
+        self.position = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.offset >= len(self.buffer):
+                try:
+                    self.buffer = next(self.chunks)
+                except StopIteration:
+                    break
+                self.offset = 0
+                continue
+            if size < 0:
+                part = self.buffer[self.offset:]
+            else:
+                part = self.buffer[self.offset:self.offset + size]
+                size -= len(part)
+            self.offset += len(part)
+            parts.append(part)
+        data = "".join(parts)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def open_osm(file_in, workers=None):
+    """
+        This function opens an osm file for reading, decompressing .gz and .bz2 files on the fly
+
+        Args:
+            file_in(str) : first parameter, the name of the osm file
+            workers(int) : second parameter, the number of processes decompressing multistream .bz2 files
+
+        Returns:
+            file: a file like object with the uncompressed bytes
+    """
+    if file_in.endswith(".gz"):
+        return gzip.open(file_in, "rb")
+    if file_in.endswith(".bz2"):
+        return ChunkReader(iter_bz2_parallel(file_in, workers))
+    return open(file_in, "rb")
+
+
+def is_compressed(file_in):
+    return file_in.endswith(".gz") or file_in.endswith(".bz2")
+
+
+def test():
+    import shutil
+    import tempfile
+    import process_data
+    with open("exercises/example.osm", "rb") as fi:
+        raw = fi.read()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        gz_file = os.path.join(tmp_dir, "example.osm.gz")
+        with gzip.open(gz_file, "wb") as fo:
+            fo.write(raw)
+        # a multistream file of one stream per 500 bytes
+        bz2_file = os.path.join(tmp_dir, "example.osm.bz2")
+        with open(bz2_file, "wb") as fo:
+            for i in range(0, len(raw), 500):
+                fo.write(bz2.compress(raw[i:i + 500]))
+        assert len(find_bz2_chunks(bz2_file, chunk_size=1000)) > 2
+        assert "".join(iter_bz2(bz2_file)) == raw
+        assert "".join(iter_bz2_parallel(bz2_file, workers=2, chunk_size=1000)) == raw
+        assert open_osm(gz_file).read() == raw
+        assert open_osm(bz2_file).read() == raw
+        expected = process_data.process_data("exercises/example.osm")
+        os.remove("exercises/example.osm.json")
+        assert process_data.process_data(gz_file) == expected
+        assert process_data.process_data(bz2_file) == expected
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    test()
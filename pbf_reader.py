@@ -0,0 +1,568 @@
+"""
+This code reads osm files in the protocol buffer binary format (.osm.pbf) without any external library.
+ The blobs are zlib compressed protobuf messages, decoded here with a small varint decoder, and the
+ nodes (plain or dense) and ways they hold are handed to process_data.shape_element as elements, so
+ the shaped dicts are the same as for the xml file. The blobs are independent, so they are decoded and
+ shaped in parallel worker processes and merged back in file order.
+
+Format reference: https://wiki.openstreetmap.org/wiki/PBF_Format
+"""
+
+import calendar
+import itertools
+import struct
+import time
+import xml.etree.cElementTree as ET
+import zlib
+from multiprocessing import Pool, cpu_count
+
+import process_data
+
+# features of the header block this reader understands
+SUPPORTED_FEATURES = set(["OsmSchema-V0.6", "DenseNodes"])
+
+
+def read_varint(data, pos):
+    """
+        This function decodes the varint starting at pos
+
+        Returns:
+            tuple: the value and the position after it
+    """
+    result = 0
+    shift = 0
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_fields(data):
+    """
+        This function iterates the (field number, value) pairs of a protobuf message, length delimited
+         values are returned as strings and varints as integers
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("unsupported protobuf wire type %d" % wire_type)
+        yield key >> 3, value
+
+
+def unpack_varints(data):
+    """
+        This function decodes a packed repeated varint field
+    """
+    values = []
+    append = values.append
+    result = 0
+    shift = 0
+    for b in bytearray(data):
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            append(result)
+            result = 0
+            shift = 0
+        else:
+            shift += 7
+    return values
+
+
+def to_signed(value):
+    # int32/int64 fields encode negative values as 64 bit two's complement
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def unpack_delta(data):
+    """
+        This function decodes a packed, delta coded repeated sint field
+    """
+    values = []
+    append = values.append
+    acc = 0
+    for value in unpack_varints(data):
+        acc += (value >> 1) ^ -(value & 1)
+        append(acc)
+    return values
+
+
+def as_text(value):
+    """
+        This function returns the string table entry the way ElementTree returns attribute values, a str
+         for ascii text and a unicode string otherwise
+    """
+    try:
+        value.decode("ascii")
+        return value
+    except UnicodeDecodeError:
+        return value.decode("utf-8")
+
+
+def format_degrees(nanodegrees):
+    """
+        This function formats a coordinate in units of 1e-9 degrees as a decimal string
+    """
+    sign = "-" if nanodegrees < 0 else ""
+    whole, fraction = divmod(abs(nanodegrees), 1000000000)
+    return ("%s%d.%09d" % (sign, whole, fraction)).rstrip("0").rstrip(".")
+
+
+def format_timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def iter_blobs(file_in):
+    """
+        This function iterates the blobs of the pbf file
+
+        Returns:
+            generator: (blob type, offset, size) of each blob
+    """
+    with open(file_in, "rb") as fi:
+        offset = 0
+        while True:
+            size = fi.read(4)
+            if not size:
+                return
+            header_size = struct.unpack(">I", size)[0]
+            header = dict(iter_fields(fi.read(header_size)))
+            offset += 4 + header_size
+            data_size = header[3]
+            yield header[1], offset, data_size
+            fi.seek(data_size, 1)
+            offset += data_size
+
+
+def read_blob(file_in, offset, size):
+    """
+        This function reads and decompresses one blob
+    """
+    with open(file_in, "rb") as fi:
+        fi.seek(offset)
+        blob = dict(iter_fields(fi.read(size)))
+    if 1 in blob:
+        return blob[1]
+    if 3 in blob:
+        return zlib.decompress(blob[3])
+    raise ValueError("unsupported blob compression, only raw and zlib blobs can be read")
+
+
+def check_header(data):
+    """
+        This function checks that the reader supports the features required by the header block
+    """
+    required = set(value for field, value in iter_fields(data) if field == 4)
+    unsupported = required - SUPPORTED_FEATURES
+    if unsupported:
+        raise ValueError("unsupported pbf features: %s" % ", ".join(sorted(unsupported)))
+
+
+def make_element(tag, attrib, tags, refs=()):
+    element = ET.Element(tag, attrib)
+    for ref in refs:
+        ET.SubElement(element, "nd", {"ref": str(ref)})
+    for k, v in tags:
+        ET.SubElement(element, "tag", {"k": k, "v": v})
+    return element
+
+
+def info_attrib(attrib, version, timestamp, changeset, uid, user, visible):
+    if visible is not None:
+        attrib["visible"] = "true" if visible else "false"
+    attrib["version"] = str(version)
+    attrib["changeset"] = str(changeset)
+    attrib["timestamp"] = format_timestamp(timestamp)
+    if user:
+        attrib["user"] = user
+    attrib["uid"] = str(uid)
+
+
+def decode_info(data, strings, date_granularity):
+    info = dict(iter_fields(data))
+    return (info.get(1, -1), info.get(2, 0) * date_granularity // 1000, to_signed(info.get(3, 0)),
+            to_signed(info.get(4, 0)), strings[info.get(5, 0)], info[6] if 6 in info else None)
+
+
+def iter_block_elements(data):
+    """
+        This function decodes the nodes and ways of a primitive block as ElementTree elements
+
+        Args:
+            data(str) : first parameter, the decompressed primitive block
+
+        Returns:
+            generator: the elements, in block order
+    """
+    strings = []
+    groups = []
+    granularity = 100
+    lat_offset = 0
+    lon_offset = 0
+    date_granularity = 1000
+    for field, value in iter_fields(data):
+        if field == 1:
+            strings = [as_text(s) for f, s in iter_fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 18:
+            date_granularity = value
+        elif field == 19:
+            lat_offset = to_signed(value)
+        elif field == 20:
+            lon_offset = to_signed(value)
+
+    for group in groups:
+        for field, value in iter_fields(group):
+            if field == 1:
+                node = {}
+                for f, v in iter_fields(value):
+                    node[f] = v
+                attrib = {"id": str(zigzag(node[1]))}
+                if 4 in node:
+                    info_attrib(attrib, *decode_info(node[4], strings, date_granularity))
+                attrib["lat"] = format_degrees(lat_offset + granularity * zigzag(node[8]))
+                attrib["lon"] = format_degrees(lon_offset + granularity * zigzag(node[9]))
+                tags = zip([strings[k] for k in unpack_varints(node.get(2, ""))],
+                           [strings[v] for v in unpack_varints(node.get(3, ""))])
+                yield make_element("node", attrib, tags)
+            elif field == 2:
+                for element in iter_dense(value, strings, granularity, lat_offset, lon_offset, date_granularity):
+                    yield element
+            elif field == 3:
+                way = {}
+                for f, v in iter_fields(value):
+                    way[f] = v
+                attrib = {"id": str(to_signed(way[1]))}
+                if 4 in way:
+                    info_attrib(attrib, *decode_info(way[4], strings, date_granularity))
+                tags = zip([strings[k] for k in unpack_varints(way.get(2, ""))],
+                           [strings[v] for v in unpack_varints(way.get(3, ""))])
+                yield make_element("way", attrib, tags, unpack_delta(way.get(8, "")))
+            # relations (4) and changesets (5) are not converted by shape_element
+
+
+def iter_dense(data, strings, granularity, lat_offset, lon_offset, date_granularity):
+    """
+        This function decodes a dense nodes message as ElementTree elements
+    """
+    dense = dict(iter_fields(data))
+    ids = unpack_delta(dense.get(1, ""))
+    lats = unpack_delta(dense.get(8, ""))
+    lons = unpack_delta(dense.get(9, ""))
+    keys_vals = unpack_varints(dense.get(10, ""))
+    infos = None
+    if 5 in dense:
+        info = dict(iter_fields(dense[5]))
+        versions = [to_signed(v) for v in unpack_varints(info.get(1, ""))]
+        timestamps = unpack_delta(info.get(2, ""))
+        changesets = unpack_delta(info.get(3, ""))
+        uids = unpack_delta(info.get(4, ""))
+        user_sids = unpack_delta(info.get(5, ""))
+        visibles = unpack_varints(info[6]) if 6 in info else [None] * len(ids)
+        infos = zip(versions, timestamps, changesets, uids, user_sids, visibles)
+    kv = 0
+    for i, node_id in enumerate(ids):
+        attrib = {"id": str(node_id)}
+        if infos is not None:
+            version, timestamp, changeset, uid, user_sid, visible = infos[i]
+            info_attrib(attrib, version, timestamp * date_granularity // 1000, changeset, uid,
+                        strings[user_sid], visible)
+        attrib["lat"] = format_degrees(lat_offset + granularity * lats[i])
+        attrib["lon"] = format_degrees(lon_offset + granularity * lons[i])
+        tags = []
+        if keys_vals:
+            while keys_vals[kv] != 0:
+                tags.append((strings[keys_vals[kv]], strings[keys_vals[kv + 1]]))
+                kv += 2
+            kv += 1
+        yield make_element("node", attrib, tags)
+
+
+def iter_elements(file_in):
+    """
+        This function iterates the nodes and ways of the pbf file as ElementTree elements, in the current
+         process
+
+        Args:
+            file_in(str) : first parameter, the name of the pbf file
+
+        Returns:
+            generator: the elements in file order
+    """
+    for blob_type, offset, size in iter_blobs(file_in):
+        data = read_blob(file_in, offset, size)
+        if blob_type == "OSMHeader":
+            check_header(data)
+        elif blob_type == "OSMData":
+            for element in iter_block_elements(data):
+                yield element
+
+
+def shape_blob(args):
+    """
+        This function decodes and shapes one data blob in a worker process, timing the parse, shape_element
+         and clean_address stages when asked to, and returns the shaped elements with the (calls, seconds)
+         of the stages or None
+    """
+    file_in, offset, size, timed = args
+    elements = iter_block_elements(read_blob(file_in, offset, size))
+    shape = process_data.shape_element
+    clean = process_data.clean_address
+    stats = None
+    if timed:
+        from instrumentation import Stats
+        stats = Stats(interval=None)
+        elements = stats.timed_iter("parse", elements)
+        shape = stats.timed("shape_element", shape)
+        clean = stats.timed("clean_address", clean)
+    shaped = []
+    for element in elements:
+        el = shape(element, clean)
+        if el:
+            shaped.append(el)
+    return shaped, (stats.calls, stats.seconds) if stats is not None else None
+
+
+def iter_shaped(file_in, workers=None, stats=None):
+    """
+        This function decodes and shapes the data blobs of the pbf file in parallel worker processes. At
+         most two blobs per worker are in flight, so memory stays bounded by the window of shaped blobs
+         however slowly the caller consumes them
+
+        Args:
+            file_in(str) : first parameter, the name of the pbf file
+            workers(int) : second parameter, the number of processes, defaults to the cpu count
+            stats : third parameter, an instrumentation.Stats the bytes of the blobs and the stage times of
+                the workers are added to
+
+        Returns:
+            generator: the shaped node/way dictionaries in file order
+    """
+    tasks = []
+    for blob_type, offset, size in iter_blobs(file_in):
+        if blob_type == "OSMHeader":
+            check_header(read_blob(file_in, offset, size))
+        elif blob_type == "OSMData":
+            tasks.append((file_in, offset, size, stats is not None))
+    workers = workers or cpu_count()
+    pool = Pool(workers) if workers > 1 else None
+
+    def shaped_blobs():
+        if pool is None:
+            for task in tasks:
+                yield task, shape_blob(task)
+            return
+        window = []
+        for task in tasks:
+            window.append((task, pool.apply_async(shape_blob, (task,))))
+            if len(window) >= 2 * workers:
+                task, result = window.pop(0)
+                yield task, result.get()
+        while window:
+            task, result = window.pop(0)
+            yield task, result.get()
+    try:
+        for task, (shaped, counts) in shaped_blobs():
+            if stats is not None:
+                stats.bytes += task[2]
+                stats.add(*counts)
+            for el in shaped:
+                yield el
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+
+def encode_varint(value):
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return str(out)
+
+
+def encode_field(field, value):
+    """
+        This function encodes an integer as a varint field and a string as a length delimited field
+    """
+    if isinstance(value, (int, long)):
+        return encode_varint(field << 3) + encode_varint(value)
+    return encode_varint(field << 3 | 2) + encode_varint(len(value)) + value
+
+
+def encode_packed(field, values, signed=False, delta=False):
+    out = []
+    last = 0
+    for value in values:
+        if delta:
+            value, last = value - last, value
+        if signed:
+            value = (value << 1) ^ (value >> 63)
+        out.append(encode_varint(value))
+    return encode_field(field, "".join(out))
+
+
+def write_blob(fo, blob_type, data):
+    blob = encode_field(2, len(data)) + encode_field(3, zlib.compress(data))
+    header = encode_field(1, blob_type) + encode_field(3, len(blob))
+    fo.write(struct.pack(">I", len(header)) + header + blob)
+
+
+def write_pbf(file_in, file_out, block_size=8000):
+    """
+        This function converts an osm xml file to a pbf file with dense nodes, used to test the reader
+
+        Args:
+            file_in(str) : first parameter, the name of the osm xml file
+            file_out(str) : second parameter, the name of the pbf file
+            block_size(int) : third parameter, the number of elements in each primitive block
+    """
+    def to_units(value):
+        return int(round(float(value) * 10000000))
+
+    def to_seconds(el):
+        return calendar.timegm(time.strptime(el.attrib["timestamp"], "%Y-%m-%dT%H:%M:%SZ"))
+
+    def flush(fo, elements):
+        strings = {"": 0}
+
+        def sid(value):
+            if isinstance(value, unicode):
+                value = value.encode("utf-8")
+            return strings.setdefault(value, len(strings))
+
+        def encode_dense(nodes):
+            keys_vals = []
+            for el in nodes:
+                for tag in el.iter("tag"):
+                    keys_vals += [sid(tag.attrib["k"]), sid(tag.attrib["v"])]
+                keys_vals.append(0)
+            info = (encode_packed(1, [int(el.attrib["version"]) for el in nodes]) +
+                    encode_packed(2, [to_seconds(el) for el in nodes], True, True) +
+                    encode_packed(3, [int(el.attrib["changeset"]) for el in nodes], True, True) +
+                    encode_packed(4, [int(el.attrib["uid"]) for el in nodes], True, True) +
+                    encode_packed(5, [sid(el.attrib["user"]) for el in nodes], True, True))
+            if "visible" in nodes[0].attrib:
+                info += encode_packed(6, [int(el.attrib["visible"] == "true") for el in nodes])
+            return (encode_packed(1, [int(el.attrib["id"]) for el in nodes], True, True) +
+                    encode_field(5, info) +
+                    encode_packed(8, [to_units(el.attrib["lat"]) for el in nodes], True, True) +
+                    encode_packed(9, [to_units(el.attrib["lon"]) for el in nodes], True, True) +
+                    encode_packed(10, keys_vals))
+
+        def encode_way(el):
+            tags = list(el.iter("tag"))
+            info = (encode_field(1, int(el.attrib["version"])) + encode_field(2, to_seconds(el)) +
+                    encode_field(3, int(el.attrib["changeset"])) + encode_field(4, int(el.attrib["uid"])) +
+                    encode_field(5, sid(el.attrib["user"])))
+            if "visible" in el.attrib:
+                info += encode_field(6, int(el.attrib["visible"] == "true"))
+            return (encode_field(1, int(el.attrib["id"])) +
+                    encode_packed(2, [sid(tag.attrib["k"]) for tag in tags]) +
+                    encode_packed(3, [sid(tag.attrib["v"]) for tag in tags]) +
+                    encode_field(4, info) +
+                    encode_packed(8, [int(nd.attrib["ref"]) for nd in el.iter("nd")], True, True))
+
+        # dense nodes share their info fields, so nodes with and without "visible" go to separate groups
+        groups = []
+        for (tag, _), run in itertools.groupby(elements, lambda el: (el.tag, "visible" in el.attrib)):
+            run = list(run)
+            if tag == "node":
+                groups.append(encode_field(2, encode_dense(run)))
+            else:
+                groups.append("".join(encode_field(3, encode_way(el)) for el in run))
+        table = "".join(encode_field(1, s) for s, _ in sorted(strings.items(), key=lambda item: item[1]))
+        write_blob(fo, "OSMData", encode_field(1, table) + "".join(encode_field(2, group) for group in groups))
+
+    with open(file_out, "wb") as fo:
+        write_blob(fo, "OSMHeader", encode_field(4, "OsmSchema-V0.6") + encode_field(4, "DenseNodes"))
+        elements = []
+        for element in process_data.iter_elements(file_in, tags=("node", "way")):
+            # keep a detached copy, iter_elements clears the parsed elements
+            copy = ET.Element(element.tag, dict(element.attrib))
+            for child in element:
+                ET.SubElement(copy, child.tag, dict(child.attrib))
+            elements.append(copy)
+            if len(elements) >= block_size:
+                flush(fo, elements)
+                elements = []
+        if elements:
+            flush(fo, elements)
+
+
+def test():
+    import os
+    import tempfile
+    assert read_varint("\xac\x02", 0) == (300, 2)
+    assert unpack_delta(encode_packed(1, [5, 3, 10, -4], True, True)[2:]) == [5, 3, 10, -4]
+    assert format_degrees(-876866303 * 100) == "-87.6866303"
+    assert format_degrees(0) == "0"
+    file_out = tempfile.mktemp(suffix=".osm.pbf")
+    try:
+        expected = process_data.process_data("exercises/example.osm")
+        os.remove("exercises/example.osm.json")
+        write_pbf("exercises/example.osm", file_out, block_size=10)
+        assert len(list(iter_blobs(file_out))) == 4
+        assert list(iter_shaped(file_out, workers=1)) == expected
+        assert list(iter_shaped(file_out, workers=2)) == expected
+        assert process_data.process_data(file_out) == expected
+        os.remove(file_out + ".json")
+
+        # a consumer slower than the workers only holds the window of shaped blobs
+        import multiprocessing.pool
+        submitted = []
+
+        class CountingPool(multiprocessing.pool.Pool):
+            def apply_async(self, *args, **kwargs):
+                submitted.append(1)
+                return multiprocessing.pool.Pool.apply_async(self, *args, **kwargs)
+        global Pool
+        pool = Pool
+        Pool = CountingPool
+        try:
+            write_pbf("exercises/example.osm", file_out, block_size=1)
+            elements = iter_shaped(file_out, workers=2)
+            assert next(elements) == expected[0] and len(submitted) == 4
+            assert [expected[0]] + list(elements) == expected and len(submitted) == len(expected)
+        finally:
+            Pool = pool
+    finally:
+        if os.path.exists(file_out):
+            os.remove(file_out)
+
+
+if __name__ == "__main__":
+    test()
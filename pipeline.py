@@ -0,0 +1,182 @@
+"""
+This code converts an osm file to json as a pipeline of three stages, each in its own process so that
+ they run at the same time: reading and parsing (decompression included), shaping, cleaning and encoding,
+ and writing. The stages are connected by bounded queues and hand over batches of elements, so the wall
+ time approaches the time of the slowest stage and at most queue_size batches wait between two stages.
+ The parse stage hands over the light (tag, attributes, node refs, tags) records of
+ expat_parser.RecordHandler, which are cheaper to pass between processes than parsed elements, the shape
+ stage hands over json lines encoded from the shaped dictionaries, so the file is the same as the one of
+ process_data, and the batches are serialized with marshal, about three times faster than the pickle of
+ the queues.
+"""
+
+import marshal
+import traceback
+import xml.parsers.expat
+from multiprocessing import Process, Queue
+
+import process_data
+from expat_parser import BLOCK_SIZE, RecordHandler
+from osm_input import open_osm
+from sinks import JsonFileSink, line_encoder
+
+# number of elements handed over at once
+BATCH_SIZE = 1000
+
+# number of batches waiting between two stages
+QUEUE_SIZE = 4
+
+
+class StageError(object):
+    """
+    Sent down the pipeline in place of a batch when a stage fails
+
+    Args:
+        stage(str) : the name of the failed stage
+        trace(str) : the formatted traceback of the error
+    """
+
+    def __init__(self, stage, trace):
+        self.stage = stage
+        self.trace = trace
+
+
+def parse_stage(file_in, out_queue, batch_size):
+    """
+        This function reads and parses the osm file, putting batches of records on the queue and None at
+         the end
+    """
+    try:
+        handler = RecordHandler()
+        parser = xml.parsers.expat.ParserCreate()
+        parser.returns_unicode = False
+        parser.StartElementHandler = handler.start
+        parser.EndElementHandler = handler.end
+        source = open_osm(file_in)
+        try:
+            while True:
+                data = source.read(BLOCK_SIZE)
+                parser.Parse(data, not data)
+                if len(handler.records) >= batch_size or not data and handler.records:
+                    out_queue.put(marshal.dumps(handler.records))
+                    handler.records = []
+                if not data:
+                    break
+        finally:
+            source.close()
+        out_queue.put(None)
+    except Exception:
+        out_queue.put(StageError("parse", traceback.format_exc()))
+
+
+def shape_stage(in_queue, out_queue, pretty, compact):
+    """
+        This function shapes the batches of records of the parse stage with process_data.shape_parts and
+         encodes them as json lines, until None or an error comes
+    """
+    try:
+        encode = line_encoder(pretty, compact)
+        shape_parts = process_data.shape_parts
+        while True:
+            batch = in_queue.get()
+            if batch is None or isinstance(batch, StageError):
+                out_queue.put(batch)
+                return
+            out_queue.put(marshal.dumps([encode(shape_parts(*record)) for record in marshal.loads(batch)]))
+    except Exception:
+        out_queue.put(StageError("shape", traceback.format_exc()))
+
+
+def process_pipelined(file_in, file_out=None, pretty=False, compact=False, batch_size=BATCH_SIZE,
+                      queue_size=QUEUE_SIZE):
+    """
+        This function converts the osm input file to json with the parse, shape and write stages running
+         in parallel, the file is the same as the one of process_data.process_data
+
+        Args:
+            file_in(str) : the first argument, the name of file to be processed, .gz and .bz2 files are
+                decompressed in the parse stage
+            file_out(str) : the second argument, the name of the json file, defaults to "<file_in>.json"
+            pretty(boolean) : the third argument, with value = False to indent the resulting json
+            compact(boolean) : the fourth argument, with value = True to write the json with compact keys
+            batch_size(int) : the fifth argument, the number of elements handed over at once
+            queue_size(int) : the sixth argument, the number of batches waiting between two stages
+
+        Returns :
+            int : the number of documents written
+
+    """
+    file_out = file_out or "{0}.json".format(file_in)
+    if file_in.endswith(".pbf"):
+        # the blobs of a pbf file are decoded and shaped in parallel already
+        return process_data.write_json(process_data.iter_shaped(file_in), file_out, pretty, compact)
+    records = Queue(queue_size)
+    shaped = Queue(queue_size)
+    stages = [Process(target=parse_stage, args=(file_in, records, batch_size)),
+              Process(target=shape_stage, args=(records, shaped, pretty, compact))]
+    for stage in stages:
+        stage.daemon = True
+        stage.start()
+    try:
+        # the write stage runs in this process
+        with JsonFileSink(file_out, pretty, compact, batch_size) as sink:
+            while True:
+                batch = shaped.get()
+                if batch is None:
+                    break
+                if isinstance(batch, StageError):
+                    raise RuntimeError("the %s stage failed:\n%s" % (batch.stage, batch.trace))
+                for line in marshal.loads(batch):
+                    sink.write_line(line)
+    except:
+        for stage in stages:
+            stage.terminate()
+        raise
+    finally:
+        for stage in stages:
+            stage.join()
+    return sink.count
+
+
+def test():
+    import os
+    import tempfile
+    import time
+    import synthetic_osm
+
+    def read_bytes(name):
+        with open(name, "rb") as fi:
+            return fi.read()
+    for name in ("exercises/example.osm", "exercises/map.osm"):
+        for compact in (False, True):
+            count = process_data.process_data(name, stream=True, compact=compact)
+            expected = read_bytes(name + ".json")
+            assert process_pipelined(name, compact=compact, batch_size=4, queue_size=1) == count
+            assert read_bytes(name + ".json") == expected
+            os.remove(name + ".json")
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        with open(file_in, "w") as fo:
+            fo.write('<osm><node id="1" lat="1" lon="1"/><node id="2"')
+        try:
+            process_pipelined(file_in)
+            assert False
+        except RuntimeError as e:
+            assert "parse stage failed" in str(e)
+        counts = synthetic_osm.generate(file_in, 12000000)
+        start = time.time()
+        process_data.process_data(file_in, stream=True, backend="expat")
+        serial = time.time() - start
+        expected = read_bytes(file_in + ".json")
+        start = time.time()
+        assert process_pipelined(file_in) == counts["nodes"] + counts["ways"]
+        print "serial %.2fs, pipelined %.2fs" % (serial, time.time() - start)
+        assert read_bytes(file_in + ".json") == expected
+    finally:
+        for name in (file_in, file_in + ".json"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    test()
@@ -1,4 +1,10 @@
+import argparse
+import array
+import bisect
+import heapq
+import random
 import xml.etree.ElementTree as ET
+from osm_input import open_osm
 
 
 OSM_FILE = "new_york_city.osm"
@@ -7,24 +13,195 @@ SAMPLE_FILE = "new_york_sample.osm"
 
 k = 10 # Parameter: take every k-th top level element
 
-# Transform to smaller sample data set
+METHODS = ('every', 'reservoir', 'stratified', 'bbox')
+TYPES = ('node', 'way', 'relation')
+
+
+# Transform to smaller sample data set, .gz and .bz2 files are decompressed on the fly
 def get_element(osm_file, tags=('node', 'way', 'relation')):
-    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    source = open_osm(osm_file)
+    try:
+        context = iter(ET.iterparse(source, events=('start', 'end')))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in tags:
+                yield elem
+                root.clear()
+    finally:
+        source.close()
+
+
+# Compact set of integer ids: a sorted array of 8 byte ids searched by bisection,
+# added ids are held in a small side set, merged into the array once it outgrows an
+# eighth of the array, so lookups between adds never rebuild the array
+MIN_PENDING = 4096
+
+
+class IdSet(object):
+    def __init__(self, ids=()):
+        self.ids = array.array('l')
+        self.pending = set()
+        self.update(ids)
+
+    def add(self, element_id):
+        self.pending.add(int(element_id))
+        if len(self.pending) > max(MIN_PENDING, len(self.ids) // 8):
+            self._merge()
+
+    def update(self, ids):
+        for element_id in ids:
+            self.add(element_id)
+
+    def _merge(self):
+        merged = array.array('l')
+        last = None
+        for element_id in heapq.merge(self.ids, sorted(self.pending)):
+            if element_id != last:
+                merged.append(element_id)
+                last = element_id
+        self.ids = merged
+        self.pending = set()
+
+    def __contains__(self, element_id):
+        element_id = int(element_id)
+        if element_id in self.pending:
+            return True
+        i = bisect.bisect_left(self.ids, element_id)
+        return i < len(self.ids) and self.ids[i] == element_id
+
+    def __len__(self):
+        if self.pending:
+            self._merge()
+        return len(self.ids)
+
+
+def node_refs(element):
+    return [nd.attrib['ref'] for nd in element.iter('nd')]
+
+
+def in_bbox(element, bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return (min_lat <= float(element.attrib['lat']) <= max_lat and
+            min_lon <= float(element.attrib['lon']) <= max_lon)
+
+
+# Pass 1: choose the sampled elements, returns a set of ids per type and the ids of the nodes
+# the sampled ways need. Memory is bounded by the sample size, not by the input size
+def select(osm_file, method='every', k=k, size=1000, bbox=None, seed=0):
+    rng = random.Random(seed)
+    selected = dict((tag, IdSet()) for tag in TYPES)
+    needed = IdSet()
+    # reservoir entries are (type, id, node refs), one reservoir for all types or one per type
+    reservoirs = dict((tag, []) for tag in TYPES)
+    seen = dict((tag, 0) for tag in TYPES)
+    for i, element in enumerate(get_element(osm_file)):
+        tag = element.tag
+        element_id = element.attrib['id']
+        if method == 'every':
+            if i % k == 0:
+                selected[tag].add(element_id)
+                needed.update(node_refs(element))
+        elif method == 'bbox':
+            if tag == 'node':
+                keep = in_bbox(element, bbox)
+            elif tag == 'way':
+                keep = any(ref in selected['node'] for ref in node_refs(element))
+            else:
+                keep = any(member.attrib['ref'] in selected[member.attrib['type']]
+                           for member in element.iter('member') if member.attrib['type'] in ('node', 'way'))
+            if keep:
+                selected[tag].add(element_id)
+                needed.update(node_refs(element))
+        else:
+            key = tag if method == 'stratified' else 'node'
+            reservoir = reservoirs[key]
+            seen[key] += 1
+            entry = (tag, element_id, array.array('l', [int(ref) for ref in node_refs(element)]))
+            if len(reservoir) < size:
+                reservoir.append(entry)
+            else:
+                j = rng.randrange(seen[key])
+                if j < size:
+                    reservoir[j] = entry
+    for reservoir in reservoirs.values():
+        for tag, element_id, refs in reservoir:
+            selected[tag].add(element_id)
+            needed.update(refs)
+    return selected, needed
+
+
+# Pass 2: write the sampled elements and the nodes they need, in input order
+def write_sample(osm_file, sample_file, selected, needed):
+    count = 0
+    with open(sample_file, 'wb') as output:
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        output.write('<osm>\n  ')
+        for element in get_element(osm_file):
+            element_id = element.attrib['id']
+            if element_id in selected[element.tag] or (element.tag == 'node' and element_id in needed):
+                output.write(ET.tostring(element, encoding='utf-8'))
+                count += 1
+        output.write('</osm>')
+    return count
+
+
+def prepare_sample(osm_file, sample_file, method='every', k=k, size=1000, bbox=None, seed=0):
+    selected, needed = select(osm_file, method, k, size, bbox, seed)
+    return write_sample(osm_file, sample_file, selected, needed)
+
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a referentially complete sample of an osm file')
+    parser.add_argument('osm_file', nargs='?', default=OSM_FILE)
+    parser.add_argument('sample_file', nargs='?', default=SAMPLE_FILE)
+    parser.add_argument('--method', choices=METHODS, default='every',
+                        help='every k-th element, a reservoir of SIZE elements, a reservoir of SIZE elements '
+                             'per type, or the elements in a bounding box')
+    parser.add_argument('-k', type=int, default=k, help='sample every k-th top level element')
+    parser.add_argument('--size', type=int, default=1000, help='reservoir size')
+    parser.add_argument('--bbox', help='min_lat,min_lon,max_lat,max_lon')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    bbox = None
+    if args.method == 'bbox':
+        if not args.bbox:
+            parser.error('--bbox is required by the bbox method')
+        bbox = [float(value) for value in args.bbox.split(',')]
+    count = prepare_sample(args.osm_file, args.sample_file, args.method, args.k, args.size, bbox, args.seed)
+    print "%d elements written to %s" % (count, args.sample_file)
 
-with open(SAMPLE_FILE, 'wb') as output:
-    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-    output.write('<osm>\n  ')
 
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            output.write(ET.tostring(element, encoding='utf-8'))
+def test():
+    import os
+    import tempfile
+    sample_file = tempfile.mktemp(suffix='.osm')
+    try:
+        for osm_file in ('exercises/example.osm', 'exercises/map.osm'):
+            for method in METHODS:
+                prepare_sample(osm_file, sample_file, method, k=3, size=2,
+                               bbox=(41.97, -87.70, 41.9735, -87.68))
+                elements = list(get_element(sample_file))
+                node_ids = set(el.attrib['id'] for el in elements if el.tag == 'node')
+                input_node_ids = set(el.attrib['id'] for el in get_element(osm_file, ('node',)))
+                ways = [el for el in elements if el.tag == 'way']
+                for way in ways:
+                    assert set(node_refs(way)) & input_node_ids <= node_ids
+                if method == 'stratified':
+                    assert len(ways) == len([el for el in get_element(osm_file, ('way',))])
+        assert len(IdSet(['5', '3', '3'])) == 2
+        ids = IdSet()
+        ids.update(['7', '1'])
+        assert '1' in ids and '2' not in ids
+        ids.add('2')
+        assert 2 in ids
+        ids = IdSet(str(i) for i in range(0, 20000, 2))
+        assert len(ids.pending) < MIN_PENDING
+        assert all(str(i) in ids for i in range(0, 20000, 2)) and '3' not in ids
+        assert len(ids) == 10000 and not ids.pending
+    finally:
+        if os.path.exists(sample_file):
+            os.remove(sample_file)
 
-    output.write('</osm>')
 
+if __name__ == '__main__':
+    main()
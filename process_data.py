@@ -4,17 +4,17 @@ This code is for processing and clean the Open Street Map data set for New York
 """
 
 import xml.etree.ElementTree as ET
+import marshal
 import re
 import pprint
-import codecs
-import json
+import tempfile
 
-# regular expression for lower case characters
-lower = re.compile(r'^([a-z]|_)*$')
-# regular expression for lower case characters containing colon
-lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
-# regular expression for problem characters
-problem_chars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+import key_classifier
+from key_classifier import lower, lower_colon, problem_chars
+from name_normalizer import NameNormalizer
+from node_index import NodeIndexBuilder
+from osm_input import open_osm
+from sinks import JsonFileSink, drain
 
 # list for created values
 CREATED = ["version", "changeset", "timestamp", "user", "uid"]
@@ -59,6 +59,9 @@ mapping = {
     "W": "West"
 }
 
+# normalizer for street/city names, built once from the mapping above
+name_normalizer = NameNormalizer(mapping, expected)
+
 
 def is_ascii(values):
     """
@@ -70,7 +73,7 @@ def is_ascii(values):
     Returns:
          bool: The return value. True for success, False otherwise.
     """
-    return all(ord(chars) < 128 for chars in values)
+    return key_classifier.is_ascii(values)
 
 
 def update_postcode(zip_code):
@@ -127,9 +130,21 @@ def find_positions(element):
                 array: The return value, the lat/lon attributes of the element
 
     """
-    lst = {float(element.attrib["lat"]), float(element.attrib["lon"])}
-    pos = list(lst)
-    return pos
+    return attrib_positions(element.attrib)
+
+
+def attrib_positions(attrib):
+    """
+        This function returns an array of latitude and longitude corresponding to the lat/lon attributes
+
+        Args:
+            attrib(dict) : first parameter, the attributes of the element
+
+        Returns:
+                array: The return value, the lat/lon attributes
+
+    """
+    return [float(attrib["lat"]), float(attrib["lon"])]
 
 
 def retrieve_address(child, element_tag):
@@ -142,97 +157,179 @@ def retrieve_address(child, element_tag):
         Returns:
             str: the corresponding/updated value
 
+    """
+    return clean_address(child.attrib['k'], child.attrib['v'], element_tag)
+
+
+def clean_address(k, v, element_tag):
+    """
+        This function cleans the value of an address tag
+
+        Args:
+            k(str): key of the tag
+            v(str): value of the tag
+            element_tag: key of the tag split on ':'
+        Returns:
+            str: the corresponding/updated value
+
     """
     if len(element_tag) == 2:
-        if child.attrib['k'] == "addr:street" or child.attrib['k'] == "addr:city":
-            return update_name(child.attrib['v'], mapping)
+        if k == "addr:street" or k == "addr:city":
+            return name_normalizer.normalize(v)
         elif element_tag[1] == "postcode":
-            postcode=update_postcode(child.attrib['v'])
+            postcode=update_postcode(v)
             if postcode is False:
                 return ""
             else:
                 return postcode
         # process other address tags of level two
         else:
-                return child.attrib['v']
+                return v
 
 
-def shape_element(element):
+def shape_attributes(node, tag, attrib):
     """
-        This function processes and cleans the values of the data set
+        This function adds the attributes of a node/way to its dictionary
 
         Args:
-            element(element) : first parameter, the element iterated
+            node(dict) : first parameter, the dictionary of the element
+            tag(str) : second parameter, "node" or "way"
+            attrib(dict) : third parameter, the attributes of the element
+
+    """
+    created = {}  # dictionary for created
+    node["type"] = tag
+    for key in attrib.keys():
+        value = attrib[key]
+        # check if attribute is among created attributes
+        if key in CREATED:
+            created[key] = value
+        # add latitude/longitude attributes to array "pos"
+        elif key in "lat" or key in "lon":
+            node["pos"] = attrib_positions(attrib)
+        else:
+            # add other attributes as it is
+            node[key] = value
+        # created dictionary
+        node["created"] = created
+
+
+def shape_tag(node, address_dict, other_keys, k, v, clean=clean_address):
+    """
+        This function adds a <tag> of a node/way to its dictionary
+
+        Args:
+            node(dict) : first parameter, the dictionary of the element
+            address_dict(dict) : second parameter, the dictionary for address
+            other_keys(dict) : third parameter, the dictionary for other tags in use
+            k(str) : fourth parameter, the key of the tag
+            v(str) : fifth parameter, the value of the tag
+            clean(function) : sixth parameter, the function cleaning the address values, clean_address or
+                a timed wrapper of it
 
         Returns:
-            node(dict) : dictionary of the key/value pair of the cleaned dataset
+            other_keys(dict) : the dictionary for other tags to be used for the next tag
 
     """
+    # classify the key once, the parts split on ':' are cached with its category
+    _, valid_key, element_tag = key_classifier.classify(k)
+    # determine if attribute key/value is valid
+    if valid_key and is_ascii(v):
+        # handle street values and update if needed
+        if k.startswith("addr:"):
+            updated_value=clean(k, v, element_tag)
+            if updated_value:
+                address_dict[element_tag[1]] = updated_value
+        # process other tag attributes
+        else:
+            # if attribute does not contain ':' put it as key/value pair
+            if len(element_tag) <= 1:
+                node[k] = v
+            # if attribute contains colon then process only second level tags
+            elif len(element_tag) == 2:
+                other_attribute = element_tag[0]
+                # if tag name already not added to 'node' dictionary then add it as dictionary
+                if not node.has_key(other_attribute):
+                    other_keys = {}
+                else:
+                    obj = node.get(other_attribute)
+                    # determine object type if is string and already present, then set it as dictionary in 'other_keys'
+                    if type(obj) is str:
+                        other_keys = {}
+                        other_keys[other_attribute] = obj
+                    del node[other_attribute]
+                # add the new key/value pair to 'other_keys' dictionary and and add to node
+                    other_keys[element_tag[1]] = v
+                node[other_attribute] = other_keys
+    return other_keys
+
+
+def shape_parts(tag, attrib, node_refs, tags, clean=clean_address):
+    """
+        This function builds the dictionary of a node/way from its parts, shared by shape_element and the
+         expat callbacks of expat_parser and pipeline
+
+        Args:
+            tag(str) : first parameter, "node" or "way"
+            attrib(dict) : second parameter, the attributes of the element
+            node_refs(list) : third parameter, the ref of each <nd> child
+            tags(list) : fourth parameter, the (k, v) of each <tag> child
+            clean(function) : fifth parameter, the function cleaning the address values, see shape_tag
 
+        Returns:
+            node(dict) : dictionary of the key/value pair of the cleaned dataset
+
+    """
     node = {}  # dictionary for tag
-    node_refs = []  # list for node references
-    created = {}  # dictionary for created
     address_dict = {}  # dictionary for address
     other_keys = {}  # dictionary for other tags
+    shape_attributes(node, tag, attrib)
+    for k, v in tags:
+        other_keys = shape_tag(node, address_dict, other_keys, k, v, clean)
+    # check if node_refs,address_dict have length then add to node dictionary
+    if len(node_refs) > 0:
+        node["node_refs"] = node_refs
+    if len(address_dict) > 0:
+        node["address"] = address_dict
+    return node
+
+
+def shape_element(element, clean=clean_address):
+    """
+        This function processes and cleans the values of the data set
+
+        Args:
+            element(element) : first parameter, the element iterated
+            clean(function) : second parameter, the function cleaning the address values, see shape_tag
+
+        Returns:
+            node(dict) : dictionary of the key/value pair of the cleaned dataset
+
+    """
     if element.tag == "node" or element.tag == "way":
-        node["type"] = element.tag
-        for key in element.attrib.keys():
-            value = element.attrib[key]
-            # check if attribute is among created attributes
-            if key in CREATED:
-                created[key] = value
-            # add latitude/longitude attributes to array "pos"
-            elif key in "lat" or key in "lon":
-                node["pos"] = find_positions(element)
-            else:
-                # add other attributes as it is
-                node[key] = value
-            # created dictionary
-            node["created"] = created
-        # iterate child tag elements
-        for child in element:
-            # if attribute tag is "nd"
-            if child.tag == "nd":
-                node_refs.append(child.attrib["ref"])
-            # determine if attribute key/value is valid
-            elif is_valid(child):
-                # handle street values and update if needed
-                element_tag = child.attrib['k'].split(":")
-                if child.attrib['k'].startswith("addr:"):
-                    updated_value=retrieve_address(child, element_tag)
-                    if updated_value:
-                        address_dict[element_tag[1]] = updated_value
-                # process other tag attributes
-                else:
-                    # if attribute does not contain ':' put it as key/value pair
-                    if len(element_tag) <= 1:
-                        node[child.attrib['k']] = child.attrib['v']
-                    # if attribute contains colon then process only second level tags
-                    elif len(element_tag) == 2:
-                        other_attribute = element_tag[0]
-                        # if tag name already not added to 'node' dictionary then add it as dictionary
-                        if not node.has_key(other_attribute):
-                            other_keys = {}
-                        else:
-                            obj = node.get(other_attribute)
-                            # determine object type if is string and already present, then set it as dictionary in 'other_keys'
-                            if type(obj) is str:
-                                other_keys = {}
-                                other_keys[other_attribute] = obj
-                            del node[other_attribute]
-                        # add the new key/value pair to 'other_keys' dictionary and and add to node
-                            other_keys[element_tag[1]] = child.attrib['v']
-                        node[other_attribute] = other_keys
-        # check if node_refs,address_dict have length then add to node dictionary
-        if len(node_refs) > 0:
-            node["node_refs"] = node_refs
-        if len(address_dict) > 0:
-            node["address"] = address_dict
-        return node
+        tag, attrib, node_refs, tags = element_parts(element)
+        return shape_parts(tag, attrib, node_refs, tags, clean)
     else:
         return None
 
 
+def element_parts(element):
+    """
+        This function returns the (tag, attributes, node references, (k, v) tags) of a node or way element,
+         the arguments of shape_parts
+    """
+    node_refs = []  # list for node references
+    tags = []  # list for the (k, v) of the tags
+    # iterate child tag elements
+    for child in element:
+        # if attribute tag is "nd"
+        if child.tag == "nd":
+            node_refs.append(child.attrib["ref"])
+        else:
+            tags.append((child.attrib['k'], child.attrib['v']))
+    return element.tag, element.attrib, node_refs, tags
+
+
 def is_valid(element):
     """
         This function checks if keys of the tag are valid or not
@@ -244,40 +341,240 @@ def is_valid(element):
             bool: The return value. True for success, False otherwise.
 
     """
-    l = lower.search(element.attrib['k'])
-    lc = lower_colon.search(element.attrib['k'])
-    pc = problem_chars.search(element.attrib['k'])
+    return is_valid_tag(element.attrib['k'], element.attrib['v'])
+
+
+def is_valid_tag(k, v):
+    """
+        This function checks if the key and value of a tag are valid or not
+
+        Args:
+            k(str) : The first parameter, the key of the tag
+            v(str) : The second parameter, the value of the tag
+
+        Returns:
+            bool: The return value. True for success, False otherwise.
+
+    """
     # if problem characters found return false
-    if pc or not is_ascii(element.attrib['v']):
+    if not key_classifier.classify(k)[1] or not is_ascii(v):
         return False
     else:
         return True
 
 
-def process_data(file_in, pretty=False):
+def iter_elements(file_in, tags=('node', 'way', 'relation'), stats=None):
+    """
+        This function iterates the top level elements of the osm file, clearing each one once it has been consumed
+
+        Args:
+            file_in(str) : the first argument, the name (or file object) of the file to be parsed, .gz and
+                .bz2 files are decompressed on the fly and .pbf files are decoded by pbf_reader
+            tags(tuple) : the second argument, the top level tags to be yielded
+            stats : the third argument, an instrumentation.Stats counting the bytes read and timing the parse
+
+        Returns :
+            generator : the parsed top level elements
+
+    """
+    if stats is not None:
+        return stats.timed_iter("parse", _iter_elements(file_in, tags, stats))
+    return _iter_elements(file_in, tags, None)
+
+
+def _iter_elements(file_in, tags, stats):
+    if isinstance(file_in, basestring) and file_in.endswith(".pbf"):
+        import pbf_reader
+        for element in pbf_reader.iter_elements(file_in):
+            if element.tag in tags:
+                yield element
+        return
+    opened = isinstance(file_in, basestring)
+    source = open_osm(file_in) if opened else file_in
+    if stats is not None:
+        source = stats.reader(source)
+    try:
+        context = iter(ET.iterparse(source, events=('start', 'end')))
+        _, root = next(context)
+        for event, element in context:
+            if event == 'end' and element.tag in tags:
+                yield element
+                # free the element and its already processed siblings
+                root.clear()
+    finally:
+        if opened:
+            source.close()
+
+
+def iter_shaped(file_in, geometry=False, backend="etree", keep=None, stats=None):
+    """
+        This function streams the shaped elements of the osm file without keeping them in memory
+
+        Args:
+            file_in(str) : the first argument, the name of file to be processed
+            geometry(boolean) : the second argument, with value = True to index the node coordinates
+                and add the "geometry" of each way, see node_index. The elements from the first way on
+                are spooled to a temporary file and shaped at the end, so nodes listed after a way are
+                resolved too
+            backend(str) : the third argument, "etree" to parse with ET.iterparse or "expat" to shape the
+                elements from the pyexpat callbacks, see expat_parser
+            keep(function) : the fourth argument, a filter called with each parsed element before it is
+                shaped, the elements it returns False for are skipped, see spatial_filter
+            stats : the fifth argument, an instrumentation.Stats timing the parse, shape_element and
+                clean_address stages of this run only
+
+        Returns :
+            generator : the shaped node/way dictionaries
+
+    """
+    if backend not in ("etree", "expat"):
+        raise ValueError("unknown parse backend: %s" % backend)
+    if keep is not None and backend == "expat":
+        raise ValueError("element filters are checked on parsed elements, use the etree backend")
+    if not geometry and keep is None and isinstance(file_in, basestring) and file_in.endswith(".pbf"):
+        # the blobs of a pbf file are decoded and shaped in parallel
+        import pbf_reader
+        for el in pbf_reader.iter_shaped(file_in, stats=stats):
+            yield el
+        return
+    if backend == "expat":
+        if geometry:
+            raise ValueError("the expat backend does not resolve way geometry")
+        import expat_parser
+        for el in expat_parser.iter_shaped(file_in, stats=stats):
+            yield el
+        return
+    shape = shape_element
+    clean = clean_address
+    if stats is not None:
+        shape = stats.timed("shape_element", shape_element)
+        clean = stats.timed("clean_address", clean_address)
+    if not geometry:
+        for element in iter_elements(file_in, stats=stats):
+            if keep is not None and not keep(element):
+                continue
+            el = shape(element, clean)
+            if el:
+                yield el
+        return
+    builder = NodeIndexBuilder()
+    index = None
+    spool = None  # the kept elements from the first way on, shaped once every node is indexed
+    try:
+        for element in iter_elements(file_in, stats=stats):
+            if element.tag == "node":
+                builder.add(element.attrib["id"], element.attrib["lat"], element.attrib["lon"])
+            if keep is not None and not keep(element):
+                continue
+            if spool is None and element.tag == "way":
+                # a node may still follow, so the ways wait for the end of the file
+                spool = tempfile.TemporaryFile()
+            if spool is None:
+                el = shape(element, clean)
+                if el:
+                    yield el
+            elif element.tag == "node" or element.tag == "way":
+                tag, attrib, node_refs, tags = element_parts(element)
+                marshal.dump((tag, dict(attrib), node_refs, tags), spool)
+        index = builder.finish()
+        if spool is None:
+            return
+        shape = shape_parts
+        if stats is not None:
+            shape = stats.timed("shape_element", shape_parts)
+        spool.seek(0)
+        while True:
+            try:
+                tag, attrib, node_refs, tags = marshal.load(spool)
+            except EOFError:
+                break
+            el = shape(tag, attrib, node_refs, tags, clean)
+            if el and tag == "way":
+                el["geometry"] = index.resolve(node_refs)
+            if el:
+                yield el
+    finally:
+        if spool is not None:
+            spool.close()
+        if index is None:
+            index = builder.finish()
+        index.close()
+
+
+def write_json(elements, file_out, pretty=False, compact=False, stats=None):
+    """
+        This function writes the shaped elements to the json file one document per line
+
+        Args:
+            elements(iterable) : the first argument, the shaped elements to be written
+            file_out(str) : the second argument, the name of the output file, gzip compressed if it ends in .gz
+            pretty(boolean) : the third argument, with value = False to indent the resulting json
+            compact(boolean) : the fourth argument, with value = True to write the fixed fields with short
+                names, see sinks.compact_keys
+            stats : the fifth argument, an instrumentation.Stats timing the json_encode and write stages
+
+        Returns :
+            int : the number of documents written
+
+    """
+    return drain(elements, JsonFileSink(file_out, pretty, compact, stats=stats))
+
+
+def process_data(file_in, pretty=False, stream=False, sink=None, geometry=False, backend="etree", stats=None,
+                 compress=False, compact=False, keep=None, records=False):
     """
         This function processes the osm input file to be converted to json
 
         Args:
             file_in(str) : the first argument, the name of file to be processed
             pretty(boolean) : the second argument, with value = False to indent the resulting json
+            stream(boolean) : the third argument, with value = True to write the json without keeping
+                the result list in memory
+            sink : the fourth argument, the sink the shaped elements are written to instead of the json file,
+                such as sinks.MongoSink, or sinks.PartitionedSink for json files partitioned by type and tile
+            geometry(boolean) : the fifth argument, with value = True to add the coordinates of each way's nodes
+            backend(str) : the sixth argument, the parse backend, "etree" or "expat"
+            stats : the seventh argument, an instrumentation.Stats timing the stages of the run and
+                reporting its progress
+            compress(boolean) : the eighth argument, with value = True to write "<file_in>.json.gz"
+            compact(boolean) : the ninth argument, with value = True to write the json with compact keys
+            keep(function) : the tenth argument, a filter of the parsed elements checked before shaping,
+                such as spatial_filter.SpatialFilter
+            records(boolean) : the eleventh argument, with value = True to return the resulting json as a
+                compact_records.ElementList, which takes several times less memory than a list of dicts
 
         Returns :
-            data(array) : the resulting json
+            data(array) : the resulting json, or the number of documents written when streaming or
+                writing to a sink
 
     """
-    file_out = "{0}.json".format(file_in)
-    data = []
-    with codecs.open(file_out, "w") as fo:
-        for _, element in ET.iterparse(file_in):
-            el = shape_element(element)
-            if el:
-                data.append(el)
-                if pretty:
-                    fo.write(json.dumps(el, indent=2) + "\n")
-                else:
-                    fo.write(json.dumps(el) + "\n")
-    return data
+    elements = iter_shaped(file_in, geometry, backend, keep, stats)
+    try:
+        if stats is not None:
+            stats.start(file_in)
+            elements = stats.track(elements)
+        if sink is not None:
+            return drain(elements, sink)
+        file_out = "{0}.json.gz".format(file_in) if compress else "{0}.json".format(file_in)
+        if stream:
+            return write_json(elements, file_out, pretty, compact, stats)
+        if records:
+            from compact_records import ElementList
+            data = ElementList()
+
+            def appended(elements):
+                # the dictionaries themselves are written, so the file is the same as without records
+                for el in elements:
+                    data.append(el)
+                    yield el
+            write_json(appended(elements), file_out, pretty, compact, stats)
+            return data
+        data = list(elements)
+        write_json(data, file_out, pretty, compact, stats)
+        return data
+    finally:
+        if stats is not None:
+            stats.finish()
 
 
 def test():
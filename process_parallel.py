@@ -0,0 +1,237 @@
+"""
+This code converts a single osm file to json using a pool of processes. The file is split into byte
+ ranges on top level node/way/relation boundaries, each shard is shaped by process_data.shape_element
+ in its own process and the shard outputs are merged in order into one json lines file.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+from multiprocessing import Pool, cpu_count
+
+import process_data
+from osm_input import is_compressed
+
+# regular expression for the start of a top level element, these tags never nest in osm files
+top_level_re = re.compile(r'<(node|way|relation)[\s/>]')
+
+# size of the blocks read while looking for shard boundaries
+BLOCK_SIZE = 1 << 20
+
+
+class ShardReader(object):
+    """
+    File like object reading the byte range [start, end) of an osm file wrapped in an <osm> root tag,
+    so that it can be parsed on its own by ET.iterparse
+    """
+
+    def __init__(self, file_in, start, end):
+        self.fo = open(file_in, "rb")
+        self.fo.seek(start)
+        self.remaining = end - start
+        self.pending = '<?xml version="1.0" encoding="UTF-8"?>\n<osm>'
+        self.closed = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.remaining + len(self.pending) + len("</osm>")
+        chunks = []
+        if self.pending:
+            chunks.append(self.pending[:size])
+            self.pending = self.pending[size:]
+            size -= len(chunks[0])
+        if size > 0 and self.remaining > 0:
+            chunk = self.fo.read(min(size, self.remaining))
+            self.remaining -= len(chunk)
+            if not chunk:
+                self.remaining = 0
+            size -= len(chunk)
+            chunks.append(chunk)
+        if size > 0 and self.remaining == 0 and not self.closed:
+            self.closed = True
+            self.pending = "</osm>"
+            chunks.append(self.pending[:size])
+            self.pending = self.pending[size:]
+        return "".join(chunks)
+
+    def close(self):
+        self.fo.close()
+
+
+def find_boundary(fo, offset, limit):
+    """
+        This function finds the byte offset of the first top level element starting at or after offset
+
+        Args:
+            fo(file) : the first argument, the osm file opened in binary mode
+            offset(int) : the second argument, the byte offset to start searching from
+            limit(int) : the third argument, the byte offset at which to give up
+
+        Returns:
+            int : the offset of the element start, or limit if none is found
+
+    """
+    fo.seek(offset)
+    carry = ""
+    while offset < limit:
+        block = fo.read(BLOCK_SIZE)
+        if not block:
+            break
+        data = carry + block
+        m = top_level_re.search(data)
+        if m:
+            return min(offset - len(carry) + m.start(), limit)
+        # keep the tail in case a tag is split across two blocks
+        carry = data[-16:]
+        offset += len(block)
+    return limit
+
+
+def find_body(fo):
+    """
+        This function finds the byte range of the top level elements of the osm file, between the opening
+         and the closing root tags
+
+        Args:
+            fo(file) : the first argument, the osm file opened in binary mode
+
+        Returns:
+            tuple : the offset of the first top level element and the offset of the closing root tag
+
+    """
+    fo.seek(0, os.SEEK_END)
+    size = fo.tell()
+    fo.seek(max(0, size - BLOCK_SIZE))
+    tail = fo.read()
+    end = size - len(tail) + tail.rfind("</osm>")
+    return find_boundary(fo, 0, end), end
+
+
+def find_shards(file_in, shards):
+    """
+        This function splits the osm file into byte ranges on top level element boundaries
+
+        Args:
+            file_in(str) : the first argument, the name of the osm file
+            shards(int) : the second argument, the number of shards wanted
+
+        Returns:
+            list : (start, end) byte ranges, in file order
+
+    """
+    with open(file_in, "rb") as fo:
+        # the last shard stops before the closing root tag
+        start, end = find_body(fo)
+        bounds = [start]
+        for i in range(1, shards):
+            cut = find_boundary(fo, max(start + (end - start) * i // shards, bounds[-1] + 1), end)
+            if cut > bounds[-1]:
+                bounds.append(cut)
+        bounds.append(end)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def shape_shard(args):
+    """
+        This function shapes one shard of the osm file and writes it to a temporary json lines file
+
+        Args:
+            args(tuple) : the osm file name, the shard byte range, the output file name, the pretty flag and
+                the parse backend
+
+        Returns:
+            tuple : the name of the shard output file and the number of documents written
+
+    """
+    file_in, (start, end), file_out, pretty, backend = args
+    reader = ShardReader(file_in, start, end)
+    try:
+        count = process_data.write_json(process_data.iter_shaped(reader, backend=backend), file_out, pretty)
+    finally:
+        reader.close()
+    return file_out, count
+
+
+def process_parallel(file_in, workers=None, pretty=False, shards_per_worker=4, backend="etree"):
+    """
+        This function converts the osm input file to json using a pool of worker processes, the
+         output is identical to process_data.process_data
+
+        Args:
+            file_in(str) : the first argument, the name of file to be processed
+            workers(int) : the second argument, the number of processes, defaults to the cpu count
+            pretty(boolean) : the third argument, with value = False to indent the resulting json
+            shards_per_worker(int) : the fourth argument, the number of shards given to each worker
+            backend(str) : the fifth argument, the parse backend of process_data, "etree" or "expat"
+
+        Returns :
+            int : the number of documents written
+
+    """
+    if is_compressed(file_in):
+        # byte ranges of a compressed file cannot be parsed on their own
+        raise ValueError("parallel conversion needs an uncompressed osm file: %s" % file_in)
+    workers = workers or cpu_count()
+    file_out = "{0}.json".format(file_in)
+    if file_in.endswith(".pbf"):
+        # pbf files are split on their blobs instead of byte ranges
+        import pbf_reader
+        return process_data.write_json(pbf_reader.iter_shaped(file_in, workers), file_out, pretty)
+    shards = find_shards(file_in, workers * shards_per_worker)
+    tmp_dir = tempfile.mkdtemp(prefix="osm_shards_")
+    tasks = [(file_in, shard, os.path.join(tmp_dir, "%05d.json" % i), pretty, backend)
+             for i, shard in enumerate(shards)]
+    pool = Pool(workers)
+    count = 0
+    try:
+        with open(file_out, "wb") as fo:
+            # imap returns the shards in order, so they are merged while later shards are shaped
+            for part, part_count in pool.imap(shape_shard, tasks):
+                with open(part, "rb") as fi:
+                    shutil.copyfileobj(fi, fo)
+                os.remove(part)
+                count += part_count
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return count
+
+
+def test():
+    import time
+    import synthetic_osm
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        synthetic_osm.generate(file_in, 5000000)
+        start = time.time()
+        serial_count = process_data.process_data(file_in, stream=True)
+        serial_time = time.time() - start
+        with open(file_in + ".json", "rb") as fi:
+            serial = fi.read()
+        for workers in (1, 2, 4):
+            start = time.time()
+            assert process_parallel(file_in, workers) == serial_count
+            print "%d workers: %.2fs (serial %.2fs)" % (workers, time.time() - start, serial_time)
+            with open(file_in + ".json", "rb") as fi:
+                assert fi.read() == serial
+        for name in ("exercises/example.osm", "exercises/map.osm"):
+            process_data.process_data(name, stream=True)
+            with open(name + ".json", "rb") as fi:
+                serial = fi.read()
+            process_parallel(name, 3, shards_per_worker=3, backend="expat")
+            with open(name + ".json", "rb") as fi:
+                assert fi.read() == serial
+            os.remove(name + ".json")
+    finally:
+        for name in (file_in, file_in + ".json"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    test()
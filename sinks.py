@@ -0,0 +1,712 @@
+"""
+This code holds the output sinks the shaped elements of process_data are written to. A sink has a write
+ method taking one document, a close method and a count of the documents written, so that the json file
+ can be replaced by a direct load into Mongo Db without the intermediate file and mongoimport, or by a
+ directory of json files partitioned by element type and spatial tile that can be loaded in parallel.
+"""
+
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from Queue import Queue
+
+# code of the write errors of documents already in the collection
+DUPLICATE_KEY = 11000
+
+
+# short names of the fixed fields of the shaped documents used by the compact-key mode, '@' is a problem
+# character so no tag key can take one of these names
+COMPACT_KEYS = {"id": "@i", "type": "@t", "visible": "@v", "created": "@c", "pos": "@p", "node_refs": "@r",
+                "address": "@a", "geometry": "@g"}
+COMPACT_CREATED_KEYS = {"version": "@v", "changeset": "@c", "timestamp": "@t", "user": "@u", "uid": "@i"}
+COMPACT_ADDRESS_KEYS = {"street": "@s", "housenumber": "@h", "postcode": "@p", "city": "@c"}
+
+
+def compact_keys(doc):
+    """
+        This function returns the document with the fixed field names replaced by their short names
+
+        Args:
+            doc(dict) : the first argument, the shaped element
+
+        Returns :
+            dict : the document with compact keys
+
+    """
+    compact = {}
+    for k, v in doc.iteritems():
+        # a "created" or "address" tag replaces the dictionary, see process_data.shape_tag
+        if k == "created" and isinstance(v, dict):
+            v = dict((COMPACT_CREATED_KEYS.get(ck, ck), cv) for ck, cv in v.iteritems())
+        elif k == "address" and isinstance(v, dict):
+            v = dict((COMPACT_ADDRESS_KEYS.get(ak, ak), av) for ak, av in v.iteritems())
+        compact[COMPACT_KEYS.get(k, k)] = v
+    return compact
+
+
+def expand_keys(doc):
+    """
+        This function restores the field names of a document written in the compact-key mode
+
+        Args:
+            doc(dict) : the first argument, the document with compact keys
+
+        Returns :
+            dict : the shaped element
+
+    """
+    expanded = {}
+    for k, v in doc.iteritems():
+        k = EXPANDED_KEYS.get(k, k)
+        if k == "created" and isinstance(v, dict):
+            v = dict((EXPANDED_CREATED_KEYS.get(ck, ck), cv) for ck, cv in v.iteritems())
+        elif k == "address" and isinstance(v, dict):
+            v = dict((EXPANDED_ADDRESS_KEYS.get(ak, ak), av) for ak, av in v.iteritems())
+        expanded[k] = v
+    return expanded
+
+
+EXPANDED_KEYS = dict((v, k) for k, v in COMPACT_KEYS.iteritems())
+EXPANDED_CREATED_KEYS = dict((v, k) for k, v in COMPACT_CREATED_KEYS.iteritems())
+EXPANDED_ADDRESS_KEYS = dict((v, k) for k, v in COMPACT_ADDRESS_KEYS.iteritems())
+
+
+def json_encoder(pretty=False, compact=False):
+    """
+        This function returns the function encoding one document as json. The default format is the one of
+         the json module whatever is installed, so the files read back by osc_update stay the same, and the
+         compact mode, which has no spaces to match, uses ujson when it is installed
+
+        Args:
+            pretty(boolean) : the first argument, with value = True to indent the json
+            compact(boolean) : the second argument, with value = True to leave out the spaces after the
+                separators
+
+        Returns :
+            function : the encoder
+
+    """
+    if pretty:
+        return json.JSONEncoder(indent=2).encode
+    if compact:
+        try:
+            import ujson
+        except ImportError:
+            return json.JSONEncoder(separators=(",", ":")).encode
+        return lambda doc: ujson.dumps(doc, ensure_ascii=True, escape_forward_slashes=False)
+    return json.JSONEncoder().encode
+
+
+def line_encoder(pretty=False, compact=False):
+    """
+        This function returns the function encoding one document as a line of a json file written by
+         JsonFileSink with the same settings
+    """
+    encoder = json_encoder(pretty, compact)
+    if compact:
+        return lambda doc: encoder(compact_keys(doc)) + "\n"
+    return lambda doc: encoder(doc) + "\n"
+
+
+class JsonFileSink(object):
+    """
+    Writes the documents to a json file, one document per line. Encoded documents are buffered and written
+    batch_size at a time, and a file name ending in .gz is written gzip compressed as a stream.
+
+    Args:
+        file_out(str) : the name of the output file
+        pretty(boolean) : with value = False to indent the resulting json
+        compact(boolean) : with value = True to write the fixed fields with their short names, see
+            compact_keys, and without spaces after the separators
+        batch_size(int) : the number of documents written at once
+        compresslevel(int) : the gzip compression level of .gz output
+        append(boolean) : with value = True to add the documents to the end of an existing file
+        stats : an instrumentation.Stats timing the json_encode and write stages of this sink
+    """
+
+    def __init__(self, file_out, pretty=False, compact=False, batch_size=1000, compresslevel=3, append=False,
+                 stats=None):
+        mode = "ab" if append else "wb"
+        if file_out.endswith(".gz"):
+            self.fo = gzip.open(file_out, mode, compresslevel)
+        else:
+            self.fo = open(file_out, mode)
+        self.pretty = pretty
+        self.compact = compact
+        self.batch_size = batch_size
+        self.encode_line = line_encoder(pretty, compact)
+        self.buffer = []
+        self.count = 0
+        if stats is not None:
+            # the timers wrap the methods of this sink only
+            self.encode = stats.timed("json_encode", self.encode)
+            self.write = stats.timed("write", self.write)
+
+    def encode(self, doc):
+        return self.encode_line(doc)
+
+    def write(self, doc):
+        self.write_line(self.encode(doc))
+
+    def write_line(self, line):
+        """
+            This function writes a document already encoded by a sink with the same settings
+        """
+        self.buffer.append(line)
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.fo.write("".join(self.buffer))
+            self.buffer = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.fo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MongoSink(object):
+    """
+    Loads the documents into a Mongo Db collection with batched, unordered insert_many calls. Batches are
+    handed to background threads through a bounded queue, so conversion waits once max_in_flight batches
+    are queued and loading overlaps with conversion. A batch is retried after a connection error, and after
+    a bulk write error only its failed documents are sent again. Duplicate key errors count as inserted,
+    since pymongo adds the _id to the documents and a resent document may have landed already. Documents
+    still failing after the retries are kept in rejected with their error, the others are loaded.
+
+    Args:
+        collection : the pymongo collection, or any object with a compatible insert_many method
+        batch_size(int) : the number of documents in each insert_many call
+        max_in_flight(int) : the number of batches queued or being inserted at once
+        retries(int) : the number of times a failed batch is retried
+        retry_delay(float) : the seconds waited before the first retry, doubled on each retry
+        retry_on(tuple) : the exception types of the insert_many calls that are retried, defaults to
+            transient_errors()
+    """
+
+    def __init__(self, collection, batch_size=1000, max_in_flight=4, retries=3, retry_delay=0.5,
+                 retry_on=None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.retry_on = transient_errors() if retry_on is None else retry_on
+        self.count = 0
+        self.inserted = 0
+        self.rejected = []
+        self.batch = []
+        self.error = None
+        self.lock = threading.Lock()
+        # each loader thread holds one batch, the queue holds the rest
+        loaders = max(1, max_in_flight // 2)
+        self.queue = Queue(maxsize=max(1, max_in_flight - loaders))
+        self.threads = [threading.Thread(target=self._load) for _ in range(loaders)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    @classmethod
+    def connect(cls, uri, database, collection, **kwargs):
+        """
+            This function opens the collection with pymongo and returns a sink loading into it
+
+            Args:
+                uri(str) : first parameter, the Mongo Db connection string
+                database(str) : second parameter, the name of the database
+                collection(str) : third parameter, the name of the collection
+
+            Returns:
+                MongoSink: the sink
+        """
+        import pymongo
+        return cls(pymongo.MongoClient(uri)[database][collection], **kwargs)
+
+    def _insert(self, batch):
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                failed = []
+            except Exception as e:
+                write_errors = bulk_write_errors(e)
+                if write_errors is None:
+                    if not isinstance(e, self.retry_on) or attempt == self.retries:
+                        raise
+                    # the whole batch is sent again, the documents that landed come back as duplicates
+                    failed = None
+                else:
+                    failed = [(batch[error["index"]], error) for error in write_errors
+                              if error.get("code") != DUPLICATE_KEY]
+            if failed is not None:
+                with self.lock:
+                    self.inserted += len(batch) - len(failed)
+                if not failed:
+                    return
+                if attempt == self.retries:
+                    with self.lock:
+                        self.rejected.extend((doc, error.get("errmsg")) for doc, error in failed)
+                    return
+                batch = [doc for doc, _ in failed]
+            attempt += 1
+            time.sleep(delay)
+            delay *= 2
+
+    def _load(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    return
+                if self.error is None:
+                    self._insert(batch)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _flush(self):
+        if self.batch:
+            self._check()
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def write(self, doc):
+        self.batch.append(doc)
+        self.count += 1
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        try:
+            self._flush()
+        finally:
+            for _ in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def transient_errors():
+    """
+        This function returns the exception types of the insert_many calls worth retrying, the connection
+         errors of pymongo, or the environment errors when pymongo is not installed
+    """
+    try:
+        from pymongo.errors import AutoReconnect, ConnectionFailure
+    except ImportError:
+        return (EnvironmentError,)
+    return (AutoReconnect, ConnectionFailure)
+
+
+def bulk_write_errors(error):
+    """
+        This function returns the write errors of a pymongo BulkWriteError, or None for other errors
+    """
+    details = getattr(error, "details", None)
+    if isinstance(details, dict) and "writeErrors" in details:
+        return details["writeErrors"]
+    return None
+
+
+def element_position(doc):
+    """
+        This function returns the (lat, lon) of a shaped element, the centroid of its geometry for a way
+         shaped with geometry=True, or None when it has no coordinates. A "geometry" tag of a way shaped
+         without geometry is a string, and gives None
+    """
+    pos = doc.get("pos")
+    if isinstance(pos, list) and len(pos) == 2:
+        return pos[0], pos[1]
+    geometry = doc.get("geometry")
+    if not isinstance(geometry, list):
+        return None
+    points = [point for point in geometry if point is not None]
+    if points and all(isinstance(point, list) and len(point) == 2 for point in points):
+        return (sum(point[0] for point in points) / len(points),
+                sum(point[1] for point in points) / len(points))
+    return None
+
+
+def tile_name(position, tile_size):
+    """
+        This function returns the name of the tile of tile_size degrees holding the position, "untiled" when
+         the position is None
+    """
+    if position is None:
+        return "untiled"
+    return "%d_%d" % (int(math.floor(position[0] / tile_size)), int(math.floor(position[1] / tile_size)))
+
+
+def tile_bounds(tile, tile_size):
+    """
+        This function returns the min_lat, min_lon, max_lat, max_lon of a tile named by tile_name
+    """
+    if tile == "untiled":
+        return None
+    row, column = [int(index) for index in tile.split("_")]
+    return [round(value * tile_size, 9) for value in (row, column, row + 1, column + 1)]
+
+
+class PartitionedSink(object):
+    """
+    Writes the documents to a directory of json files partitioned by element type and by spatial tile of
+    pos, or of the geometry centroid for ways. A partition rolls over to a new file once max_bytes of json
+    are written to it, and a manifest.json lists every file with its type, tile, bounds, document count and
+    bytes, so the files can be loaded by parallel mongoimport streams. Each partition buffers batch_size
+    encoded documents and appends them to its file, so only one file is open at a time and a compressed
+    file is a series of gzip members, which gzip readers handle as one stream. Elements whose type is
+    replaced by a "type" tag go to the "other" partitions.
+
+    Args:
+        out_dir(str) : the directory of the partition files, created if needed
+        tile_size(float) : the size of the tiles in degrees
+        max_bytes(int) : the json bytes of a partition file before it rolls over, before compression
+        pretty(boolean) : with value = False to indent the resulting json
+        compact(boolean) : with value = True to write the json with compact keys, see JsonFileSink
+        compress(boolean) : with value = True to write gzip compressed .json.gz files
+        batch_size(int) : the number of documents of a partition written at once
+        max_buffered(int) : the number of documents buffered over all partitions before they are written
+    """
+
+    TYPES = ("node", "way")
+
+    def __init__(self, out_dir, tile_size=0.1, max_bytes=64 << 20, pretty=False, compact=False, compress=False,
+                 batch_size=1000, max_buffered=100000):
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        self.out_dir = out_dir
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self.compact = compact
+        self.compress = compress
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.encode = line_encoder(pretty, compact)
+        self.buffers = {}
+        self.buffered = 0
+        # (type, tile) : list of [file name, count, bytes] of the partition files, the last one is open for
+        # writing
+        self.files = {}
+        self.count = 0
+
+    def write(self, doc):
+        # a "type" tag replaces the element type, see process_data.shape_tag
+        doc_type = doc.get("type")
+        key = (doc_type if doc_type in self.TYPES else "other", tile_name(element_position(doc), self.tile_size))
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = []
+        buffer.append(self.encode(doc))
+        self.count += 1
+        self.buffered += 1
+        if len(buffer) >= self.batch_size:
+            self._flush(key)
+        elif self.buffered >= self.max_buffered:
+            self.flush()
+
+    def _open(self, name, mode):
+        path = os.path.join(self.out_dir, name)
+        if self.compress:
+            return gzip.open(path, mode, 3)
+        return open(path, mode)
+
+    def _flush(self, key):
+        lines = self.buffers.pop(key, None)
+        if not lines:
+            return
+        self.buffered -= len(lines)
+        parts = self.files.setdefault(key, [])
+        suffix = ".json.gz" if self.compress else ".json"
+        start = 0
+        while start < len(lines):
+            if not parts or parts[-1][2] >= self.max_bytes:
+                parts.append(["%s-%s-%04d%s" % (key[0], key[1], len(parts), suffix), 0, 0])
+                mode = "wb"
+            else:
+                mode = "ab"
+            part = parts[-1]
+            end = start
+            while end < len(lines) and part[2] < self.max_bytes:
+                part[1] += 1
+                part[2] += len(lines[end])
+                end += 1
+            fo = self._open(part[0], mode)
+            try:
+                fo.write("".join(lines[start:end]))
+            finally:
+                fo.close()
+            start = end
+
+    def flush(self):
+        for key in self.buffers.keys():
+            self._flush(key)
+
+    def manifest(self):
+        """
+            This function returns the manifest of the partition files written
+        """
+        partitions = []
+        for (doc_type, tile), parts in sorted(self.files.iteritems()):
+            for name, count, size in parts:
+                partitions.append({"file": name, "type": doc_type, "tile": tile,
+                                   "bounds": tile_bounds(tile, self.tile_size), "count": count, "bytes": size,
+                                   "file_bytes": os.path.getsize(os.path.join(self.out_dir, name))})
+        return {"tile_size": self.tile_size, "max_bytes": self.max_bytes, "compact": self.compact,
+                "count": self.count, "partitions": partitions}
+
+    def close(self):
+        self.flush()
+        manifest = os.path.join(self.out_dir, "manifest.json")
+        with open(manifest + ".tmp", "w") as fo:
+            json.dump(self.manifest(), fo, indent=2, sort_keys=True)
+        os.rename(manifest + ".tmp", manifest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def drain(elements, sink):
+    """
+        This function writes every element to the sink and closes it
+
+        Args:
+            elements(iterable) : the first argument, the shaped elements to be written
+            sink : the second argument, the sink to write to
+
+        Returns :
+            int : the number of documents written
+
+    """
+    try:
+        for el in elements:
+            sink.write(el)
+    finally:
+        sink.close()
+    return sink.count
+
+
+class FakeBulkWriteError(Exception):
+    """
+    Stand-in for pymongo's BulkWriteError, with the write errors of the documents that were not inserted
+    """
+
+    def __init__(self, write_errors):
+        Exception.__init__(self, "batch op errors occurred")
+        self.details = {"writeErrors": write_errors}
+
+
+class FakeCollection(object):
+    """
+    In process stand-in for a pymongo collection, failing the first insert_many calls it is told to with the
+    first error type of transient_errors, the one MongoSink retries by default. A partial failure inserts half of the documents before the connection drops, a document sent twice is a
+    duplicate key error, like the _id pymongo adds makes it, and the documents with an id in invalid are
+    rejected with a bulk write error.
+    """
+
+    def __init__(self, failures=0, delay=0.0, partial_failures=0, invalid=()):
+        self.docs = []
+        self.calls = 0
+        self.failures = failures
+        self.partial_failures = partial_failures
+        self.invalid = set(invalid)
+        self.delay = delay
+        self.inserted = set()
+        self.lock = threading.Lock()
+
+    def insert_many(self, docs, ordered=True):
+        assert not ordered
+        with self.lock:
+            self.calls += 1
+            if self.failures:
+                self.failures -= 1
+                raise transient_errors()[0]("connection reset")
+            partial = self.partial_failures > 0
+            if partial:
+                self.partial_failures -= 1
+        time.sleep(self.delay)
+        write_errors = []
+        with self.lock:
+            for index, doc in enumerate(docs):
+                if partial and index == len(docs) // 2:
+                    raise transient_errors()[0]("connection reset")
+                if id(doc) in self.inserted:
+                    write_errors.append({"index": index, "code": DUPLICATE_KEY, "errmsg": "E11000 duplicate key"})
+                elif doc.get("id") in self.invalid:
+                    write_errors.append({"index": index, "code": 121, "errmsg": "Document failed validation"})
+                else:
+                    self.inserted.add(id(doc))
+                    self.docs.append(doc)
+        if write_errors:
+            raise FakeBulkWriteError(write_errors)
+
+    def _find(self, query):
+        for i, doc in enumerate(self.docs):
+            if all(doc.get(key) not in value["$nin"] if isinstance(value, dict) else doc.get(key) == value
+                   for key, value in query.items()):
+                return i
+        return None
+
+    def replace_one(self, query, doc, upsert=False):
+        i = self._find(query)
+        if i is not None:
+            self.docs[i] = doc
+        elif upsert:
+            self.docs.append(doc)
+
+    def delete_one(self, query):
+        i = self._find(query)
+        if i is not None:
+            del self.docs[i]
+
+
+def test():
+    collection = FakeCollection(failures=2, delay=0.01)
+    sink = MongoSink(collection, batch_size=10, max_in_flight=2, retry_delay=0.001)
+    assert drain(({"id": str(i)} for i in range(95)), sink) == 95
+    assert sink.inserted == 95
+    assert sorted(int(doc["id"]) for doc in collection.docs) == range(95)
+    assert collection.calls == 12
+
+    sink = MongoSink(FakeCollection(failures=10), batch_size=10, retries=1, retry_delay=0.001)
+    try:
+        drain(({"id": str(i)} for i in range(100)), sink)
+        assert False
+    except transient_errors():
+        pass
+
+    # the half of each batch that landed before the connection dropped comes back as duplicates
+    collection = FakeCollection(partial_failures=3, invalid=["7", "42"])
+    sink = MongoSink(collection, batch_size=10, retries=2, retry_delay=0.001)
+    assert drain(({"id": str(i)} for i in range(95)), sink) == 95
+    assert sink.inserted == 93 and len(collection.docs) == 93
+    assert sorted(int(doc["id"]) for doc in collection.docs) == [i for i in range(95) if i not in (7, 42)]
+    assert sorted(doc["id"] for doc, _ in sink.rejected) == ["42", "7"]
+    assert sink.rejected[0][1] == "Document failed validation"
+
+    sink = MongoSink(FakeCollection())
+    sink.collection.insert_many = lambda docs, ordered: 1 / 0
+    try:
+        drain(({"id": str(i)} for i in range(10)), sink)
+        assert False
+    except ZeroDivisionError:
+        pass
+
+    import gzip
+    import os
+    import tempfile
+    import process_data
+    docs = process_data.process_data("exercises/example.osm")
+    os.remove("exercises/example.osm.json")
+    for suffix, compact in ((".json", False), (".json.gz", False), (".json.gz", True)):
+        file_out = tempfile.mktemp(suffix=suffix)
+        try:
+            with JsonFileSink(file_out, compact=compact, batch_size=7) as sink:
+                for doc in docs:
+                    sink.write(doc)
+            fi = gzip.open(file_out) if suffix.endswith(".gz") else open(file_out)
+            lines = fi.read().splitlines()
+            fi.close()
+            written = [json.loads(line) for line in lines]
+            if compact:
+                assert '"created"' not in lines[0] and '"@c":{' in lines[0]
+                written = [expand_keys(doc) for doc in written]
+            assert written == docs
+        finally:
+            os.remove(file_out)
+    assert expand_keys(compact_keys({"created": "tag", "name": "x"})) == {"created": "tag", "name": "x"}
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        with open(file_in, "w") as fo:
+            fo.write('<osm><node id="1" lat="1" lon="2"><tag k="address" v="1 Main St"/></node></osm>')
+        assert process_data.process_data(file_in, stream=True, compact=True) == 1
+        with open(file_in + ".json") as fi:
+            assert expand_keys(json.loads(fi.read()))["address"] == "1 Main St"
+    finally:
+        for name in (file_in, file_in + ".json"):
+            if os.path.exists(name):
+                os.remove(name)
+
+    collection = FakeCollection()
+    assert process_data.process_data("exercises/example.osm", sink=MongoSink(collection, batch_size=4)) == 25
+    assert sorted(collection.docs) == sorted(process_data.process_data("exercises/example.osm"))
+    os.remove("exercises/example.osm.json")
+
+    import shutil
+    assert tile_name((40.75, -73.99), 0.1) == "407_-740" and tile_bounds("407_-740", 0.1)[1] == -74.0
+    assert element_position({"geometry": [[1.0, 2.0], None, [3.0, 4.0]]}) == (2.0, 3.0)
+    assert element_position({"geometry": "line"}) is None and element_position({"geometry": ["ab"]}) is None
+    out_dir = tempfile.mkdtemp()
+    file_in = os.path.join(out_dir, "line.osm")
+    try:
+        with open(file_in, "w") as fo:
+            fo.write('<osm><way id="1"><nd ref="2"/><tag k="geometry" v="line"/></way></osm>')
+        assert process_data.process_data(file_in, sink=PartitionedSink(os.path.join(out_dir, "parts"))) == 1
+        with open(os.path.join(out_dir, "parts", "manifest.json")) as fi:
+            assert [part["tile"] for part in json.load(fi)["partitions"]] == ["untiled"]
+    finally:
+        shutil.rmtree(out_dir)
+    for geometry, compress in ((False, False), (True, True)):
+        docs = list(process_data.iter_shaped("exercises/example.osm", geometry=geometry))
+        out_dir = tempfile.mkdtemp()
+        try:
+            sink = PartitionedSink(out_dir, tile_size=0.002, max_bytes=500, compress=compress, batch_size=3,
+                                   max_buffered=10)
+            assert process_data.process_data("exercises/example.osm", geometry=geometry, sink=sink) == len(docs)
+            with open(os.path.join(out_dir, "manifest.json")) as fi:
+                manifest = json.load(fi)
+            partitions = manifest["partitions"]
+            assert manifest["count"] == sum(part["count"] for part in partitions) == len(docs)
+            assert sorted(part["file"] for part in partitions) == sorted(
+                name for name in os.listdir(out_dir) if name != "manifest.json")
+            written = []
+            for part in partitions:
+                path = os.path.join(out_dir, part["file"])
+                fi = gzip.open(path) if compress else open(path)
+                data = fi.read()
+                fi.close()
+                assert len(data) == part["bytes"] and data.count("\n") == part["count"]
+                assert part["bytes"] - len(data.splitlines(True)[-1]) < 500
+                for doc in [json.loads(line) for line in data.splitlines()]:
+                    assert doc["type"] == part["type"]
+                    assert tile_name(element_position(doc), 0.002) == part["tile"]
+                    written.append(doc)
+            assert sorted(written) == sorted(docs)
+            tiles = set(part["tile"] for part in partitions)
+            # the nodes of the ways of example.osm are outside the extract, so the ways have no position
+            assert len(tiles) > 1 and "untiled" in tiles
+            assert max(part["file"].endswith("-0001" + (".json.gz" if compress else ".json"))
+                       for part in partitions)
+        finally:
+            shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    test()
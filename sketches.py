@@ -0,0 +1,312 @@
+"""
+This code holds fixed-memory sketches for auditing extracts too large for exact sets and dictionaries.
+ Each sketch counts exactly until it has seen exact_limit distinct items and then switches to its sketch,
+ and two sketches with the same parameters can be merged, so that runs over separate extracts add up.
+
+ HyperLogLog counts distinct items in 2^precision one-byte registers (16kB for precision 14). Its relative
+ standard error is 1.04 / sqrt(2^precision), 0.81% for precision 14, and the estimate is within three
+ times that in 99.7% of the runs.
+
+ HeavyHitters finds the most frequent items with a Count-Min sketch of depth rows of width counters and a
+ table of the top candidates. A count is never underestimated, and with probability 1 - exp(-depth) it is
+ overestimated by at most e / width times the total count, 0.13% of it for a width of 2048. The
+ candidates, at most top * 4 items, are ranked by their sketch counts, so a frequent item dropped from them
+ comes back with its full count the next time it is seen.
+"""
+
+import array
+import base64
+import hashlib
+import heapq
+import math
+import struct
+
+
+def hash64(value):
+    """
+        This function returns a 64 bit hash of the value that is the same in every process and run
+    """
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return struct.unpack("<Q", hashlib.md5(value).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+    """
+    Estimates the number of distinct items
+
+    Args:
+        precision(int) : the number of index bits, 2^precision registers are used
+        exact_limit(int) : the number of distinct items counted exactly before switching to the registers
+    """
+
+    def __init__(self, precision=14, exact_limit=1000):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.exact = set()
+        self.registers = None
+
+    def add(self, value):
+        if self.registers is None:
+            self.exact.add(value)
+            if len(self.exact) > self.exact_limit:
+                self._switch()
+            return
+        self._add_hash(hash64(value))
+
+    def _add_hash(self, h):
+        index = h >> (64 - self.precision)
+        # rank of the first set bit of the remaining bits
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _switch(self):
+        self.registers = bytearray(1 << self.precision)
+        for value in self.exact:
+            self._add_hash(hash64(value))
+        self.exact = None
+
+    @property
+    def is_exact(self):
+        return self.registers is None
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+    def estimate(self):
+        """
+            This function returns the estimated number of distinct items
+        """
+        if self.registers is None:
+            return float(len(self.exact))
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count("\x00")
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small counts
+            return m * math.log(m / zeros)
+        return estimate
+
+    def error(self):
+        """
+            This function returns the relative standard error of the estimate
+        """
+        if self.registers is None:
+            return 0.0
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def merge(self, other):
+        """
+            This function adds the items of another sketch with the same precision to this one
+        """
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches of different precision")
+        if other.registers is None:
+            for value in other.exact:
+                self.add(value)
+            return self
+        if self.registers is None:
+            self._switch()
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def to_dict(self):
+        return {"precision": self.precision, "exact_limit": self.exact_limit,
+                "exact": sorted(self.exact) if self.registers is None else None,
+                "registers": base64.b64encode(str(self.registers)) if self.registers is not None else None}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["precision"], state["exact_limit"])
+        if state["registers"] is not None:
+            sketch.exact = None
+            sketch.registers = bytearray(base64.b64decode(state["registers"]))
+        else:
+            sketch.exact = set(state["exact"])
+        return sketch
+
+
+class HeavyHitters(object):
+    """
+    Counts items and keeps the most frequent ones
+
+    Args:
+        top(int) : the number of most frequent items reported
+        width(int) : the number of counters in each row of the Count-Min sketch
+        depth(int) : the number of rows of the Count-Min sketch, at most 4
+        exact_limit(int) : the number of distinct items counted exactly before switching to the sketch
+    """
+
+    def __init__(self, top=20, width=2048, depth=4, exact_limit=1000):
+        if not 1 <= depth <= 4:
+            raise ValueError("depth must be between 1 and 4")
+        self.top = top
+        self.width = width
+        self.depth = depth
+        self.exact_limit = exact_limit
+        self.total = 0
+        self.exact = {}
+        self.counters = None
+        self.candidates = None
+
+    def _cells(self, value):
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        hashes = struct.unpack("<4I", hashlib.md5(value).digest())
+        width = self.width
+        return [row * width + hashes[row] % width for row in xrange(self.depth)]
+
+    def add(self, value, count=1):
+        self.total += count
+        if self.counters is None:
+            self.exact[value] = self.exact.get(value, 0) + count
+            if len(self.exact) > self.exact_limit:
+                self._switch()
+            return
+        counters = self.counters
+        cells = self._cells(value)
+        for cell in cells:
+            counters[cell] += count
+        self._offer(value, min(counters[cell] for cell in cells))
+
+    def _offer(self, value, estimate):
+        candidates = self.candidates
+        candidates[value] = estimate
+        if len(candidates) > self.top * 4:
+            # drop the least frequent half of the candidates
+            for k, _ in heapq.nsmallest(len(candidates) - self.top * 2, candidates.iteritems(),
+                                        key=lambda kv: kv[1]):
+                del candidates[k]
+
+    def _switch(self):
+        self.counters = array.array("l", [0]) * (self.width * self.depth)
+        self.candidates = {}
+        exact = self.exact
+        self.exact = None
+        for value, count in exact.iteritems():
+            for cell in self._cells(value):
+                self.counters[cell] += count
+        for value, count in heapq.nlargest(self.top * 2, exact.iteritems(), key=lambda kv: kv[1]):
+            self._offer(value, self.count(value))
+
+    @property
+    def is_exact(self):
+        return self.counters is None
+
+    def count(self, value):
+        """
+            This function returns the count of the item, exact or overestimated by at most error_bound()
+        """
+        if self.counters is None:
+            return self.exact.get(value, 0)
+        return min(self.counters[cell] for cell in self._cells(value))
+
+    def most_common(self, n=None):
+        """
+            This function returns the n most frequent (item, count) pairs, by default the top ones
+        """
+        n = n or self.top
+        items = self.exact if self.counters is None else self.candidates
+        return heapq.nlargest(n, ((value, self.count(value)) for value in items), key=lambda kv: (kv[1], kv[0]))
+
+    def error_bound(self):
+        """
+            This function returns the largest overestimate of a count with probability 1 - exp(-depth)
+        """
+        if self.counters is None:
+            return 0
+        return int(math.ceil(math.e / self.width * self.total))
+
+    def merge(self, other):
+        """
+            This function adds the counts of another sketch with the same width and depth to this one
+        """
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("cannot merge sketches of different width or depth")
+        if other.counters is None:
+            for value, count in other.exact.iteritems():
+                self.add(value, count)
+            return self
+        if self.counters is None:
+            self._switch()
+        self.total += other.total
+        for i, count in enumerate(other.counters):
+            self.counters[i] += count
+        for value in set(self.candidates) | set(other.candidates):
+            self._offer(value, self.count(value))
+        return self
+
+    def to_dict(self):
+        return {"top": self.top, "width": self.width, "depth": self.depth, "exact_limit": self.exact_limit,
+                "total": self.total, "exact": self.exact,
+                "counters": base64.b64encode(self.counters.tostring()) if self.counters is not None else None,
+                "candidates": self.candidates}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["top"], state["width"], state["depth"], state["exact_limit"])
+        sketch.total = state["total"]
+        if state["counters"] is not None:
+            sketch.exact = None
+            sketch.counters = array.array("l")
+            sketch.counters.fromstring(base64.b64decode(state["counters"]))
+            sketch.candidates = dict(state["candidates"])
+        else:
+            sketch.exact = dict(state["exact"])
+        return sketch
+
+
+def test():
+    import json
+    import random
+    rng = random.Random(1)
+
+    hll = HyperLogLog(precision=14, exact_limit=100)
+    for i in xrange(50):
+        hll.add(str(i))
+        hll.add(str(i))
+    assert hll.is_exact and len(hll) == 50 and hll.error() == 0
+    for n in (1000, 20000, 200000):
+        hll = HyperLogLog(precision=14, exact_limit=100)
+        for i in xrange(n):
+            hll.add("user%d" % i)
+        assert not hll.is_exact
+        assert abs(hll.estimate() - n) / n < 3 * hll.error(), (n, hll.estimate())
+        assert len(hll.registers) == 16384
+    first, second = HyperLogLog(exact_limit=100), HyperLogLog(exact_limit=100)
+    for i in xrange(30000):
+        first.add(str(i))
+        second.add(str(i + 15000))
+    merged = HyperLogLog.from_dict(json.loads(json.dumps(first.to_dict()))).merge(second)
+    assert abs(merged.estimate() - 45000) / 45000 < 3 * merged.error()
+    small = HyperLogLog(exact_limit=100)
+    small.add(u"caf\xe9")
+    assert len(HyperLogLog.from_dict(small.to_dict()).merge(second)) >= len(second)
+
+    hh = HeavyHitters(top=3, width=512, depth=4, exact_limit=50)
+    words = ["Street"] * 5000 + ["Avenue"] * 3000 + ["St"] * 2000 + ["x%d" % i for i in xrange(20000)]
+    rng.shuffle(words)
+    for word in words[:15000]:
+        hh.add(word)
+    other = HeavyHitters(top=3, width=512, depth=4, exact_limit=50)
+    for word in words[15000:]:
+        other.add(word)
+    merged = HeavyHitters.from_dict(json.loads(json.dumps(hh.to_dict()))).merge(other)
+    assert not merged.is_exact and merged.total == len(words)
+    top = merged.most_common()
+    assert [word for word, _ in top] == ["Street", "Avenue", "St"], top
+    for word, count in top:
+        assert words.count(word) <= count <= words.count(word) + merged.error_bound()
+    exact = HeavyHitters(top=2)
+    for word in ["Ave", "Ave", "St", "Rd", "Ave", "St"]:
+        exact.add(word)
+    assert exact.is_exact and exact.most_common() == [("Ave", 3), ("St", 2)] and exact.error_bound() == 0
+
+
+if __name__ == "__main__":
+    test()
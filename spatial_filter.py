@@ -0,0 +1,181 @@
+"""
+This code keeps the part of an osm file inside a bounding box or a simple polygon. The filter is passed to
+ process_data as keep=SpatialFilter(...) and is checked against the raw lat/lon attributes of each parsed
+ element before shape_element runs, so the elements outside the region are never shaped, cleaned or
+ written. The ids of the kept nodes are held in a compact sorted id set, and a way is kept when it
+ references at least one of them.
+"""
+
+import argparse
+import json
+
+from prepare_sample import IdSet
+
+
+def point_in_polygon(lat, lon, polygon):
+    """
+        This function checks if the point is inside the polygon, by counting the polygon edges crossed by
+         a ray from the point
+
+        Args:
+            lat(float) : first parameter, the latitude of the point
+            lon(float) : second parameter, the longitude of the point
+            polygon(list) : third parameter, the (lat, lon) vertices of the polygon
+
+        Returns:
+            bool: True if the point is inside the polygon
+    """
+    inside = False
+    j = len(polygon) - 1
+    for i in xrange(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > lat) != (lat_j > lat) and lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+            inside = not inside
+        j = i
+    return inside
+
+
+class SpatialFilter(object):
+    """
+    Keeps the nodes inside the region, the ways referencing a kept node and the relations with a kept
+    member. Osm files list the nodes before the ways and the ways before the relations.
+
+    Args:
+        bbox(tuple) : min_lat, min_lon, max_lat, max_lon of the region
+        polygon(list) : the (lat, lon) vertices of the region, checked inside its bounding box
+    """
+
+    def __init__(self, bbox=None, polygon=None):
+        if (bbox is None) == (polygon is None):
+            raise ValueError("a spatial filter needs either a bbox or a polygon")
+        if polygon is not None:
+            polygon = [(float(lat), float(lon)) for lat, lon in polygon]
+            if len(polygon) < 3:
+                raise ValueError("a polygon needs at least 3 vertices")
+            bbox = (min(lat for lat, _ in polygon), min(lon for _, lon in polygon),
+                    max(lat for lat, _ in polygon), max(lon for _, lon in polygon))
+        self.min_lat, self.min_lon, self.max_lat, self.max_lon = [float(value) for value in bbox]
+        self.polygon = polygon
+        self.ids = {"node": IdSet(), "way": IdSet(), "relation": IdSet()}
+
+    def contains(self, lat, lon):
+        if not (self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon):
+            return False
+        return self.polygon is None or point_in_polygon(lat, lon, self.polygon)
+
+    def __call__(self, element):
+        """
+            This function decides if the parsed element is kept
+
+            Args:
+                element(element) : first parameter, the parsed top level element
+
+            Returns:
+                bool: True if the element is in the region
+        """
+        tag = element.tag
+        if tag == "node":
+            attrib = element.attrib
+            keep = "lat" in attrib and self.contains(float(attrib["lat"]), float(attrib["lon"]))
+        elif tag == "way":
+            nodes = self.ids["node"]
+            keep = any(nd.attrib["ref"] in nodes for nd in element.iter("nd"))
+        elif tag == "relation":
+            keep = any(member.attrib["ref"] in self.ids[member.attrib["type"]]
+                       for member in element.iter("member") if member.attrib.get("type") in self.ids)
+        else:
+            return False
+        if keep:
+            self.ids[tag].add(element.attrib["id"])
+        return keep
+
+
+def main(argv=None):
+    import process_data
+    parser = argparse.ArgumentParser(description="Convert the part of an osm file inside a region to json")
+    parser.add_argument("file_in")
+    parser.add_argument("--bbox", help="min_lat,min_lon,max_lat,max_lon")
+    parser.add_argument("--polygon", help="json file holding a list of [lat, lon] vertices")
+    args = parser.parse_args(argv)
+    if args.polygon:
+        with open(args.polygon) as fi:
+            keep = SpatialFilter(polygon=json.load(fi))
+    elif args.bbox:
+        keep = SpatialFilter(bbox=[float(value) for value in args.bbox.split(",")])
+    else:
+        parser.error("--bbox or --polygon is required")
+    count = process_data.process_data(args.file_in, stream=True, keep=keep)
+    print "%d documents written to %s.json" % (count, args.file_in)
+
+
+def test():
+    import os
+    import time
+    import tempfile
+    import xml.etree.ElementTree as ET
+    import process_data
+    import synthetic_osm
+    square = [(0, 0), (0, 2), (2, 2), (2, 0)]
+    assert point_in_polygon(1, 1, square) and not point_in_polygon(3, 1, square)
+    triangle = [(0, 0), (2, 0), (0, 2)]
+    assert point_in_polygon(0.5, 0.5, triangle) and not point_in_polygon(1.5, 1.5, triangle)
+
+    data = process_data.process_data("exercises/example.osm")
+    os.remove("exercises/example.osm.json")
+    bbox = (41.97, -87.70, 41.9735, -87.68)
+    kept = process_data.process_data("exercises/example.osm", keep=SpatialFilter(bbox))
+    os.remove("exercises/example.osm.json")
+    expected = [el.attrib["id"] for el in process_data.iter_elements("exercises/example.osm", ("node",))
+                if bbox[0] <= float(el.attrib["lat"]) <= bbox[2] and bbox[1] <= float(el.attrib["lon"]) <= bbox[3]]
+    assert 0 < len(kept) == len(expected) < len(data)
+    assert sorted(el["id"] for el in kept) == sorted(expected)
+    polygon = [(bbox[0], bbox[1]), (bbox[0], bbox[3]), (bbox[2], bbox[3]), (bbox[2], bbox[1])]
+    assert process_data.process_data("exercises/example.osm", keep=SpatialFilter(polygon=polygon)) == kept
+    os.remove("exercises/example.osm.json")
+
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        with open(file_in, "w") as fo:
+            fo.write('<osm><node id="1" lat="0.5" lon="0.25"/><node id="2" lat="5" lon="5"/><node id="3" lat="6" lon="6"/>'
+                     '<way id="10"><nd ref="2"/><nd ref="1"/></way><way id="11"><nd ref="2"/><nd ref="3"/></way>'
+                     '<relation id="20"><member type="way" ref="10" role=""/></relation></osm>')
+        keep = SpatialFilter(polygon=triangle)
+        kept = list(process_data.iter_shaped(file_in, keep=keep))
+        assert [(el["type"], el["id"]) for el in kept] == [("node", "1"), ("way", "10")]
+        assert "20" in keep.ids["relation"]
+        # each kept relation is looked up by the next one, without rebuilding the id set every time
+        keep = SpatialFilter(polygon=triangle)
+        assert keep(ET.fromstring('<node id="1" lat="0.5" lon="0.25"/>'))
+        relations = 20000
+        assert all(keep(ET.fromstring('<relation id="%d"><member type="%s" ref="%d" role=""/></relation>'
+                                      % (i, "relation" if i > 1 else "node", i - 1 or 1)))
+                   for i in range(1, relations + 1))
+        assert len(keep.ids["relation"]) == relations
+        geometry = list(process_data.iter_shaped(file_in, geometry=True, keep=SpatialFilter(polygon=triangle)))
+        assert geometry[-1]["geometry"] == [[5.0, 5.0], [0.5, 0.25]]
+        os.remove(file_in)
+        synthetic_osm.generate(file_in, 12000000)
+        # the synthetic latitudes are spread over 40.5 to 40.9, a tenth of the nodes are south of 40.54
+        bbox = (40.5, -74.25, 40.54, -73.7)
+        nodes = set()
+        ways = 0
+        for el in process_data.iter_elements(file_in, ("node", "way")):
+            if el.tag == "node" and bbox[0] <= float(el.attrib["lat"]) <= bbox[2]:
+                nodes.add(el.attrib["id"])
+            elif el.tag == "way" and any(nd.attrib["ref"] in nodes for nd in el.iter("nd")):
+                ways += 1
+        start = time.time()
+        process_data.process_data(file_in, stream=True)
+        full = time.time() - start
+        start = time.time()
+        assert process_data.process_data(file_in, stream=True, keep=SpatialFilter(bbox)) == len(nodes) + ways
+        print "full %.2fs, 10%% region %.2fs" % (full, time.time() - start)
+    finally:
+        for name in (file_in, file_in + ".json"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    main()
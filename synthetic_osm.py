@@ -0,0 +1,189 @@
+"""
+This code generates synthetic osm files for the benchmarks. The size of the file, the ratio of ways to
+ nodes, the number of tags per element and the share of abbreviated street names and of each postcode
+ format can be chosen, so that the cleaning functions see a realistic mix of values.
+"""
+
+import random
+from xml.sax.saxutils import quoteattr
+
+STREETS = ["Broadway", "Main", "Park", "Lexington", "Madison", "Atlantic", "Flatbush", "Ocean", "Bedford",
+           "Nostrand", "Queens", "Jamaica", "Linden", "Myrtle", "Fulton", "Amsterdam", "Columbus", "Church"]
+
+# full street types and the abbreviations found for them
+STREET_TYPES = {"Street": ["St", "St.", "st"], "Avenue": ["Ave", "Ave.", "ave"], "Road": ["Rd", "Rd."],
+                "Place": ["Pl", "Pl."], "Boulevard": ["Blvd", "Blvd."], "Parkway": ["Pkwy"], "Drive": ["Dr"],
+                "Lane": ["Ln"], "Court": ["Ct", "Ct."]}
+
+OTHER_TAGS = [("amenity", ["restaurant", "cafe", "school", "bank", "pharmacy"]),
+              ("cuisine", ["pizza", "chinese", "mexican", "italian"]),
+              ("name", ["Joe's", "Corner Deli", "Central Market", "City Bank"]),
+              ("building", ["yes", "house", "apartments"]),
+              ("building:levels", ["1", "2", "5", "12"]),
+              ("highway", ["residential", "primary", "footway"]),
+              ("source", ["bing", "survey", "tiger"]),
+              ("tiger:county", ["Kings, NY", "Queens, NY"]),
+              ("gnis:feature_id", ["975772", "942344"]),
+              ("name:en", ["Central Park", "Times Square"]),
+              ("fixme", ["check address"]),
+              ("note;bad", ["problem key"])]
+
+# share of each postcode format
+POSTCODES = {"valid": 0.8, "zip4": 0.15, "invalid": 0.05}
+
+
+def street_name(rng, abbreviation_rate):
+    full_type = rng.choice(sorted(STREET_TYPES))
+    street_type = rng.choice(STREET_TYPES[full_type]) if rng.random() < abbreviation_rate else full_type
+    return "%s %s" % (rng.choice(STREETS), street_type)
+
+
+def postcode(rng, postcodes):
+    r = rng.random()
+    zip5 = "1%04d" % rng.randint(0, 1500)
+    for kind in ("valid", "zip4", "invalid"):
+        r -= postcodes.get(kind, 0)
+        if r < 0:
+            break
+    if kind == "valid":
+        return zip5
+    if kind == "zip4":
+        return "%s-%04d" % (zip5, rng.randint(0, 9999))
+    return rng.choice(["NY 10001", "1001", "100O1", "New York"])
+
+
+def element_tags(rng, tags_per_element, abbreviation_rate, postcodes):
+    """
+        This function draws the tags of one element, on average tags_per_element of them
+    """
+    count = int(rng.expovariate(1.0 / tags_per_element)) if tags_per_element > 0 else 0
+    tags = []
+    if count and rng.random() < 0.5:
+        tags.append(("addr:street", street_name(rng, abbreviation_rate)))
+        tags.append(("addr:housenumber", str(rng.randint(1, 999))))
+        tags.append(("addr:postcode", postcode(rng, postcodes)))
+        if rng.random() < 0.3:
+            tags.append(("addr:city", "New York"))
+        count -= len(tags)
+    for _ in xrange(max(0, count)):
+        key, values = rng.choice(OTHER_TAGS)
+        tags.append((key, rng.choice(values)))
+    return tags
+
+
+def write_tags(fo, tags):
+    for k, v in tags:
+        fo.write('  <tag k=%s v=%s/>\n' % (quoteattr(k), quoteattr(v)))
+
+
+def generate(file_out, target_size, way_ratio=0.15, tags_per_element=1.0, abbreviation_rate=0.3,
+             postcodes=POSTCODES, refs_per_way=8, seed=0):
+    """
+        This function writes a synthetic osm file of about target_size bytes, nodes first and then ways
+         referencing earlier nodes, like an osm extract
+
+        Args:
+            file_out(str) : first parameter, the name of the file to be written
+            target_size(int) : second parameter, the size of the file in bytes
+            way_ratio(float) : third parameter, the number of ways per node
+            tags_per_element(float) : fourth parameter, the mean number of tags of an element
+            abbreviation_rate(float) : fifth parameter, the share of abbreviated street types
+            postcodes(dict) : sixth parameter, the share of "valid", "zip4" and "invalid" postcodes
+            refs_per_way(int) : seventh parameter, the mean number of nodes of a way
+            seed(int) : eighth parameter, the random seed
+
+        Returns:
+            dict: the number of nodes and ways written
+    """
+    rng = random.Random(seed)
+    # a node takes about 200 bytes and each tag 40 more, a way 120 bytes plus 25 per node reference
+    node_size = 200 + 40 * tags_per_element
+    way_size = 120 + 25 * refs_per_way + 40 * tags_per_element
+    nodes = max(1, int(target_size / (node_size + way_ratio * way_size)))
+    ways = int(nodes * way_ratio)
+    with open(file_out, "w") as fo:
+        fo.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="synthetic_osm">\n')
+        for i in xrange(1, nodes + 1):
+            uid = rng.randint(1, 5000)
+            tags = element_tags(rng, tags_per_element, abbreviation_rate, postcodes)
+            fo.write(' <node id="%d" visible="true" version="%d" changeset="%d" timestamp="2016-%02d-%02dT12:00:00Z" '
+                     'user="user%d" uid="%d" lat="%.7f" lon="%.7f"%s\n'
+                     % (i, rng.randint(1, 9), rng.randint(1, 40000000), rng.randint(1, 12), rng.randint(1, 28),
+                        uid, uid, rng.uniform(40.5, 40.9), rng.uniform(-74.25, -73.7), ">" if tags else "/>"))
+            if tags:
+                write_tags(fo, tags)
+                fo.write(' </node>\n')
+        for i in xrange(1, ways + 1):
+            uid = rng.randint(1, 5000)
+            fo.write(' <way id="%d" visible="true" version="1" changeset="1" timestamp="2016-01-01T12:00:00Z" '
+                     'user="user%d" uid="%d">\n' % (nodes + i, uid, uid))
+            start = rng.randint(1, nodes)
+            for ref in xrange(start, min(nodes, start + max(2, int(rng.expovariate(1.0 / refs_per_way)))) + 1):
+                fo.write('  <nd ref="%d"/>\n' % ref)
+            write_tags(fo, element_tags(rng, tags_per_element, abbreviation_rate, postcodes))
+            fo.write(' </way>\n')
+        fo.write('</osm>\n')
+    return {"nodes": nodes, "ways": ways}
+
+
+def sample_values(count, abbreviation_rate=0.3, postcodes=POSTCODES, seed=0):
+    """
+        This function draws street names, postcodes and tags with the distributions of generate
+
+        Returns:
+            dict: lists of "street" names, "postcode" values and "tags" (k, v) pairs
+    """
+    rng = random.Random(seed)
+    tags = []
+    while len(tags) < count:
+        tags.extend(element_tags(rng, 4, abbreviation_rate, postcodes))
+    return {"street": [street_name(rng, abbreviation_rate) for _ in xrange(count)],
+            "postcode": [postcode(rng, postcodes) for _ in xrange(count)],
+            "tags": tags[:count]}
+
+
+def test():
+    import os
+    import tempfile
+    import process_data
+    file_out = tempfile.mktemp(suffix=".osm")
+    try:
+        counts = generate(file_out, 200000, way_ratio=0.2, tags_per_element=2)
+        assert 0.5 < os.path.getsize(file_out) / 200000.0 < 1.5, os.path.getsize(file_out)
+        data = process_data.process_data(file_out)
+        os.remove(file_out + ".json")
+        assert len([el for el in data if el["type"] == "node"]) == counts["nodes"]
+        assert len([el for el in data if el["type"] == "way"]) == counts["ways"]
+    finally:
+        os.remove(file_out)
+    values = sample_values(1000, abbreviation_rate=1.0, postcodes={"zip4": 1.0})
+    assert all("-" in value for value in values["postcode"])
+    assert all(name.split()[-1] not in STREET_TYPES for name in values["street"])
+    assert len(values["tags"]) == 1000
+    test_stream_memory()
+
+
+def test_stream_memory():
+    import os
+    import resource
+    import tempfile
+    import process_data
+    small = tempfile.mktemp(suffix=".osm")
+    large = tempfile.mktemp(suffix=".osm")
+    try:
+        small_counts = generate(small, 2500000)
+        large_counts = generate(large, 50000000)
+        assert process_data.process_data(small, stream=True) == small_counts["nodes"] + small_counts["ways"]
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        assert process_data.process_data(large, stream=True) == large_counts["nodes"] + large_counts["ways"]
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes; a result list for the large file would take hundreds of MB
+        assert peak_rss - baseline_rss < 20 * 1024, (baseline_rss, peak_rss)
+    finally:
+        for name in (small, large, small + ".json", large + ".json"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,180 @@
+"""
+This code filters the elements of an osm file on their tags before they are shaped. Include and exclude
+ expressions such as "amenity", "cuisine=pizza|chinese" or "addr:*" are compiled once into lookup tables,
+ and the filter is passed to process_data as keep=TagFilter(...). An element is kept when one of its tags
+ matches an include expression, or when there are none, and none of its tags match an exclude expression.
+ The bare geometry nodes of a POI export are rejected after a look at their children and are never shaped,
+ cleaned or written.
+"""
+
+import argparse
+
+
+def compile_expressions(expressions):
+    """
+        This function compiles tag expressions into lookup tables
+
+        Args:
+            expressions(list) : the first argument, expressions of the form "key", "key=*", "key=value",
+                "key=value1|value2" or "prefix*", such as "addr:*"
+
+        Returns :
+            tuple : a dictionary of the keys to the set of their accepted values, None for any value, and a
+                tuple of the (prefix, values) pairs
+
+    """
+    keys = {}
+    prefixes = []
+    for expression in expressions:
+        key, _, value = expression.partition("=")
+        key = key.strip()
+        if not key:
+            raise ValueError("tag expression without a key: %r" % expression)
+        values = None if value.strip() in ("", "*") else set(v.strip() for v in value.split("|"))
+        if key.endswith("*"):
+            prefixes.append((key[:-1], values))
+        elif key in keys and keys[key] is not None and values is not None:
+            keys[key] |= values
+        else:
+            keys[key] = None if key in keys and keys[key] is None else values
+    return keys, tuple(prefixes)
+
+
+def matches(k, v, keys, prefixes):
+    if k in keys:
+        values = keys[k]
+        if values is None or v in values:
+            return True
+    for prefix, values in prefixes:
+        if k.startswith(prefix) and (values is None or v in values):
+            return True
+    return False
+
+
+class TagFilter(object):
+    """
+    Keeps the elements whose tags match the include expressions and none of the exclude expressions
+
+    Args:
+        include(list) : the tag expressions of the elements kept, all the elements when empty
+        exclude(list) : the tag expressions of the elements dropped
+        tags(tuple) : the top level tags the filter applies to, other elements are dropped
+    """
+
+    def __init__(self, include=(), exclude=(), tags=("node", "way")):
+        self.include = compile_expressions(include) if include else None
+        self.exclude = compile_expressions(exclude) if exclude else None
+        self.tags = tags
+
+    def __call__(self, element):
+        """
+            This function decides if the parsed element is kept
+
+            Args:
+                element(element) : first parameter, the parsed top level element
+
+            Returns:
+                bool: True if the element is kept
+        """
+        if element.tag not in self.tags:
+            return False
+        include, exclude = self.include, self.exclude
+        # most nodes are bare geometry vertices without children
+        if not len(element):
+            return include is None
+        kept = include is None
+        for child in element:
+            if child.tag != "tag":
+                continue
+            attrib = child.attrib
+            k, v = attrib["k"], attrib["v"]
+            if exclude is not None and matches(k, v, *exclude):
+                return False
+            if not kept and matches(k, v, *include):
+                kept = True
+                if exclude is None:
+                    return True
+        return kept
+
+
+def all_filters(*filters):
+    """
+        This function combines element filters, an element is kept when every filter keeps it. The filters
+         are called in order until one drops the element, so a spatial_filter.SpatialFilter, which records
+         the ids it keeps, has to come first.
+    """
+    def keep(element):
+        for element_filter in filters:
+            if not element_filter(element):
+                return False
+        return True
+    return keep
+
+
+def main(argv=None):
+    import process_data
+    parser = argparse.ArgumentParser(description="Convert the elements of an osm file with matching tags to json")
+    parser.add_argument("file_in")
+    parser.add_argument("--include", action="append", default=[], help="tag expression, such as amenity=*")
+    parser.add_argument("--exclude", action="append", default=[], help="tag expression, such as building=no")
+    parser.add_argument("--bbox", help="min_lat,min_lon,max_lat,max_lon")
+    args = parser.parse_args(argv)
+    keep = TagFilter(args.include, args.exclude)
+    if args.bbox:
+        from spatial_filter import SpatialFilter
+        keep = all_filters(SpatialFilter([float(value) for value in args.bbox.split(",")]), keep)
+    count = process_data.process_data(args.file_in, stream=True, keep=keep)
+    print "%d documents written to %s.json" % (count, args.file_in)
+
+
+def test():
+    import os
+    import time
+    import tempfile
+    import xml.etree.ElementTree as ET
+    import process_data
+    import synthetic_osm
+    assert compile_expressions(["amenity", "cuisine=pizza|chinese", "cuisine=thai", "addr:*", "shop=*"]) == \
+        ({"amenity": None, "cuisine": set(["pizza", "chinese", "thai"]), "shop": None}, (("addr:", None),))
+    element = ET.fromstring('<node id="1"><tag k="amenity" v="cafe"/><tag k="cuisine" v="pizza"/></node>')
+    assert TagFilter(["amenity"])(element)
+    assert TagFilter(["cuisine=pizza"])(element) and not TagFilter(["cuisine=thai"])(element)
+    assert not TagFilter(["amenity"], ["cuisine=pizza"])(element)
+    assert TagFilter(exclude=["shop"])(element) and TagFilter()(element)
+    assert not TagFilter(["amenity"])(ET.fromstring('<node id="2"/>'))
+    assert not TagFilter(["amenity"])(ET.fromstring('<way id="3"><nd ref="1"/></way>'))
+    assert TagFilter(["addr:*"])(ET.fromstring('<way id="3"><tag k="addr:street" v="Main"/></way>'))
+    assert not TagFilter()(ET.fromstring('<relation id="4"/>'))
+
+    data = process_data.process_data("exercises/example.osm")
+    os.remove("exercises/example.osm.json")
+    raw_tags = [dict((tag.attrib["k"], tag.attrib["v"]) for tag in el.iter("tag"))
+                for el in process_data.iter_elements("exercises/example.osm", ("node", "way"))]
+    for include, exclude, predicate in (
+            (["amenity"], [], lambda tags: "amenity" in tags),
+            (["addr:*", "highway"], [], lambda tags: "highway" in tags or any(k.startswith("addr:") for k in tags)),
+            ([], ["highway=service|traffic_signals"], lambda tags: tags.get("highway") not in ("service", "traffic_signals"))):
+        kept = process_data.process_data("exercises/example.osm", keep=TagFilter(include, exclude))
+        os.remove("exercises/example.osm.json")
+        expected = [el for el, tags in zip(data, raw_tags) if predicate(tags)]
+        assert 0 < len(kept) == len(expected) < len(data) and kept == expected, (include, exclude)
+
+    file_in = tempfile.mktemp(suffix=".osm")
+    try:
+        synthetic_osm.generate(file_in, 12000000)
+        pois = sum(1 for el in process_data.iter_elements(file_in, ("node", "way"))
+                   if any(tag.attrib["k"] == "amenity" for tag in el.iter("tag")))
+        start = time.time()
+        process_data.process_data(file_in, stream=True)
+        full = time.time() - start
+        start = time.time()
+        assert 0 < process_data.process_data(file_in, stream=True, keep=TagFilter(["amenity"])) == pois
+        print "full %.2fs, POI only %.2fs" % (full, time.time() - start)
+    finally:
+        for name in (file_in, file_in + ".json"):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == "__main__":
+    main()